@@ -88,13 +88,17 @@ def create_app(config_class=Config):
     # Ensure upload directories exist (moved from config.py for app context)
     face_upload_folder = os.path.join(app.root_path, app.config['FACE_UPLOAD_FOLDER'])
     attendance_upload_folder = os.path.join(app.root_path, app.config['ATTENDANCE_UPLOAD_FOLDER'])
+    unknown_face_upload_folder = os.path.join(app.root_path, app.config['UNKNOWN_FACE_UPLOAD_FOLDER'])
     if not os.path.exists(face_upload_folder):
         os.makedirs(face_upload_folder)
     if not os.path.exists(attendance_upload_folder):
         os.makedirs(attendance_upload_folder)
+    if not os.path.exists(unknown_face_upload_folder):
+        os.makedirs(unknown_face_upload_folder)
     # Update config with absolute paths if needed elsewhere, though relative might be fine
     app.config['FACE_UPLOAD_FOLDER'] = face_upload_folder
     app.config['ATTENDANCE_UPLOAD_FOLDER'] = attendance_upload_folder
+    app.config['UNKNOWN_FACE_UPLOAD_FOLDER'] = unknown_face_upload_folder
 
     # Initialize extensions
     jwt.init_app(app)
@@ -109,6 +113,10 @@ def create_app(config_class=Config):
     app.register_blueprint(reports_bp, url_prefix='/api/reports')
     app.register_blueprint(password_reset, url_prefix='/api/password')
 
+    # Register CLI commands (face pipeline maintenance)
+    from .cli import register_commands
+    register_commands(app)
+
     @app.route('/')
     def hello():
         # Simple route for testing
@@ -0,0 +1,207 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import click
+import numpy as np
+
+from app.models.user import default_datetime
+from app.services import attendance_stats_service, data_service, enrollment_service, face_service
+
+STUDENTS_FILE = 'students.json'
+ATTENDANCE_DETAILS_FILE = 'attendance_details.json'
+
+
+def _load_fixture_faces(fixtures_dir):
+    """
+    Loads a labelled fixture set laid out as <fixtures_dir>/<label>/<image>.
+    Returns a list of (label, file_name, img_array, location) using the largest face of each image.
+    """
+    samples = []
+    for label in sorted(os.listdir(fixtures_dir)):
+        label_dir = os.path.join(fixtures_dir, label)
+        if not os.path.isdir(label_dir):
+            continue
+        for file_name in sorted(os.listdir(label_dir)):
+            if not face_service.allowed_file(file_name):
+                continue
+            with open(os.path.join(label_dir, file_name), 'rb') as f:
+                img_array = face_service.preprocess_image(f.read())
+            locations = face_service.detect_faces(img_array)
+            if not locations:
+                click.echo(f"  ! {label}/{file_name}: yüz bulunamadı, atlandı")
+                continue
+            largest = max(locations, key=lambda loc: (loc[2] - loc[0]) * (loc[1] - loc[3]))
+            samples.append((label, file_name, img_array, largest))
+    return samples
+
+
+def _leave_one_out_scores(labels, encodings, tolerance):
+    """Nearest-neighbour leave-one-out: correct accepts, false accepts and false rejects."""
+    known = np.asarray(encodings)
+    distances = np.linalg.norm(known[:, None, :] - known[None, :, :], axis=2)
+    np.fill_diagonal(distances, np.inf)
+    correct = false_accepts = false_rejects = 0
+    for i, label in enumerate(labels):
+        if labels.count(label) < 2:
+            continue # No genuine counterpart to find
+        nearest = int(distances[i].argmin())
+        if distances[i, nearest] > tolerance:
+            false_rejects += 1
+        elif labels[nearest] == label:
+            correct += 1
+        else:
+            false_accepts += 1
+    return correct, false_accepts, false_rejects
+
+
+def _face_photo_path(app, student):
+    """Absolute path of a student's stored face photo (face_photo_url holds the file name under FACE_UPLOAD_FOLDER)."""
+    return os.path.join(app.config['FACE_UPLOAD_FOLDER'], os.path.basename(student['face_photo_url'].strip('/')))
+
+
+def register_commands(app):
+    """Registers the face pipeline maintenance commands on the Flask CLI."""
+
+    @app.cli.command('benchmark-encoders')
+    @click.argument('fixtures_dir', type=click.Path(exists=True, file_okay=False))
+    @click.option('--jitters', default='1,5,10', show_default=True, help='Virgülle ayrılmış num_jitters değerleri.')
+    @click.option('--models', default='small,large', show_default=True, help='Virgülle ayrılmış landmark modelleri.')
+    @click.option('--tolerance', type=float, default=None, help='Eşleşme eşiği (varsayılan FACE_RECOGNITION_TOLERANCE).')
+    def benchmark_encoders(fixtures_dir, jitters, models, tolerance):
+        """
+        Kodlayıcı ayarlarının (num_jitters, landmark modeli) gecikme ve eşleşme doğruluğunu ölçer.
+        FIXTURES_DIR, etiket başına bir klasör içermelidir: <FIXTURES_DIR>/<etiket>/<fotoğraf>.
+        """
+        tolerance = tolerance if tolerance is not None else app.config.get('FACE_RECOGNITION_TOLERANCE', 0.6)
+        jitter_values = [int(j) for j in jitters.split(',') if j.strip()]
+        model_values = [m.strip() for m in models.split(',') if m.strip()]
+        for model in model_values:
+            if model not in face_service.LANDMARK_MODELS:
+                raise click.BadParameter(f"Geçersiz model: {model}", param_hint='--models')
+
+        samples = _load_fixture_faces(fixtures_dir)
+        labels = [label for label, _, _, _ in samples]
+        if len(samples) < 2:
+            raise click.ClickException("Karşılaştırma için en az iki yüz içeren fotoğraf gerekli.")
+        click.echo(f"{len(samples)} yüz, {len(set(labels))} etiket, eşik {tolerance}")
+        click.echo(f"{'model':<6} {'jitter':>6} {'ms/yüz':>9} {'doğru':>6} {'yanlış kabul':>13} {'yanlış red':>11}")
+
+        for model in model_values:
+            for num_jitters in jitter_values:
+                encodings = []
+                start = time.perf_counter()
+                for _, _, img_array, location in samples:
+                    encodings.extend(face_service.encode_faces(
+                        img_array, [location], num_jitters=num_jitters, model=model, use_cache=False
+                    ))
+                elapsed_ms = (time.perf_counter() - start) * 1000.0 / len(samples)
+                correct, false_accepts, false_rejects = _leave_one_out_scores(labels, encodings, tolerance)
+                click.echo(f"{model:<6} {num_jitters:>6} {elapsed_ms:>9.1f} {correct:>6} {false_accepts:>13} {false_rejects:>11}")
+
+    @app.cli.command('reencode-faces')
+    @click.option('--workers', type=int, default=None, help='İşçi süreç sayısı (varsayılan CPU sayısı).')
+    @click.option('--force', is_flag=True, help='Güncel sürümde olanlar dahil tüm öğrencileri yeniden kodla.')
+    @click.option('--limit', type=int, default=None, help='Bu çalıştırmada işlenecek en fazla öğrenci sayısı.')
+    def reencode_faces(workers, force, limit):
+        """
+        Kayıtlı yüz fotoğraflarını (FACE_UPLOAD_FOLDER) güncel kodlayıcı ayarlarıyla paralel olarak yeniden kodlar
+        ve her kodlamayı FACE_ENCODING_VERSION ile etiketler. Her öğrenci tamamlanınca kaydedilir; yarıda kalan
+        bir çalıştırma tekrar başlatıldığında güncel sürümdeki öğrenciler atlanır.
+        """
+        version = face_service.get_encoding_version()
+        students = data_service.read_data(STUDENTS_FILE)
+        pending = [s for s in students if s.get('face_photo_url') and (force or face_service.needs_reencoding(s))]
+        if limit:
+            pending = pending[:limit]
+        click.echo(f"Hedef sürüm {version}: {len(pending)} öğrenci yeniden kodlanacak.")
+        if not pending:
+            return
+
+        jobs = []
+        missing = 0
+        for student in pending:
+            photo_path = _face_photo_path(app, student)
+            if not os.path.exists(photo_path):
+                missing += 1
+                click.echo(f"  ! öğrenci {student['id']}: fotoğraf bulunamadı ({photo_path})")
+                continue
+            jobs.append((student['id'], photo_path))
+
+        done = failed = 0
+        start = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=workers or os.cpu_count(),
+                                 initializer=face_service._init_pipeline_worker) as pool:
+            futures = [pool.submit(face_service.reencode_face_photo, student_id, photo_path) for student_id, photo_path in jobs]
+            for future in as_completed(futures):
+                student_id, result, error = future.result()
+                if error or not result or not result['encodings']:
+                    failed += 1
+                    click.echo(f"  ! öğrenci {student_id}: {error or 'kodlama çıkarılamadı'}")
+                    continue
+                # Her sonuç hemen yazılır; böylece iş kesintiye uğrarsa kaldığı yerden devam eder
+                encodings = result['encodings']
+                data_service.update_item(STUDENTS_FILE, student_id, {
+                    'face_encodings': face_service.encode_encodings_for_json([np.asarray(e) for e in encodings]),
+                    'face_encoding_versions': [version] * len(encodings),
+                    'face_encoding_qualities': [result['quality']['score']] * len(encodings),
+                    **enrollment_service.template_reset_fields(), # Eski kodlamalara göre öğrenilmiş şablonlar karıştırılmaz
+                    'updated_at': default_datetime(),
+                })
+                done += 1
+                if done % 25 == 0:
+                    click.echo(f"  {done}/{len(jobs)} tamamlandı")
+
+        elapsed = time.perf_counter() - start
+        click.echo(f"Bitti: {done} yeniden kodlandı, {failed} başarısız, {missing} fotoğrafı eksik ({elapsed:.1f} sn).")
+
+    @app.cli.command('calibrate-thresholds')
+    @click.option('--student-id', 'student_ids', type=int, multiple=True, help='Sadece bu öğrenci(ler) için hesapla (tekrarlanabilir).')
+    def calibrate_thresholds(student_ids):
+        """
+        Öğrenci başına eşleşme eşiğini (match_threshold) kayıt kodlamalarından ve onaylanmış/düzeltilmiş
+        yoklama geçmişinden yeniden öğrenir. Eşiği olmayan öğrenciler FACE_RECOGNITION_TOLERANCE kullanır.
+        """
+        thresholds = enrollment_service.calibrate_match_thresholds(student_ids or None)
+        if not thresholds:
+            click.echo("Güncel sürümde yüz kodlaması olan öğrenci bulunamadı.")
+            return
+        values = sorted(thresholds.values())
+        click.echo(f"{len(thresholds)} öğrencinin eşiği güncellendi (en düşük {values[0]:.3f}, "
+                   f"ortanca {values[len(values) // 2]:.3f}, en yüksek {values[-1]:.3f}).")
+
+    @app.cli.command('rebuild-counters')
+    def rebuild_counters():
+        """
+        Yoklama kayıtlarındaki status_counts sayaçlarını ve öğrenci-ders katılım özetlerini (student_course_stats)
+        detaylardan yeniden hesaplar. Her ikisi de normalde yazım sırasında güncellenir; bu komut onlardan önce
+        oluşturulmuş kayıtlar içindir.
+        """
+        updated = data_service.rebuild_counters(ATTENDANCE_DETAILS_FILE)
+        click.echo(f"{updated} yoklama kaydının sayaçları yeniden hesaplandı.")
+        rows = attendance_stats_service.rebuild_stats()
+        click.echo(f"{rows} öğrenci-ders katılım özeti yeniden hesaplandı.")
+
+    @app.cli.command('enroll-faces')
+    @click.argument('archive', type=click.Path(exists=True, dir_okay=False))
+    @click.option('--workers', type=int, default=None, help='İşçi süreç sayısı (varsayılan BULK_ENROLLMENT_WORKERS / CPU sayısı).')
+    def enroll_faces(archive, workers):
+        """
+        ARCHIVE içindeki, öğrenci numarasıyla adlandırılmış fotoğraflardan (örn. 20231045.jpg) toplu yüz kaydı yapar.
+        Her dosyanın sonucu işlendikçe yazdırılır; kodlamalar sonunda tek seferde kaydedilir.
+        """
+        with open(archive, 'rb') as f:
+            try:
+                results = enrollment_service.bulk_enroll_faces(f.read(), workers=workers)
+            except ValueError as ve:
+                raise click.ClickException(str(ve))
+        for result in results:
+            if 'summary' in result:
+                summary = result['summary']
+                click.echo(f"Bitti: {summary['enrolled']}/{summary['total']} öğrenci kaydedildi, {summary['failed']} başarısız.")
+                if summary.get('error'):
+                    raise click.ClickException(summary['error'])
+            elif result['status'] == 'error':
+                click.echo(f"  ! {result['file']}: {result['message']}")
+            else:
+                click.echo(f"  {result['file']} -> öğrenci {result['student_id']}")
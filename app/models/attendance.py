@@ -15,7 +15,10 @@ class AttendanceDetail:
     confidence: Optional[float] = None
     emotion: Optional[str] = None
     emotion_confidence: Optional[float] = None
+    emotion_scores: Optional[List[float]] = None # Probabilities in face_service.EMOTION_LABELS order
     emotion_statistics: Optional[Dict[str, float]] = None
+    spoof_suspected: Optional[bool] = None # Liveness heuristics flagged the matched face (photo sessions)
+    spoof_reasons: Optional[List[str]] = None
     created_at: str = field(default_factory=default_datetime)
 
 @dataclass
@@ -30,9 +33,13 @@ class Attendance:
     
     # Default fields last
     photo_path: Optional[str] = None
+    photo_paths: List[str] = field(default_factory=list) # Multi-photo sessions; photo_path is the first
+    source: Optional[str] = None # "VIDEO" or "ARCHIVE" for frame-sequence sessions, None for photos
+    frame_count: Optional[int] = None # Sampled frames processed for frame-sequence sessions
     total_students: Optional[int] = None # Number of students registered for the course at this time
     recognized_students: Optional[int] = None
     unrecognized_students: Optional[int] = None
+    status_counts: Optional[Dict[str, int]] = None # PRESENT/ABSENT/LATE/EXCUSED, maintained by data_service on detail writes
     emotion_statistics: Optional[Dict[str, int]] = None # Overall stats for the session
     created_at: str = field(default_factory=default_datetime)
     # details: List[AttendanceDetail] = field(default_factory=list) # Or load separately
@@ -45,5 +52,5 @@ class EmotionHistory:
     emotion: str
     confidence: float
     timestamp: str # ISO format datetime string
-    # Might link to attendance_id or attendance_detail_id if needed
-    # attendance_detail_id: Optional[int] = None 
\ No newline at end of file
+    attendance_id: Optional[int] = None # Session the emotion was observed in
+    emotion_scores: Optional[List[float]] = None # Probabilities in face_service.EMOTION_LABELS order 
\ No newline at end of file
@@ -25,6 +25,7 @@ class Course:
     name: str
     teacher_id: int
     semester: str
+    default_attributes: Optional[List[str]] = None # e.g. ["emotion"]; None uses ATTENDANCE_DEFAULT_ATTRIBUTES
     created_at: str = field(default_factory=default_datetime)
     updated_at: str = field(default_factory=default_datetime)
     # lesson_times: List[LessonTime] = field(default_factory=list) # Or load separately
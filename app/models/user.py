@@ -43,7 +43,16 @@ class Student:
     student_number: str
     department: str
     face_encodings: Optional[str] = None # Stored as JSON string or similar
+    face_encoding_versions: List[str] = field(default_factory=list) # FACE_ENCODING_VERSION per encoding
+    face_encoding_qualities: List[float] = field(default_factory=list) # Enrollment photo quality (0-1) per encoding
+    match_threshold: Optional[float] = None # Learned match tolerance, see face_service.compute_match_threshold
+    template_encodings: Optional[str] = None # Adaptive templates from confirmed attendance matches (JSON, bounded)
+    template_version: Optional[str] = None # FACE_ENCODING_VERSION of the templates
+    template_seen: int = 0 # Confirmed matches offered to the template reservoir
+    template_attendance_ids: List[Optional[int]] = field(default_factory=list) # Session each template came from
     face_photo_url: Optional[str] = None
+    estimated_age: Optional[int] = None # Estimated from the face photo at upload time
+    estimated_gender: Optional[str] = None
     created_at: str = field(default_factory=default_datetime)
     updated_at: str = field(default_factory=default_datetime)
     # user: Optional[User] = None 
\ No newline at end of file
@@ -3,24 +3,22 @@ from flask import Blueprint, request, jsonify, current_app
 from pydantic import ValidationError
 from werkzeug.utils import secure_filename
 import datetime
+import tempfile
 import traceback # Detaylı hata loglama için
 import cv2 # OpenCV for image cropping
-import numpy as np # NumPy for array operations
 from collections import Counter # For counting emotions
-from PIL import Image # To read image from filestorage
-import io # To read image from filestorage
-import face_recognition # Import face_recognition
 from flask_jwt_extended import jwt_required # Import jwt_required
 
-from app.services import data_service, face_service # Removed file_service import
+from app.services import data_service, enrollment_service, face_service, unknown_face_service, attendance_stats_service # Removed file_service import
 # from app.services import emotion_service # Uygulanınca import edilecek
 from app.schemas.attendance import (
     AttendanceResponse, AttendanceCreate, AttendanceDetailResponse, 
-    AttendanceManualUpdate, AttendanceResultSummary, AttendanceResultDetail # Renamed from AttendanceResponseSummary
+    AttendanceManualUpdate, AttendanceResultSummary, AttendanceResultDetail, # Renamed from AttendanceResponseSummary
+    AttendanceVideoCreate
 )
 from app.schemas.user import StudentResponse # For student details
 from app.models.attendance import Attendance, AttendanceDetail, default_datetime
-from app.utils.auth import teacher_required, get_jwt_identity, self_or_admin_required, get_current_user_role_and_id
+from app.utils.auth import teacher_required, admin_required, get_jwt_identity, self_or_admin_required, get_current_user_role_and_id
 
 attendance_bp = Blueprint('attendance_bp', __name__)
 
@@ -30,6 +28,7 @@ STUDENT_COURSE_FILE = 'student_course.json'
 ATTENDANCE_FILE = 'attendance.json'
 ATTENDANCE_DETAILS_FILE = 'attendance_details.json'
 EMOTION_HISTORY_FILE = 'emotion_history.json' # Duygu geçmişi kullanılırsa eklenecek
+TEMPLATE_CANDIDATES_FILE = 'template_candidates.json'
 TEACHERS_FILE = 'teachers.json'
 USERS_FILE = 'users.json' # USERS_FILE tanımı eklendi
 
@@ -38,19 +37,16 @@ def _get_attendance_details(attendance_dict):
     if not attendance_dict:
         return None
     details = data_service.find_many(ATTENDANCE_DETAILS_FILE, attendance_id=attendance_dict.get('id'))
-    # İsteğe bağlı: Detayları öğrenci bilgileriyle zenginleştir
+    # Öğrenciler ve kullanıcılar satır başına find_one yerine tek okumada birleştirilir
+    # (oturum büyüklüğünden bağımsız olarak toplam üç dosya okuması)
+    data_service.join(details, STUDENTS_FILE, 'student_id') # detail['student']
+    data_service.join([detail['student'] for detail in details if detail['student']], USERS_FILE, 'user_id') # student['user']
     detailed_list = []
     for detail in details:
-        student = data_service.find_one(STUDENTS_FILE, id=detail.get('student_id'))
+        student = detail.pop('student')
         if student:
-             # Varsa ve gerekliyse students rotasından yardımcı fonksiyonu kullan
-             # from app.routes.students import _get_student_with_user 
-             # detail['student'] = _get_student_with_user(student)
-             # Veya sadece temel bilgileri ekle
-             student.pop('password_hash', None)
-             student.pop('face_encodings', None)
              # Yanıtta sadece gerekli temel öğrenci bilgilerini döndür
-             user = data_service.find_one(USERS_FILE, id=student.get('user_id'))
+             user = student.get('user')
              user_info = None
              if user:
                  user_info = {
@@ -70,99 +66,12 @@ def _get_attendance_details(attendance_dict):
     return attendance_dict
 
 
-@attendance_bp.route('/', methods=['POST'])
-@teacher_required
-def create_attendance():
-    """
-    Bir fotoğraf yükleyerek ve yüzleri işleyerek yeni bir yoklama kaydı oluşturur.
-    Yalnızca dersin öğretmeni yoklama alabilir (veya Admin).
-    ---
-    tags:
-      - Yoklama (Attendance)
-    security:
-      - Bearer: []
-    parameters:
-      - in: formData
-        name: file
-        type: file
-        required: true
-        description: Yoklama alınacak sınıfın fotoğrafı.
-      - in: formData
-        name: course_id
-        type: integer
-        required: true
-        description: Yoklamanın ait olduğu dersin ID'si.
-        example: 1
-      - in: formData
-        name: date
-        type: string
-        format: date
-        required: true
-        description: Yoklamanın alındığı tarih (YYYY-AA-GG formatında).
-        example: "2024-05-20"
-      - in: formData
-        name: lesson_number
-        type: integer
-        required: true
-        description: Yoklamanın ait olduğu ders saati numarası (örn. 1, 2).
-        example: 1
-      - in: formData
-        name: type
-        type: string
-        required: true
-        enum: ["FACE", "EMOTION", "FACE_EMOTION"]
-        description: Yoklama türü (Şimdilik sadece FACE destekleniyor).
-        example: "FACE"
-    responses:
-      201:
-        description: Yoklama başarıyla oluşturuldu ve yüzler işlendi. Tanınan ve tanınmayan öğrenci sayıları döndürülür.
-        schema:
-          $ref: '#/definitions/AttendanceResultSummary' # Önceden tanımlanmış veya global şema
-        examples:
-          application/json:
-            attendance_id: 25
-            recognized_count: 18
-            unrecognized_count: 2
-            results:
-              - student_id: 5
-                status: "PRESENT"
-                confidence: 0.95
-                emotion: null
-                emotion_confidence: null
-              - student_id: 12
-                status: "ABSENT"
-                confidence: null
-                emotion: null
-                emotion_confidence: null
-              # ... (diğer öğrenciler)
-      400:
-        description: Geçersiz istek (eksik dosya, eksik form alanı, geçersiz veri formatı, desteklenmeyen dosya türü, resimde yüz bulunamadı).
-      401:
-        description: Yetkisiz (Geçerli JWT token sağlanmadı).
-      403:
-        description: Yasak (Kullanıcı dersin öğretmeni veya Admin değil).
-      404:
-        description: Ders veya derse kayıtlı öğrenci bulunamadı.
-      500:
-        description: Sunucu hatası (Resim işleme hatası, veritabanı yazma hatası).
-    """
-    # --- Mevcut kullanıcı rolünü ve INT ID'sini al --- 
-    current_role, current_user_id = get_current_user_role_and_id() 
-    if current_role is None or current_user_id is None:
-         return jsonify({"message": "Geçersiz token kimliği veya kullanıcı bulunamadı"}), 401
-    # --- Bitiş --- 
-
-    # --- 1. Form Verisini & Dosyayı Doğrula --- 
-    if 'file' not in request.files:
-        return jsonify({"message": "İstekte dosya bölümü yok"}), 400
-    file = request.files['file']
-    if file.filename == '':
-        return jsonify({"message": "Seçili dosya yok"}), 400
-
+def _parse_attendance_form(schema_class):
+    """Yardımcı fonksiyon: Yoklama form alanlarını doğrular. (girdi, None) veya (None, hata_yanıtı) döndürür."""
     form_data = request.form.to_dict()
     try:
         # Form alanlarını doğrulamak için Pydantic modelini kullan (dosya hariç)
-        attendance_input = AttendanceCreate(**form_data)
+        return schema_class(**form_data), None
     except ValidationError as e:
         # Pydantic hatalarını daha okunabilir formatta döndür
         error_details = []
@@ -170,12 +79,14 @@ def create_attendance():
              field = ".".join(map(str, error.get('loc', [])))
              message = error.get('msg', 'Bilinmeyen hata')
              error_details.append({"field": field, "message": message})
-        return jsonify({"message": "Geçersiz form verisi", "errors": error_details}), 400
+        return None, (jsonify({"message": "Geçersiz form verisi", "errors": error_details}), 400)
     except Exception as e: # Olası tarih ayrıştırma hatalarını vb. yakala.
-         return jsonify({"message": f"Geçersiz form verisi: {e}"}), 400
+         return None, (jsonify({"message": f"Geçersiz form verisi: {e}"}), 400)
 
-    # --- 2. İzinleri ve Ders/Saat Geçerliliğini Kontrol Et --- 
-    course = data_service.find_one(COURSES_FILE, id=attendance_input.course_id)
+
+def _check_attendance_permission(course_id, current_role, current_user_id):
+    """Yardımcı fonksiyon: Kullanıcının ders için yoklama alabildiğini doğrular. Hata yanıtı veya None döndürür."""
+    course = data_service.find_one(COURSES_FILE, id=course_id)
     if not course:
         return jsonify({"message": "Ders bulunamadı"}), 404
     
@@ -188,210 +99,120 @@ def create_attendance():
     
     if not is_teacher_of_course and not is_admin: 
         return jsonify({"message": "Yasak: Sadece dersin öğretmeni veya admin yoklama alabilir."}), 403
+    return None
 
-    # İsteğe bağlı: lesson_number'ı dersin/tarihin mevcut ders saatlerine göre doğrula
-    # lesson_time = data_service.find_one(LESSON_TIMES_FILE, course_id=course_id, lesson_number=lesson_number)
-    # if not lesson_time: return jsonify(...), 404
-
-    # --- 3. Resmi İşle: Yüzleri Bul & Kodlamaları Çıkar --- 
-    face_locations = []
-    image_encodings = []
-    img_array = None # Initialize img_array
-    face_analysis_results = [] # Store analysis results for each detected face
-    all_detected_emotions = [] # Collect all emotions for stats
 
-    try:
-        if not face_service.allowed_file(file.filename):
-             allowed_ext_str = ", ".join(face_service.ALLOWED_EXTENSIONS)
-             return jsonify({"message": f"Dosya türüne izin verilmiyor. İzin verilenler: {allowed_ext_str}"}), 400
-
-        # Read the image file into memory (once)
-        file.seek(0)
-        img_bytes = file.read()
-        img = Image.open(io.BytesIO(img_bytes))
-        # Convert PIL image to numpy array (RGB format)
-        # Ensure image is in RGB format for face_recognition and potentially DeepFace
-        img_array = np.array(img.convert('RGB')) 
-
-        # Find face locations (use the same array)
-        # model can be 'cnn' or 'hog'
-        face_locations = face_recognition.face_locations(img_array, model="hog")
-
-        if not face_locations:
-            return jsonify({"message": "Yüklenen resimde yüz tespit edilemedi."}), 400
-            
-        current_app.logger.info(f"{attendance_input.course_id} ID'li ders için yüklenen yoklama fotoğrafında {len(face_locations)} yüz bulundu.")
-
-        # Extract face encodings for the found locations
-        image_encodings = face_recognition.face_encodings(img_array, known_face_locations=face_locations)
-        
-        # --- Perform Age/Gender/Emotion Analysis for each detected face --- 
-        if attendance_input.type in ["EMOTION", "FACE_EMOTION"]: # Only analyze if requested
-            current_app.logger.info(f"Performing analysis (age, gender, emotion) for {len(face_locations)} faces...")
-            actions_to_perform = ['age', 'gender', 'emotion']
-            for i, (top, right, bottom, left) in enumerate(face_locations):
-                # Crop the face from the image (NumPy slicing)
-                # Add some padding maybe? For now, use exact coordinates
-                face_image = img_array[top:bottom, left:right]
-                
-                # Analyze the cropped face
-                # Pass the NumPy array directly
-                analysis_result = face_service.analyze_face_attributes(face_image, actions=actions_to_perform)
-                face_analysis_results.append(analysis_result) # Store result (or None if failed)
-                
-                if analysis_result and analysis_result.get('emotion'):
-                    all_detected_emotions.append(analysis_result['emotion'])
-                    current_app.logger.debug(f"Face {i}: Analysis Result: {analysis_result}")
-                else:
-                     current_app.logger.debug(f"Face {i}: Analysis failed or no emotion detected.")
-            current_app.logger.info(f"Analysis complete. Found emotions: {len(all_detected_emotions)}")
-        else:
-             # Ensure face_analysis_results has the same length as face_locations, filled with None
-             face_analysis_results = [None] * len(face_locations)
+def _resolve_attribute_actions(attendance_input):
+    """
+    Yardımcı fonksiyon: Yoklamada analiz edilecek yüz özelliklerini belirler.
+    Sadece EMOTION/FACE_EMOTION türlerinde analiz yapılır; öncelik sırası istek, dersin
+    default_attributes alanı, ardından ATTENDANCE_DEFAULT_ATTRIBUTES ayarıdır.
+    """
+    if attendance_input.type not in ["EMOTION", "FACE_EMOTION"]:
+        return []
+    if attendance_input.attributes is not None:
+        return attendance_input.attributes
+    course = data_service.find_one(COURSES_FILE, id=attendance_input.course_id)
+    if course and course.get('default_attributes') is not None:
+        return course['default_attributes']
+    return current_app.config.get('ATTENDANCE_DEFAULT_ATTRIBUTES', ['emotion'])
 
-    except ValueError as ve: # face_service'den dosya türü hatası
-        return jsonify({"message": str(ve)}), 400 
-    except Exception as e:
-        current_app.logger.error(f"Yoklama resmi işlenirken veya analiz edilirken hata: {e}\n{traceback.format_exc()}")
-        return jsonify({"message": "Yoklama resmi işlenirken veya analiz edilirken hata oluştu."}), 500
 
-    # --- 4. Kayıtlı Öğrencileri ve Kodlamalarını Al --- 
-    enrollments = data_service.find_many(STUDENT_COURSE_FILE, course_id=attendance_input.course_id)
+def _load_enrolled_encodings(course_id):
+    """
+    Yardımcı fonksiyon: Derse kayıtlı öğrencileri ve bilinen yüz kodlamalarını yükler.
+    ((öğrenci_idleri, öğrenciler, bilinen_yüzler), None) veya hata durumunda (None, hata_yanıtı) döndürür.
+    bilinen_yüzler, face_service.match_faces'e doğrudan verilebilecek anahtarları içerir.
+    """
+    enrollments = data_service.find_many(STUDENT_COURSE_FILE, course_id=course_id)
     enrolled_student_ids = [enrollment['student_id'] for enrollment in enrollments]
 
     if not enrolled_student_ids:
-        return jsonify({"message": "Bu derse kayıtlı öğrenci bulunamadı."}), 404
+        return None, (jsonify({"message": "Bu derse kayıtlı öğrenci bulunamadı."}), 404)
 
     all_students = data_service.read_data(STUDENTS_FILE)
     enrolled_students = [s for s in all_students if s['id'] in enrolled_student_ids]
     
     known_encodings = []
     student_id_map = [] # Hangi ID'nin hangi bilinen kodlama indeksine karşılık geldiğini takip et
+    known_qualities = [] # Her kodlamanın kayıt fotoğrafı kalite puanı (eşleştirmede ağırlık)
+    known_tolerances = [] # Öğrenciye özel öğrenilmiş eşik (match_threshold), yoksa genel tolerans
+    stale_students = 0 # Kodlamaları farklı bir sürümle üretilmiş öğrenciler (karşılaştırılmaz)
     for student in enrolled_students:
         encoding_str = student.get('face_encodings')
         if encoding_str:
             try:
-                decoded = face_service.decode_encodings_from_json(encoding_str)
+                # Sadece güncel FACE_ENCODING_VERSION ile üretilmiş kodlamalar karşılaştırılır
+                # Onaylanmış eşleşmelerden öğrenilen uyarlanabilir şablonlar da karşılaştırılır
+                decoded, qualities = face_service.get_current_encodings(student, with_qualities=True, include_templates=True)
                 if decoded:
                     known_encodings.extend(decoded) # Öğrenci için tüm bilinen kodlamaları ekle
                     student_id_map.extend([student['id'] for _ in decoded])
+                    known_qualities.extend(qualities)
+                    known_tolerances.extend([student.get('match_threshold')] * len(decoded))
+                else:
+                    stale_students += 1
+                    current_app.logger.warning(f"Öğrenci {student['id']} için güncel sürümde ({face_service.get_encoding_version()}) yüz kodlaması yok. 'flask reencode-faces' çalıştırılmalı.")
             except Exception as decode_e:
                  current_app.logger.error(f"Öğrenci {student['id']} için yüz kodlaması çözülürken hata: {decode_e}")
         else:
             current_app.logger.warning(f"Öğrenci {student['id']} için kayıtlı yüz verisi yok. Tanınamaz.")
             
     if not known_encodings:
-         return jsonify({"message": "Derse kayıtlı öğrencilerin hiçbirinde kayıtlı yüz verisi bulunamadı."}), 400
-
-    # --- 5. Yüzleri Karşılaştır, Analiz Sonuçlarını Eşleştir --- 
-    # Store details per recognized student { student_id: {'confidence': float, 'analysis': dict_or_none} }
-    recognized_student_details = {} 
-    # Keep track of which image encoding index maps to which best match student
-    encoding_match_map = {} # { encoding_index: student_id }
+         if stale_students:
+             return None, (jsonify({"message": "Derse kayıtlı öğrencilerin yüz kodlamaları eski bir model sürümüne ait. Yeniden kodlama (flask reencode-faces) gerekli."}), 400)
+         return None, (jsonify({"message": "Derse kayıtlı öğrencilerin hiçbirinde kayıtlı yüz verisi bulunamadı."}), 400)
+
+    # match_faces / aggregate_track_identities anahtar kelime argümanları olarak kullanılır
+    known_faces = {
+        'known_encodings': known_encodings,
+        'known_labels': student_id_map,
+        'known_qualities': known_qualities,
+        'known_tolerances': known_tolerances,
+    }
+    return (enrolled_student_ids, enrolled_students, known_faces), None
 
-    face_recognition_tolerance = current_app.config.get('FACE_RECOGNITION_TOLERANCE', 0.6)
 
-    # Iterate through detected faces (encodings and their analysis results)
-    for idx, img_encoding in enumerate(image_encodings):
-        matches = []
-        distances = []
-        if known_encodings:
-            matches = face_service.compare_faces(known_encodings, img_encoding, tolerance=face_recognition_tolerance)
-            distances = face_service.face_distance(known_encodings, img_encoding)
-        
-        best_match_index = -1
-        min_distance = 1.0 
-
-        for i, match in enumerate(matches):
-            if match and distances[i] < min_distance:
-                # Check if this known encoding (student) has already been matched with a *better* distance by another face
-                prospective_student_id = student_id_map[i]
-                existing_match = recognized_student_details.get(prospective_student_id)
-                if not existing_match or distances[i] < (1.0 - existing_match['confidence']): # Compare distances
-                    min_distance = distances[i]
-                    best_match_index = i
-        
-        if best_match_index != -1:
-            recognized_student_id = student_id_map[best_match_index]
-            confidence = max(0.0, 1.0 - min_distance)
-            current_analysis = face_analysis_results[idx] # Get analysis for this face
-            
-            # If this student is already recognized, only update if current match is better
-            existing_match = recognized_student_details.get(recognized_student_id)
-            if not existing_match or confidence > existing_match['confidence']:
-                recognized_student_details[recognized_student_id] = {
-                    'confidence': confidence,
-                    'analysis': current_analysis
-                }
-                encoding_match_map[idx] = recognized_student_id # Store which encoding matched this student best
-                current_app.logger.info(f"Student {recognized_student_id} matched (Conf: {confidence:.4f}) with face {idx}. Analysis: {current_analysis}")
-            else:
-                current_app.logger.info(f"Student {recognized_student_id} already matched with better confidence ({existing_match['confidence']:.4f}). Skipping face {idx} match (Conf: {confidence:.4f}).")
-        else:
-             # Face did not match any known student well enough
-             log_min_distance = min(distances) if distances else 'N/A'
-             current_app.logger.info(f"Face {idx} did not match known students (min distance: {log_min_distance}). Analysis: {face_analysis_results[idx]}")
-             # If no match, the analysis result for this face isn't associated with a student
-
-    # --- Calculate Overall Emotion Statistics --- 
-    emotion_statistics = dict(Counter(all_detected_emotions)) if all_detected_emotions else None
-    current_app.logger.info(f"Overall Emotion Stats: {emotion_statistics}")
-
-    # --- 6. Yoklama Kayıtlarını Oluştur (Ana ve Detaylar) --- 
+def _persist_attendance(attendance_input, current_user_id, enrolled_student_ids, enrolled_students,
+                        recognized_student_details, emotion_statistics, photo_urls=None, saved_photo_paths=None,
+                        extra_record_fields=None, summary_fields=None, attributes=None, unknown_faces=None):
+    """
+    Yardımcı fonksiyon: Ana yoklama kaydını ve tüm kayıtlı öğrenciler için detayları oluşturur.
+    Hata durumunda oluşturulan kayıtları ve kaydedilen fotoğrafları geri alır.
+    recognized_student_details: { student_id: {'confidence': float, 'encoding': kodlama, 'analysis': dict_or_none} }
+    attributes: Analiz edilen yüz özellikleri; hesaplanmayan özellikler detay kayıtlarına yazılmaz.
+    unknown_faces: Hiçbir öğrenciyle eşleşmeyen yüzlerin (kodlamalar, kırpımlar); dersin bilinmeyen yüz kümelerine eklenir.
+    Flask yanıtı (yanıt, durum_kodu) döndürür.
+    """
     now = default_datetime()
     attendance_id = data_service.get_next_id(ATTENDANCE_FILE)
     recognized_count = len(recognized_student_details) # Count of unique students recognized
     total_enrolled = len(enrolled_student_ids)
     absent_count = total_enrolled - recognized_count 
 
-    # --- Yoklama Fotoğrafını Kaydet --- 
-    photo_url = None
-    saved_photo_path = None
-    try:
-        file_extension = file.filename.rsplit('.', 1)[1].lower() if '.' in file.filename else 'jpg'
-        filename = secure_filename(f"attendance_{attendance_input.course_id}_{attendance_input.date.isoformat()}_{attendance_input.lesson_number}_{datetime.datetime.now().strftime('%H%M%S')}.{file_extension}")
-        upload_dir = current_app.config.get('ATTENDANCE_UPLOAD_FOLDER')
-        if not upload_dir:
-             raise ValueError("ATTENDANCE_UPLOAD_FOLDER yapılandırılmamış.")
-        if not os.path.exists(upload_dir): os.makedirs(upload_dir)
-        file_path = os.path.join(upload_dir, filename)
-        
-        file.seek(0) 
-        file.save(file_path)
-        saved_photo_path = file_path # Potansiyel silme için tam yolu sakla
-        # Web erişimi için göreceli URL oluştur (örn. /uploads/attendance/dosya.jpg)
-        # Bu URL'nin uygulamanızın statik dosya sunumuyla eşleştiğinden emin olun
-        static_url_path = current_app.static_url_path or '' # Genellikle /static
-        relative_upload_dir = os.path.relpath(upload_dir, current_app.static_folder if current_app.static_folder else current_app.root_path)
-        photo_url = f"{static_url_path}/{relative_upload_dir}/{filename}".replace("\\", "/").replace("//", "/") # Windows ve çift // düzeltmesi
-         
-        current_app.logger.info(f"Yoklama fotoğrafı kaydedildi: {saved_photo_path}, URL: {photo_url}")
-    except Exception as e:
-        current_app.logger.error(f"Yoklama fotoğrafı kaydedilemedi: {e}")
-        photo_url = None 
-        saved_photo_path = None
-        # Hata durumunda devam etmeli mi? Yoksa 500 döndürmeli mi?
-        # Şimdilik devam et, fotoğrafsız bir kayıt oluşsun.
-    # --- Fotoğraf Kaydetme Sonu --- 
-
     main_attendance_record = {
         "id": attendance_id,
         "course_id": attendance_input.course_id,
         "date": attendance_input.date.isoformat(),
         "lesson_number": attendance_input.lesson_number,
         "type": attendance_input.type.upper(),
-        "photo_path": photo_url,
+        "photo_path": photo_urls[0] if photo_urls else None,
+        "photo_paths": photo_urls or [],
         "total_students": total_enrolled, 
         "recognized_students": recognized_count,
         "unrecognized_students": absent_count,
+        "status_counts": dict.fromkeys(data_service.ATTENDANCE_STATUSES, 0), # Detaylar eklendikçe data_service tarafından artırılır
         "emotion_statistics": emotion_statistics, # Add overall stats here
         "created_by": current_user_id,
         "created_at": now,
         "updated_at": now
     }
+    main_attendance_record.update(extra_record_fields or {})
 
     created_main_record_dict = None
     created_detail_ids = []
+    created_history_count = 0
+    stats_recorded = False
     final_summary_results = [] # Use AttendanceResultDetail structure
 
     try:
@@ -418,44 +239,67 @@ def create_attendance():
                 if user['id'] in user_ids:
                     users_dict[user['id']] = user
         
+        detail_records = []
+        emotion_history_records = []
         for student_id in enrolled_student_ids:
             status = "ABSENT"
             confidence = None
             emotion = None
+            emotion_confidence = None
+            emotion_scores = None
             estimated_age = None
             estimated_gender = None
+            student_emotion_statistics = None
+            liveness = None
 
             student_match_details = recognized_student_details.get(student_id)
             if student_match_details:
                 status = "PRESENT"
                 confidence = student_match_details['confidence']
+                liveness = student_match_details.get('liveness')
+                student_emotion_statistics = student_match_details.get('emotion_statistics')
                 analysis = student_match_details['analysis']
                 if analysis:
                     emotion = analysis.get('emotion')
+                    emotion_confidence = analysis.get('emotion_confidence')
+                    emotion_scores = analysis.get('emotion_scores')
                     estimated_age = analysis.get('age')
                     estimated_gender = analysis.get('gender')
             
-            # Create detail record for database
+            # Create detail record for database (only the attributes that were analyzed)
             detail_record = {
                 "attendance_id": attendance_id,
                 "student_id": student_id,
                 "status": status,
                 "confidence": confidence,
-                "emotion": emotion,
-                "estimated_age": estimated_age, # Save to DB
-                "estimated_gender": estimated_gender, # Save to DB
-                # "emotion_confidence": None, # Add if available from analysis
-                # "emotion_statistics": None, # Per-student stats if needed
                 "created_at": now,
                 "updated_at": now
             }
-            try:
-                created_detail = data_service.add_item(ATTENDANCE_DETAILS_FILE, detail_record)
-                created_detail_ids.append(created_detail['id'])
-                current_app.logger.debug(f"Öğrenci {student_id} için yoklama detayı kaydedildi (Durum: {status}) - ID: {created_detail['id']}")
-            except Exception as detail_e:
-                 current_app.logger.error(f"Öğrenci {student_id} için yoklama detayı kaydedilemedi (Yoklama ID: {attendance_id}): {detail_e}")
-                 raise detail_e 
+            if 'emotion' in (attributes or []):
+                detail_record["emotion"] = emotion
+                detail_record["emotion_confidence"] = emotion_confidence
+                detail_record["emotion_scores"] = emotion_scores # Fixed order, see face_service.EMOTION_LABELS
+                detail_record["emotion_statistics"] = student_emotion_statistics # Per-student distribution (video sessions)
+            if 'age' in (attributes or []):
+                detail_record["estimated_age"] = estimated_age # Save to DB
+            if 'gender' in (attributes or []):
+                detail_record["estimated_gender"] = estimated_gender # Save to DB
+            if liveness:
+                # Şüpheli eşleşmeler öğretmenin incelemesi için işaretlenir, yoklama durumu değiştirilmez
+                detail_record["spoof_suspected"] = liveness['suspicious']
+                detail_record["spoof_reasons"] = liveness['reasons']
+            detail_records.append(detail_record)
+
+            if emotion and emotion_confidence is not None:
+                emotion_history_records.append({
+                    "student_id": student_id,
+                    "course_id": attendance_input.course_id,
+                    "attendance_id": attendance_id,
+                    "emotion": emotion,
+                    "confidence": emotion_confidence,
+                    "emotion_scores": emotion_scores,
+                    "timestamp": now
+                })
 
             # Öğrenci ve kullanıcı bilgilerini al
             student_info = None
@@ -479,22 +323,50 @@ def create_attendance():
                 status=status,
                 confidence=confidence,
                 emotion=emotion,
+                emotion_confidence=emotion_confidence,
+                emotion_scores=emotion_scores,
                 estimated_age=estimated_age,
                 estimated_gender=estimated_gender,
+                emotion_statistics=student_emotion_statistics,
+                spoof_suspected=liveness['suspicious'] if liveness else None,
+                spoof_reasons=liveness['reasons'] if liveness else None,
                 student=student_info  # Öğrenci bilgilerini ekle
             )
             final_summary_results.append(summary_detail)
 
+        # Detayları ve duygu geçmişini tek yazma işlemiyle kaydet (öğrenci başına ayrı yazma yerine)
+        created_details = data_service.add_items(ATTENDANCE_DETAILS_FILE, detail_records)
+        created_detail_ids = [detail['id'] for detail in created_details]
+        current_app.logger.info(f"Yoklama ID {attendance_id} için {len(created_detail_ids)} detay kaydı eklendi.")
+        # Öğrenci-ders katılım özetleri (student_course_stats) oturum başına tek yazmayla güncellenir
+        attendance_stats_service.record_session(attendance_input.course_id, main_attendance_record['date'], created_details)
+        stats_recorded = True
+        created_history_count = len(data_service.add_items(EMOTION_HISTORY_FILE, emotion_history_records))
+
+        # Eşleşen yüz kodlamaları öğrencilerin uyarlanabilir şablonlarını besler; hata yoklamayı geri almaz
+        try:
+            enrollment_service.record_attendance_matches(attendance_input.course_id, attendance_id, recognized_student_details)
+        except Exception as template_e:
+            current_app.logger.error(f"Yoklama ID {attendance_id} için yüz şablonları güncellenemedi: {template_e}")
+
         # Adım 6c: Başarılı yanıt özetini hazırla (using AttendanceResultSummary)
         response_summary = AttendanceResultSummary(
             attendance_id=attendance_id,
             recognized_count=recognized_count,
             unrecognized_count=absent_count,
             total_students=total_enrolled,  # Toplam öğrenci sayısını ekle
+            **(summary_fields or {}),
             emotion_statistics=emotion_statistics, # Add overall stats to summary
             results=final_summary_results # Pass the list of AttendanceResultDetail objects
         )
         current_app.logger.info(f"Yoklama ID {attendance_id} için oluşturma başarılı")
+
+        # Eşleşmeyen yüzler oturumlar arası kümelenir (kayıtsız tekrar eden katılımcılar); hata yoklamayı etkilemez
+        if unknown_faces and unknown_faces[0]:
+            try:
+                unknown_face_service.record_unknown_faces(attendance_input.course_id, attendance_id, *unknown_faces)
+            except Exception as unknown_e:
+                current_app.logger.error(f"Yoklama ID {attendance_id} için bilinmeyen yüzler kaydedilemedi: {unknown_e}")
         # Pydantic models are automatically converted to dicts by jsonify
         return jsonify(response_summary.dict()), 201 
 
@@ -506,11 +378,11 @@ def create_attendance():
         # 1. Başarıyla oluşturulan detay kayıtlarını sil
         if created_detail_ids:
             current_app.logger.warning(f"Deleting {len(created_detail_ids)} created attendance detail records.")
-            deleted_detail_count = 0
-            for detail_id in created_detail_ids:
-                if data_service.delete_item(ATTENDANCE_DETAILS_FILE, detail_id):
-                    deleted_detail_count += 1
+            deleted_detail_count = data_service.delete_many(ATTENDANCE_DETAILS_FILE, attendance_id=attendance_id)
             current_app.logger.warning(f"Deleted {deleted_detail_count} detail records during rollback.")
+        if created_history_count:
+            data_service.delete_many(EMOTION_HISTORY_FILE, attendance_id=attendance_id)
+        data_service.delete_many(TEMPLATE_CANDIDATES_FILE, attendance_id=attendance_id)
             
         # 2. Oluşturulduysa ana yoklama kaydını sil
         if created_main_record_dict:
@@ -519,9 +391,17 @@ def create_attendance():
                 current_app.logger.warning(f"Deleted main attendance record {attendance_id} during rollback.")
             else:
                 current_app.logger.error(f"Failed to delete main attendance record {attendance_id} during rollback.")
+        # Geri alınan oturum katılım özetlerinden çıkarılır (dersin satırları detaylardan yeniden sayılır)
+        if stats_recorded:
+            try:
+                attendance_stats_service.rebuild_stats(course_id=attendance_input.course_id)
+            except Exception as stats_e:
+                current_app.logger.error(f"Ders {attendance_input.course_id} için katılım özetleri geri alınamadı: {stats_e}")
                 
-        # 3. Varsa kaydedilen fotoğrafı sil
-        if saved_photo_path and os.path.exists(saved_photo_path):
+        # 3. Varsa kaydedilen fotoğrafları sil
+        for saved_photo_path in saved_photo_paths or []:
+            if not os.path.exists(saved_photo_path):
+                continue
             current_app.logger.warning(f"Deleting saved attendance photo: {saved_photo_path}")
             try:
                 os.remove(saved_photo_path)
@@ -532,6 +412,467 @@ def create_attendance():
         return jsonify({"message": "Yoklama kayıtları kaydedilirken bir hata oluştu. Lütfen logları kontrol edin."}), 500
 
 
+@attendance_bp.route('/', methods=['POST'])
+@teacher_required
+def create_attendance():
+    """
+    Bir fotoğraf yükleyerek ve yüzleri işleyerek yeni bir yoklama kaydı oluşturur.
+    Yalnızca dersin öğretmeni yoklama alabilir (veya Admin).
+    ---
+    tags:
+      - Yoklama (Attendance)
+    security:
+      - Bearer: []
+    parameters:
+      - in: formData
+        name: file
+        type: file
+        required: true
+        description: Yoklama alınacak sınıfın fotoğrafı. Kalabalık sınıflar için alan tekrarlanarak birden fazla fotoğraf gönderilebilir (en fazla ATTENDANCE_MAX_IMAGES); sonuçlar öğrenci başına en yüksek güvenle birleştirilir.
+      - in: formData
+        name: course_id
+        type: integer
+        required: true
+        description: Yoklamanın ait olduğu dersin ID'si.
+        example: 1
+      - in: formData
+        name: date
+        type: string
+        format: date
+        required: true
+        description: Yoklamanın alındığı tarih (YYYY-AA-GG formatında).
+        example: "2024-05-20"
+      - in: formData
+        name: lesson_number
+        type: integer
+        required: true
+        description: Yoklamanın ait olduğu ders saati numarası (örn. 1, 2).
+        example: 1
+      - in: formData
+        name: type
+        type: string
+        required: true
+        enum: ["FACE", "EMOTION", "FACE_EMOTION"]
+        description: Yoklama türü (Şimdilik sadece FACE destekleniyor).
+        example: "FACE"
+      - in: formData
+        name: detection_mode
+        type: string
+        required: false
+        enum: ["standard", "tiled"]
+        default: "standard"
+        description: Yüz tespit modu. Büyük amfi fotoğraflarında küçük yüzler için "tiled" (örtüşen parçalara bölerek paralel tespit) kullanılır.
+      - in: formData
+        name: tile_size
+        type: integer
+        required: false
+        description: Tiled modda parça kenar uzunluğu (piksel). Varsayılan FACE_DETECTION_TILE_SIZE.
+        example: 800
+      - in: formData
+        name: tile_overlap
+        type: integer
+        required: false
+        description: Tiled modda komşu parçalar arasındaki örtüşme (piksel). En büyük yüzden büyük olmalıdır.
+        example: 200
+      - in: formData
+        name: attributes
+        type: string
+        required: false
+        description: EMOTION/FACE_EMOTION yoklamalarında analiz edilecek yüz özellikleri, virgülle ayrılmış (age, gender, emotion). Verilmezse dersin default_attributes alanı, o da yoksa ATTENDANCE_DEFAULT_ATTRIBUTES kullanılır. Hesaplanmayan özellikler detay kayıtlarına yazılmaz.
+        example: "emotion"
+      - in: formData
+        name: analyze_unmatched
+        type: boolean
+        required: false
+        default: false
+        description: Özellik analizi varsayılan olarak yalnızca bir öğrenciyle eşleşen yüzlerde yapılır. true ise eşleşmeyen yüzler de analiz edilir ve genel duygu istatistiklerine katılır.
+      - in: formData
+        name: liveness_check
+        type: boolean
+        required: false
+        description: Eşleştirmeden önce tüm yüzlerde ucuz canlılık kontrolü (ekran/baskı moiresi, fotoğraftaki diğer yüzlere göre boyut tutarlılığı) yapar. Şüpheli eşleşmeler sonuçlarda spoof_suspected/spoof_reasons ile işaretlenir; yoklama durumu değişmez. Verilmezse ATTENDANCE_LIVENESS_CHECK kullanılır.
+    responses:
+      201:
+        description: Yoklama başarıyla oluşturuldu ve yüzler işlendi. Tanınan ve tanınmayan öğrenci sayıları döndürülür.
+        schema:
+          $ref: '#/definitions/AttendanceResultSummary' # Önceden tanımlanmış veya global şema
+        examples:
+          application/json:
+            attendance_id: 25
+            recognized_count: 18
+            unrecognized_count: 2
+            results:
+              - student_id: 5
+                status: "PRESENT"
+                confidence: 0.95
+                emotion: null
+                emotion_confidence: null
+              - student_id: 12
+                status: "ABSENT"
+                confidence: null
+                emotion: null
+                emotion_confidence: null
+              # ... (diğer öğrenciler)
+      400:
+        description: Geçersiz istek (eksik dosya, eksik form alanı, geçersiz veri formatı, desteklenmeyen dosya türü, resimde yüz bulunamadı).
+      401:
+        description: Yetkisiz (Geçerli JWT token sağlanmadı).
+      403:
+        description: Yasak (Kullanıcı dersin öğretmeni veya Admin değil).
+      404:
+        description: Ders veya derse kayıtlı öğrenci bulunamadı.
+      500:
+        description: Sunucu hatası (Resim işleme hatası, veritabanı yazma hatası).
+    """
+    # --- Mevcut kullanıcı rolünü ve INT ID'sini al --- 
+    current_role, current_user_id = get_current_user_role_and_id() 
+    if current_role is None or current_user_id is None:
+         return jsonify({"message": "Geçersiz token kimliği veya kullanıcı bulunamadı"}), 401
+    # --- Bitiş --- 
+
+    # --- 1. Form Verisini & Dosyaları Doğrula --- 
+    # Aynı oturum için birden fazla fotoğraf 'file' alanı tekrarlanarak gönderilebilir
+    if 'file' not in request.files:
+        return jsonify({"message": "İstekte dosya bölümü yok"}), 400
+    files = [f for f in request.files.getlist('file') if f and f.filename]
+    if not files:
+        return jsonify({"message": "Seçili dosya yok"}), 400
+    max_images = current_app.config.get('ATTENDANCE_MAX_IMAGES', 10)
+    if len(files) > max_images:
+        return jsonify({"message": f"Bir yoklama oturumu için en fazla {max_images} fotoğraf yüklenebilir."}), 400
+
+    attendance_input, error_response = _parse_attendance_form(AttendanceCreate)
+    if error_response:
+        return error_response
+
+    # --- 2. İzinleri ve Ders/Saat Geçerliliğini Kontrol Et --- 
+    error_response = _check_attendance_permission(attendance_input.course_id, current_role, current_user_id)
+    if error_response:
+        return error_response
+
+    # İsteğe bağlı: lesson_number'ı dersin/tarihin mevcut ders saatlerine göre doğrula
+    # lesson_time = data_service.find_one(LESSON_TIMES_FILE, course_id=course_id, lesson_number=lesson_number)
+    # if not lesson_time: return jsonify(...), 404
+
+    # --- 3. Resimleri İşle: Yüzleri Bul & Kodlamaları Çıkar --- 
+    # Her fotoğraf paralel işlenir; tüm yüzler tek bir düz listede toplanır
+    face_refs = [] # (image_index, face_index) for each face in the flat lists below
+    image_encodings = []
+    face_crops = [] # Face regions, analyzed after matching
+    face_locations = [] # (top, right, bottom, left) in the face's own photo
+
+    try:
+        for file in files:
+            if not face_service.allowed_file(file.filename):
+                allowed_ext_str = ", ".join(face_service.ALLOWED_EXTENSIONS)
+                return jsonify({"message": f"Dosya türüne izin verilmiyor ({file.filename}). İzin verilenler: {allowed_ext_str}"}), 400
+
+        # Read the image files into memory (once)
+        images_bytes = []
+        for file in files:
+            file.seek(0)
+            images_bytes.append(file.read())
+
+        # Only the requested attributes are analyzed (see _resolve_attribute_actions)
+        actions_to_perform = _resolve_attribute_actions(attendance_input)
+
+        tile_options = None
+        if attendance_input.detection_mode == 'tiled':
+            tile_options = {'tile_size': attendance_input.tile_size, 'overlap': attendance_input.tile_overlap}
+
+        # Preprocess, detect and encode each image (see face_service.analyze_image);
+        # attribute analysis runs after matching, only for the faces that need it
+        image_results = face_service.analyze_images(
+            images_bytes,
+            detection_mode=attendance_input.detection_mode,
+            tile_options=tile_options
+        )
+
+        for image_index, image_result in enumerate(image_results):
+            current_app.logger.info(f"{attendance_input.course_id} ID'li ders için fotoğraf {image_index + 1}/{len(files)} içinde {len(image_result['locations'])} yüz bulundu.")
+            for face_index, encoding in enumerate(image_result['encodings']):
+                face_refs.append((image_index, face_index))
+                image_encodings.append(encoding)
+                face_crops.append(image_result['crops'][face_index])
+                face_locations.append(image_result['locations'][face_index])
+
+        if not image_encodings:
+            return jsonify({"message": "Yüklenen resimlerde yüz tespit edilemedi."}), 400
+
+    except ValueError as ve: # face_service'den dosya türü / resim hatası
+        return jsonify({"message": str(ve)}), 400 
+    except Exception as e:
+        current_app.logger.error(f"Yoklama resmi işlenirken veya analiz edilirken hata: {e}\n{traceback.format_exc()}")
+        return jsonify({"message": "Yoklama resmi işlenirken veya analiz edilirken hata oluştu."}), 500
+
+    # --- 4. Kayıtlı Öğrencileri ve Kodlamalarını Al --- 
+    enrolled_data, error_response = _load_enrolled_encodings(attendance_input.course_id)
+    if error_response:
+        return error_response
+    enrolled_student_ids, enrolled_students, known_faces = enrolled_data
+
+    # --- 4b. İsteğe Bağlı Canlılık Kontrolü (fotoğrafın fotoğrafı), eşleştirmeden önce toplu --- 
+    liveness_results = [None] * len(image_encodings)
+    liveness_enabled = attendance_input.liveness_check
+    if liveness_enabled is None:
+        liveness_enabled = current_app.config.get('ATTENDANCE_LIVENESS_CHECK', False)
+    if liveness_enabled:
+        liveness_results = face_service.check_liveness(face_crops, face_locations, [ref[0] for ref in face_refs])
+        suspicious_count = sum(1 for result in liveness_results if result['suspicious'])
+        if suspicious_count:
+            current_app.logger.warning(f"Canlılık kontrolü: {suspicious_count}/{len(liveness_results)} yüz şüpheli (fotoğraf/ekran olabilir).")
+
+    # --- 5. Yüzleri Karşılaştır, Ardından Sadece Gerekli Yüzleri Analiz Et --- 
+    # Tüm fotoğraflardaki yüzler tek seferde eşleştirilir; aynı öğrenci birden fazla
+    # fotoğrafta görünürse en yüksek güvenli eşleşme kullanılır.
+    face_recognition_tolerance = current_app.config.get('FACE_RECOGNITION_TOLERANCE', 0.6)
+    match_result = face_service.match_faces(face_encodings=image_encodings, tolerance=face_recognition_tolerance, **known_faces)
+
+    # Faces that matched a student whose best match is in another photo are duplicates of the same person
+    duplicate_faces = set()
+    for idx, student_id in enumerate(match_result['face_labels']):
+        if student_id is None:
+            current_app.logger.info(f"Face {idx} did not match known students (min distance: {match_result['face_distances'][idx]}).")
+            continue
+        winner_idx = match_result['matches'][student_id]['face_index']
+        if winner_idx != idx and face_refs[winner_idx][0] != face_refs[idx][0]:
+            duplicate_faces.add(idx)
+
+    # Attributes are analyzed only for faces assigned to a student (and, if requested, the other
+    # non-duplicate faces); strangers and false detections never reach the attribute models
+    matched_faces = {match['face_index'] for match in match_result['matches'].values()}
+    faces_to_analyze = sorted(matched_faces)
+    if attendance_input.analyze_unmatched:
+        faces_to_analyze = [idx for idx in range(len(image_encodings)) if idx not in duplicate_faces]
+    face_analysis_results = [None] * len(image_encodings)
+    if actions_to_perform and faces_to_analyze:
+        analyzed = face_service.analyze_face_crops([face_crops[idx] for idx in faces_to_analyze], actions_to_perform)
+        for idx, analysis in zip(faces_to_analyze, analyzed):
+            face_analysis_results[idx] = analysis
+        current_app.logger.info(f"{len(faces_to_analyze)}/{len(image_encodings)} yüz için özellik analizi yapıldı.")
+
+    # Store details per recognized student { student_id: {'confidence': float, 'analysis': dict_or_none} }
+    recognized_student_details = {}
+    for student_id, match in match_result['matches'].items():
+        face_idx = match['face_index']
+        recognized_student_details[student_id] = {
+            'confidence': max(0.0, 1.0 - match['distance']),
+            'encoding': image_encodings[face_idx], # Şablon güncellemesi için
+            'liveness': liveness_results[face_idx],
+            'analysis': face_analysis_results[face_idx]
+        }
+        current_app.logger.info(f"Student {student_id} matched (Conf: {recognized_student_details[student_id]['confidence']:.4f}) with face {face_idx} of image {face_refs[face_idx][0]}.")
+
+    # Eşleşmeyen (ve canlılık kontrolünde şüpheli olmayan) yüzler bilinmeyen yüz kümelemesine gider
+    unknown_face_indices = [
+        idx for idx, student_id in enumerate(match_result['face_labels'])
+        if student_id is None and not (liveness_results[idx] or {}).get('suspicious')
+    ]
+
+    # --- Calculate Overall Emotion Statistics --- 
+    all_detected_emotions = [
+        analysis['emotion'] for idx, analysis in enumerate(face_analysis_results)
+        if idx not in duplicate_faces and analysis and analysis.get('emotion')
+    ]
+    emotion_statistics = dict(Counter(all_detected_emotions)) if all_detected_emotions else None
+    current_app.logger.info(f"Overall Emotion Stats: {emotion_statistics}")
+
+    # --- Yoklama Fotoğraflarını Kaydet --- 
+    photo_urls = []
+    saved_photo_paths = []
+    for image_index, file in enumerate(files):
+        try:
+            file_extension = file.filename.rsplit('.', 1)[1].lower() if '.' in file.filename else 'jpg'
+            filename = secure_filename(f"attendance_{attendance_input.course_id}_{attendance_input.date.isoformat()}_{attendance_input.lesson_number}_{datetime.datetime.now().strftime('%H%M%S')}_{image_index + 1}.{file_extension}")
+            upload_dir = current_app.config.get('ATTENDANCE_UPLOAD_FOLDER')
+            if not upload_dir:
+                 raise ValueError("ATTENDANCE_UPLOAD_FOLDER yapılandırılmamış.")
+            if not os.path.exists(upload_dir): os.makedirs(upload_dir)
+            file_path = os.path.join(upload_dir, filename)
+            
+            file.seek(0) 
+            file.save(file_path)
+            saved_photo_paths.append(file_path) # Potansiyel silme için tam yolu sakla
+            # Web erişimi için göreceli URL oluştur (örn. /uploads/attendance/dosya.jpg)
+            # Bu URL'nin uygulamanızın statik dosya sunumuyla eşleştiğinden emin olun
+            static_url_path = current_app.static_url_path or '' # Genellikle /static
+            relative_upload_dir = os.path.relpath(upload_dir, current_app.static_folder if current_app.static_folder else current_app.root_path)
+            photo_url = f"{static_url_path}/{relative_upload_dir}/{filename}".replace("\\", "/").replace("//", "/") # Windows ve çift // düzeltmesi
+            photo_urls.append(photo_url)
+             
+            current_app.logger.info(f"Yoklama fotoğrafı kaydedildi: {file_path}, URL: {photo_url}")
+        except Exception as e:
+            current_app.logger.error(f"Yoklama fotoğrafı kaydedilemedi ({file.filename}): {e}")
+            # Hata durumunda devam etmeli mi? Yoksa 500 döndürmeli mi?
+            # Şimdilik devam et, fotoğrafsız bir kayıt oluşsun.
+    # --- Fotoğraf Kaydetme Sonu --- 
+
+    # --- 6. Yoklama Kayıtlarını Oluştur (Ana ve Detaylar) --- 
+    return _persist_attendance(
+        attendance_input, current_user_id, enrolled_student_ids, enrolled_students,
+        recognized_student_details, emotion_statistics,
+        photo_urls=photo_urls, saved_photo_paths=saved_photo_paths,
+        summary_fields={'image_count': len(files), 'detected_face_count': len(image_encodings),
+                        'suspicious_face_count': sum(1 for r in liveness_results if r and r['suspicious']) if liveness_enabled else None},
+        attributes=actions_to_perform,
+        unknown_faces=([image_encodings[idx] for idx in unknown_face_indices], [face_crops[idx] for idx in unknown_face_indices])
+    )
+
+
+@attendance_bp.route('/video', methods=['POST'])
+@teacher_required
+def create_attendance_from_video():
+    """
+    Kısa bir sınıf videosu (veya karelerden oluşan bir ZIP) yükleyerek yoklama kaydı oluşturur.
+    Kareler yapılandırılan hızda örneklenir, yüzler kareler boyunca takip edilir (aynı kişi her karede
+    yeniden kodlanmaz) ve öğrenci başına kimlik oyları ile duygu dağılımları birleştirilir.
+    Yalnızca dersin öğretmeni yoklama alabilir (veya Admin).
+    ---
+    tags:
+      - Yoklama (Attendance)
+    security:
+      - Bearer: []
+    consumes:
+      - multipart/form-data
+    parameters:
+      - in: formData
+        name: file
+        type: file
+        required: true
+        description: Sınıf videosu (mp4, avi, mov, mkv, webm) veya kare fotoğraflarını içeren ZIP arşivi.
+      - in: formData
+        name: course_id
+        type: integer
+        required: true
+        example: 1
+      - in: formData
+        name: date
+        type: string
+        format: date
+        required: true
+        example: "2024-05-20"
+      - in: formData
+        name: lesson_number
+        type: integer
+        required: true
+        example: 1
+      - in: formData
+        name: type
+        type: string
+        required: true
+        enum: ["FACE", "EMOTION", "FACE_EMOTION"]
+        example: "FACE_EMOTION"
+      - in: formData
+        name: sample_fps
+        type: number
+        required: false
+        description: Saniyede örneklenecek kare sayısı (varsayılan VIDEO_SAMPLE_FPS). ZIP arşivlerinde kullanılmaz.
+        example: 2
+      - in: formData
+        name: attributes
+        type: string
+        required: false
+        description: EMOTION/FACE_EMOTION yoklamalarında analiz edilecek yüz özellikleri, virgülle ayrılmış (age, gender, emotion). Verilmezse dersin default_attributes alanı, o da yoksa ATTENDANCE_DEFAULT_ATTRIBUTES kullanılır. Hesaplanmayan özellikler detay kayıtlarına yazılmaz.
+        example: "emotion"
+      - in: formData
+        name: analyze_unmatched
+        type: boolean
+        required: false
+        default: false
+        description: Özellik analizi varsayılan olarak yalnızca bir öğrenciyle eşleşen yüzlerde yapılır. true ise eşleşmeyen yüzler de analiz edilir ve genel duygu istatistiklerine katılır.
+    responses:
+      201:
+        description: Yoklama oluşturuldu. Öğrenci bazlı duygu dağılımları emotion_statistics alanında döner.
+        schema:
+          $ref: '#/definitions/AttendanceResultSummary'
+      400:
+        description: Geçersiz istek (eksik dosya, desteklenmeyen format, açılamayan video, yüz bulunamadı).
+      401:
+        description: Yetkisiz (Geçerli JWT token sağlanmadı).
+      403:
+        description: Yasak (Kullanıcı dersin öğretmeni veya Admin değil).
+      404:
+        description: Ders veya derse kayıtlı öğrenci bulunamadı.
+      500:
+        description: Sunucu hatası (Video işleme hatası, veritabanı yazma hatası).
+    """
+    current_role, current_user_id = get_current_user_role_and_id() 
+    if current_role is None or current_user_id is None:
+         return jsonify({"message": "Geçersiz token kimliği veya kullanıcı bulunamadı"}), 401
+
+    # --- 1. Form Verisini & Dosyayı Doğrula --- 
+    if 'file' not in request.files:
+        return jsonify({"message": "İstekte dosya bölümü yok"}), 400
+    file = request.files['file']
+    if file.filename == '':
+        return jsonify({"message": "Seçili dosya yok"}), 400
+    if not face_service.allowed_video_file(file.filename):
+        allowed_ext_str = ", ".join(sorted(face_service.VIDEO_EXTENSIONS | face_service.FRAME_ARCHIVE_EXTENSIONS))
+        return jsonify({"message": f"Dosya türüne izin verilmiyor. İzin verilenler: {allowed_ext_str}"}), 400
+
+    attendance_input, error_response = _parse_attendance_form(AttendanceVideoCreate)
+    if error_response:
+        return error_response
+
+    # --- 2. İzinleri Kontrol Et --- 
+    error_response = _check_attendance_permission(attendance_input.course_id, current_role, current_user_id)
+    if error_response:
+        return error_response
+
+    # --- 3. Kayıtlı Öğrencileri ve Kodlamalarını Al (video işlenmeden önce) --- 
+    enrolled_data, error_response = _load_enrolled_encodings(attendance_input.course_id)
+    if error_response:
+        return error_response
+    enrolled_student_ids, enrolled_students, known_faces = enrolled_data
+
+    # --- 4. Kareleri Akış Halinde İşle: Tespit, Takip, Kodlama, Analiz --- 
+    actions_to_perform = _resolve_attribute_actions(attendance_input)
+    extension = file.filename.rsplit('.', 1)[1].lower()
+    temp_video_path = None
+    try:
+        if extension in face_service.FRAME_ARCHIVE_EXTENSIONS:
+            frames = face_service.iter_archive_frames(file.read())
+        else:
+            # OpenCV videoları dosya yolundan okur
+            with tempfile.NamedTemporaryFile(suffix=f".{extension}", delete=False) as temp_video:
+                temp_video_path = temp_video.name
+                file.save(temp_video)
+            frames = face_service.iter_video_frames(temp_video_path, sample_fps=attendance_input.sample_fps)
+
+        tracking_result = face_service.track_faces_in_frames(frames, keep_crops=bool(actions_to_perform))
+    except ValueError as ve:
+        return jsonify({"message": str(ve)}), 400
+    except Exception as e:
+        current_app.logger.error(f"Yoklama videosu işlenirken hata: {e}\n{traceback.format_exc()}")
+        return jsonify({"message": "Yoklama videosu işlenirken hata oluştu."}), 500
+    finally:
+        if temp_video_path and os.path.exists(temp_video_path):
+            os.remove(temp_video_path)
+
+    if not tracking_result['tracks']:
+        return jsonify({"message": "Yüklenen videoda yüz tespit edilemedi."}), 400
+
+    # --- 5. Kimlik Oylarını ve Duygu Dağılımlarını Öğrenci Bazında Birleştir --- 
+    face_recognition_tolerance = current_app.config.get('FACE_RECOGNITION_TOLERANCE', 0.6)
+    aggregation = face_service.aggregate_track_identities(
+        tracking_result['tracks'], tolerance=face_recognition_tolerance,
+        actions=actions_to_perform, analyze_unmatched=attendance_input.analyze_unmatched, **known_faces
+    )
+    recognized_student_details = aggregation['matches']
+    current_app.logger.info(f"Video yoklaması: {tracking_result['frame_count']} kare, {len(tracking_result['tracks'])} yüz izi, {len(recognized_student_details)} öğrenci tanındı.")
+
+    # --- 6. Yoklama Kayıtlarını Oluştur (Ana ve Detaylar) --- 
+    return _persist_attendance(
+        attendance_input, current_user_id, enrolled_student_ids, enrolled_students,
+        recognized_student_details, aggregation['emotion_statistics'],
+        extra_record_fields={'source': 'ARCHIVE' if extension in face_service.FRAME_ARCHIVE_EXTENSIONS else 'VIDEO',
+                             'frame_count': tracking_result['frame_count']},
+        summary_fields={'image_count': 0, 'frame_count': tracking_result['frame_count'],
+                        'detected_face_count': len(tracking_result['tracks'])},
+        attributes=actions_to_perform
+    )
+
+
 @attendance_bp.route('/<int:attendance_id>', methods=['GET'])
 @teacher_required # Dersin Öğretmeni veya Admin erişebilir
 def get_attendance_record(attendance_id):
@@ -1125,8 +1466,9 @@ def manually_update_student_attendance(attendance_id, student_id):
              return jsonify({"message": "Failed to add manual attendance detail."}), 500
     
     # ** Important: Update the summary counts in the main attendance record **
-    all_details_for_att = data_service.find_many(ATTENDANCE_DETAILS_FILE, attendance_id=attendance_id)
-    present_count = sum(1 for d in all_details_for_att if d.get('status') == 'PRESENT')
+    # status_counts detay yazılırken data_service tarafından güncellendi; detaylar yeniden sayılmaz
+    status_counts = (data_service.find_one(ATTENDANCE_FILE, id=attendance_id) or {}).get('status_counts') or {}
+    present_count = status_counts.get('PRESENT', 0)
     total_enrolled = attendance_record.get('total_students', len(data_service.find_many(STUDENT_COURSE_FILE, course_id=course_id)))
     absent_count = total_enrolled - present_count # Recalculate based on PRESENT count
 
@@ -1138,6 +1480,31 @@ def manually_update_student_attendance(attendance_id, student_id):
     data_service.update_item(ATTENDANCE_FILE, attendance_id, main_updates)
     # --- End summary update ---
 
+    # Öğrencinin bu dersteki katılım özeti (student_course_stats) sadece değişen durumla güncellenir
+    try:
+        attendance_stats_service.update_student_status(
+            course_id, student_id, attendance_record.get('date'),
+            existing_detail.get('status') if existing_detail else None, new_status
+        )
+    except Exception as e:
+        current_app.logger.error(f"Öğrenci {student_id} için katılım özeti güncellenemedi: {e}")
+
+    # Düzeltilen otomatik eşleşmeler öğrencinin eşleşme eşiğini yeniden öğrenmek için kullanılır
+    if existing_detail and existing_detail.get('confidence') is not None and existing_detail.get('status') != new_status:
+        try:
+            enrollment_service.calibrate_match_thresholds([student_id])
+        except Exception as e:
+            current_app.logger.error(f"Öğrenci {student_id} için eşleşme eşiği güncellenemedi: {e}")
+
+    # Öğretmen onayı, bekleyen düşük güvenli eşleşmeyi öğrencinin şablonlarına ekler; ret adayı atar ve
+    # bu oturumdan şablona girmiş eşleşmeyi de şablonlardan çıkarır (yanlış kabul öğrenilmiş kalmaz)
+    try:
+        enrollment_service.resolve_template_candidate(
+            attendance_id, student_id, confirmed=new_status in enrollment_service.CONFIRMED_STATUSES
+        )
+    except Exception as e:
+        current_app.logger.error(f"Öğrenci {student_id} için şablon adayı işlenemedi: {e}")
+
     # Add student info to response
     if updated_detail:
         from app.routes.students import _get_student_with_user
@@ -1145,4 +1512,215 @@ def manually_update_student_attendance(attendance_id, student_id):
         if student_info:
              updated_detail['student'] = student_info.get('user', {}) # Add basic user info
     
-    return jsonify(updated_detail), response_status 
\ No newline at end of file
+    return jsonify(updated_detail), response_status
+
+
+@attendance_bp.route('/metrics', methods=['GET'])
+@admin_required
+def get_pipeline_metrics():
+    """
+    Yüz işleme hattının aşama bazlı süre metriklerini (ön işleme, tespit, kodlama, analiz)
+    ve önbellek isabet/ıskalama sayaçlarını getirir.
+    Metrikler sunucu işlemi (worker) başına bellekte tutulur.
+    ---
+    tags:
+      - Yüz Tanıma (Face Recognition)
+    security:
+      - Bearer: []
+    responses:
+      200:
+        description: Aşama bazlı süre metrikleri.
+        examples:
+          application/json:
+            stages:
+              preprocess:
+                count: 42
+                total_ms: 1260.5
+                avg_ms: 30.01
+                max_ms: 95.2
+              detect:
+                count: 42
+                total_ms: 10420.0
+                avg_ms: 248.1
+                max_ms: 610.4
+            caches:
+              analysis.exact_hits: 3
+              analysis.near_hits: 1
+              analysis.misses: 38
+              analysis.entries: 38
+      401:
+        description: Yetkisiz. Geçerli token sağlanmadı.
+      403:
+        description: Yasak. Kullanıcı Admin değil.
+    """
+    return jsonify({"stages": face_service.get_pipeline_metrics(), "caches": face_service.get_cache_stats()}), 200
+
+
+@attendance_bp.route('/course/<int:course_id>/unknown-faces', methods=['GET'])
+@admin_required
+def get_unknown_face_clusters(course_id):
+    """
+    Dersin yoklamalarında hiçbir kayıtlı öğrenciyle eşleşmeyen yüzlerin oturumlar arası kümelerini listeler.
+    Birden fazla oturumda görülen kümeler, derse kayıtlı olmayan tekrar eden katılımcılara işaret eder.
+    ---
+    tags:
+      - Yoklama (Attendance)
+      - Yüz Tanıma (Face Recognition)
+    security:
+      - Bearer: []
+    parameters:
+      - in: path
+        name: course_id
+        type: integer
+        required: true
+        description: Dersin ID'si.
+      - in: query
+        name: min_sessions
+        type: integer
+        required: false
+        default: 1
+        description: Sadece en az bu kadar farklı yoklama oturumunda görülen kümeleri döndür.
+    responses:
+      200:
+        description: Bilinmeyen yüz kümeleri (en çok tekrar eden önce).
+        examples:
+          application/json:
+            - id: 3
+              course_id: 4
+              face_count: 5
+              session_count: 4
+              attendance_ids: [11, 12, 14, 15]
+              thumbnail_urls: ["/uploads/unknown_faces/unknown_4_11_20240315101500_2.jpg"]
+              created_at: "2024-03-15T10:15:00Z"
+              updated_at: "2024-03-22T10:16:00Z"
+      401:
+        description: Yetkisiz. Geçerli token sağlanmadı.
+      403:
+        description: Yasak. Kullanıcı Admin değil.
+      404:
+        description: Ders bulunamadı.
+    """
+    if not data_service.find_one(COURSES_FILE, id=course_id):
+        return jsonify({"message": "Ders bulunamadı"}), 404
+    min_sessions = request.args.get('min_sessions', 1, type=int)
+    return jsonify(unknown_face_service.list_clusters(course_id, min_sessions=max(1, min_sessions))), 200
+
+
+@attendance_bp.route('/course/<int:course_id>/unknown-faces/<int:cluster_id>/enroll', methods=['POST'])
+@admin_required
+def enroll_unknown_face_cluster(course_id, cluster_id):
+    """
+    Bilinmeyen yüz kümesini tek işlemde bir öğrenciye kaydeder: kümenin merkezine en yakın yüz
+    kodlamaları öğrencinin yüz kodlamaları olur, öğrenci derse kayıtlı değilse kaydedilir ve küme silinir.
+    ---
+    tags:
+      - Yoklama (Attendance)
+      - Yüz Tanıma (Face Recognition)
+    security:
+      - Bearer: []
+    parameters:
+      - in: path
+        name: course_id
+        type: integer
+        required: true
+      - in: path
+        name: cluster_id
+        type: integer
+        required: true
+      - in: body
+        name: body
+        required: true
+        schema:
+          type: object
+          required:
+            - student_id
+          properties:
+            student_id:
+              type: integer
+              description: Kümenin ait olduğu öğrencinin ID'si.
+              example: 12
+            replace:
+              type: boolean
+              default: false
+              description: Öğrencinin mevcut yüz kodlamalarının ve fotoğrafının kümeyle değiştirilmesine izin verir.
+    responses:
+      200:
+        description: Küme öğrenciye kaydedildi.
+        examples:
+          application/json: { "message": "Bilinmeyen yüz kümesi öğrenciye kaydedildi.", "student_id": 12, "course_id": 4, "encodings_count": 5 }
+      400:
+        description: student_id eksik veya kümede güncel sürümde yüz örneği yok.
+      401:
+        description: Yetkisiz. Geçerli token sağlanmadı.
+      403:
+        description: Yasak. Kullanıcı Admin değil.
+      404:
+        description: Küme veya öğrenci bulunamadı.
+      409:
+        description: Öğrencinin zaten yüz kaydı var ve replace belirtilmedi.
+    """
+    cluster = data_service.find_one(unknown_face_service.UNKNOWN_FACE_CLUSTERS_FILE, id=cluster_id, course_id=course_id)
+    if not cluster:
+        return jsonify({"message": "Bilinmeyen yüz kümesi bulunamadı"}), 404
+    json_data = request.get_json(silent=True) or {}
+    student_id = json_data.get('student_id')
+    if not isinstance(student_id, int):
+        return jsonify({"message": "student_id (tam sayı) gerekli"}), 400
+    student = data_service.find_one(STUDENTS_FILE, id=student_id)
+    if not student:
+        return jsonify({"message": "Öğrenci bulunamadı"}), 404
+    replace = json_data.get('replace') is True
+    if unknown_face_service.has_enrollment(student) and not replace:
+        return jsonify({"message": "Öğrencinin zaten yüz kaydı var. Mevcut kaydı kümeyle değiştirmek için replace: true gönderin."}), 409
+
+    try:
+        updated_student = unknown_face_service.enroll_cluster(cluster, student, replace=replace)
+    except ValueError as ve:
+        return jsonify({"message": str(ve)}), 400
+    except Exception as e:
+        current_app.logger.error(f"Bilinmeyen yüz kümesi {cluster_id} öğrenci {student_id} için kaydedilemedi: {e}")
+        return jsonify({"message": "Bilinmeyen yüz kümesi kaydedilemedi."}), 500
+
+    return jsonify({
+        "message": "Bilinmeyen yüz kümesi öğrenciye kaydedildi.",
+        "student_id": student_id,
+        "course_id": course_id,
+        "encodings_count": len((updated_student or {}).get('face_encoding_versions') or [])
+    }), 200
+
+
+@attendance_bp.route('/course/<int:course_id>/unknown-faces/<int:cluster_id>', methods=['DELETE'])
+@admin_required
+def delete_unknown_face_cluster(course_id, cluster_id):
+    """
+    Bilinmeyen yüz kümesini ve küçük resimlerini siler (örn. misafir veya hatalı tespit).
+    ---
+    tags:
+      - Yoklama (Attendance)
+      - Yüz Tanıma (Face Recognition)
+    security:
+      - Bearer: []
+    parameters:
+      - in: path
+        name: course_id
+        type: integer
+        required: true
+      - in: path
+        name: cluster_id
+        type: integer
+        required: true
+    responses:
+      200:
+        description: Küme silindi.
+      401:
+        description: Yetkisiz. Geçerli token sağlanmadı.
+      403:
+        description: Yasak. Kullanıcı Admin değil.
+      404:
+        description: Küme bulunamadı.
+    """
+    cluster = data_service.find_one(unknown_face_service.UNKNOWN_FACE_CLUSTERS_FILE, id=cluster_id, course_id=course_id)
+    if not cluster:
+        return jsonify({"message": "Bilinmeyen yüz kümesi bulunamadı"}), 404
+    unknown_face_service.delete_cluster(cluster)
+    return jsonify({"message": "Bilinmeyen yüz kümesi silindi."}), 200
@@ -3,7 +3,7 @@ from pydantic import ValidationError
 import datetime
 import os # Import the os module
 
-from app.services import data_service
+from app.services import data_service, unknown_face_service, attendance_stats_service
 from app.schemas.course import (
     CourseResponse, CourseCreate, CourseUpdate, LessonTimeResponse, 
     StudentCourseLink, StudentCourseResponse, LessonTimeCreate # Ensure LessonTimeCreate is imported
@@ -12,6 +12,7 @@ from app.schemas.user import TeacherResponse, StudentResponse # Import related s
 from app.schemas.attendance import AttendanceResponse # For listing attendance
 from app.models.course import Course, LessonTime, StudentCourse, default_datetime
 from app.utils.auth import jwt_required, teacher_required, admin_required, self_or_admin_required, get_jwt_identity, get_current_user_role_and_id
+from app.utils.hydration import attach_users, hydrate_students
 
 courses_bp = Blueprint('courses_bp', __name__)
 
@@ -23,37 +24,75 @@ STUDENTS_FILE = 'students.json'
 STUDENT_COURSE_FILE = 'student_course.json'
 ATTENDANCE_FILE = 'attendance.json'
 ATTENDANCE_DETAILS_FILE = 'attendance_details.json'
-# EMOTION_HISTORY_FILE = 'emotion_history.json' # If needed later
+EMOTION_HISTORY_FILE = 'emotion_history.json'
+TEMPLATE_CANDIDATES_FILE = 'template_candidates.json'
+STUDENT_COURSE_STATS_FILE = 'student_course_stats.json'
+
+COURSE_INCLUDES = ('teacher', 'lesson_times') # Ders yanıtlarına eklenebilen ilişkiler
+
+def _parse_course_includes(default):
+    """
+    Yardımcı fonksiyon: ?include=teacher,lesson_times parametresini doğrular.
+    (ilişkiler, None) veya geçersiz değerde (None, hata_yanıtı) döndürür.
+    """
+    value = request.args.get('include')
+    if value is None:
+        return tuple(default), None
+    includes = tuple(part.strip().lower() for part in value.split(',') if part.strip())
+    invalid = [part for part in includes if part not in COURSE_INCLUDES]
+    if invalid:
+        return None, (jsonify({"message": f"Geçersiz include değeri: {', '.join(invalid)}. İzin verilenler: {', '.join(COURSE_INCLUDES)}"}), 400)
+    return includes, None
+
+def _hydrate_courses(courses, includes=COURSE_INCLUDES):
+    """
+    Yardımcı fonksiyon: Derslere istenen ilişkileri (öğretmen + kullanıcısı, ders saatleri) ekler.
+    Her ilişki dosyası ders sayısından bağımsız olarak istek başına bir kez okunur.
+    İstenmeyen ders saatleri boş liste olarak döner (liste görünümüyle uyumlu).
+    """
+    if 'teacher' in includes:
+        teachers = data_service.fetch_by_ids(TEACHERS_FILE, (course.get('teacher_id') for course in courses))
+        attach_users(list(teachers.values()))
+        for course in courses:
+            if course.get('teacher_id') in teachers:
+                course['teacher'] = teachers[course['teacher_id']]
+
+    lesson_times_by_course = {}
+    if 'lesson_times' in includes and courses:
+        course_ids = {course.get('id') for course in courses}
+        for lesson_time in data_service.read_data(LESSON_TIMES_FILE):
+            if lesson_time.get('course_id') in course_ids:
+                lesson_times_by_course.setdefault(lesson_time['course_id'], []).append(lesson_time)
+    for course in courses:
+        course['lesson_times'] = lesson_times_by_course.get(course.get('id'), [])
+    return courses
 
 def _get_course_details(course_dict):
     """Yardımcı fonksiyon: Bir dersin öğretmen ve ders saati detaylarını getirir."""
     if not course_dict:
         return None
-    # Öğretmen detaylarını getir
-    teacher = data_service.find_one(TEACHERS_FILE, id=course_dict.get('teacher_id'))
-    if teacher:
-        user = data_service.find_one(USERS_FILE, id=teacher.get('user_id'))
-        if user:
-            user.pop('password_hash', None)
-            teacher['user'] = user
-        course_dict['teacher'] = teacher
-    
-    # Ders saatlerini getir
-    lesson_times = data_service.find_many(LESSON_TIMES_FILE, course_id=course_dict.get('id'))
-    course_dict['lesson_times'] = lesson_times
-    return course_dict
+    return _hydrate_courses([course_dict])[0]
 
 @courses_bp.route('/', methods=['GET'])
 # @jwt_required() # Removed JWT requirement
 def get_courses():
     """
     Tüm derslerin listesini getirir.
-    Her ders için öğretmen bilgileri (kullanıcı detayları dahil) ve ders saatleri (bu endpoint için özet) eklenir.
+    Varsayılan olarak her ders için öğretmen bilgileri (kullanıcı detayları dahil) eklenir; ders saatleri boş döner.
+    Eklenecek ilişkiler `include` parametresiyle seçilir ve her biri istek başına tek okumayla birleştirilir.
     ---    
     tags:
       - Dersler (Courses)
     # security: # Removed security section
     #  - Bearer: []
+    parameters:
+      - in: query
+        name: include
+        type: string
+        required: false
+        default: "teacher"
+        description: Virgülle ayrılmış eklenecek ilişkiler (teacher, lesson_times). Boş değer ("include=") sadece ders alanlarını döndürür.
+        example: "teacher,lesson_times"
     responses:
       200:
         description: Derslerin listesi başarıyla alındı.
@@ -104,6 +143,8 @@ def get_courses():
                      role: "TEACHER"
                      is_active: true
               lesson_times: []
+      400:
+        description: Geçersiz include değeri.
       401:
         description: Yetkisiz. Geçerli bir token sağlanmadı.
     definitions:
@@ -230,21 +271,12 @@ def get_courses():
                   items:
                       $ref: '#/definitions/LessonTimeResponseShort'
     """
+    includes, error_response = _parse_course_includes(default=('teacher',))
+    if error_response:
+        return error_response
     courses_list = data_service.read_data(COURSES_FILE)
-    # Liste görünümü için öğretmen detaylarını ekle
-    detailed_courses = []
-    for course in courses_list:
-        teacher = data_service.find_one(TEACHERS_FILE, id=course.get('teacher_id'))
-        if teacher:
-            user = data_service.find_one(USERS_FILE, id=teacher.get('user_id'))
-            if user:
-                user.pop('password_hash', None)
-                teacher['user'] = user
-            course['teacher'] = teacher
-        # Liste görünümünü basit tutmak için ders saatlerini ekleme
-        course['lesson_times'] = [] 
-        detailed_courses.append(course)
-        
+    # Liste görünümü için istenen ilişkileri toplu olarak ekle
+    detailed_courses = _hydrate_courses(courses_list, includes)
     return jsonify(detailed_courses), 200
 
 @courses_bp.route('/<int:course_id>', methods=['GET'])
@@ -405,6 +437,13 @@ def create_course():
             type: string
             description: Dersin verildiği dönem.
             example: "2024-Güz"
+          default_attributes:
+            type: array
+            items:
+              type: string
+              enum: ["age", "gender", "emotion"]
+            description: EMOTION/FACE_EMOTION yoklamalarında varsayılan olarak analiz edilecek yüz özellikleri (varsayılan ATTENDANCE_DEFAULT_ATTRIBUTES).
+            example: ["emotion"]
           teacher_id:
             type: integer
             description: Giriş yapan kullanıcı Admin ise zorunludur. Öğretmen ise bu alan yok sayılır.
@@ -476,6 +515,7 @@ def create_course():
         "name": course_data.name,
         "teacher_id": teacher_id, # Doğrulanmış/belirlenmiş teacher_id'yi kullan
         "semester": course_data.semester,
+        "default_attributes": course_data.default_attributes,
         "created_at": now,
         "updated_at": now
     }
@@ -610,6 +650,13 @@ def update_course(course_id):
             type: string
             description: Dersin yeni dönemi.
             example: "2024-Bahar-Güncel"
+          default_attributes:
+            type: array
+            items:
+              type: string
+              enum: ["age", "gender", "emotion"]
+            description: Yoklamalarda varsayılan olarak analiz edilecek yüz özellikleri. null gönderilirse ATTENDANCE_DEFAULT_ATTRIBUTES kullanılır.
+            example: ["emotion", "age"]
           # teacher_id: # Öğretmen değiştirme genellikle ayrı bir admin işlemidir
           lesson_times:
             type: array
@@ -776,9 +823,12 @@ def delete_course(course_id):
                 num_details_deleted += data_service.delete_many(ATTENDANCE_DETAILS_FILE, attendance_id=att_id)
             current_app.logger.info(f"{course_id} ID'li ders için {num_details_deleted} yoklama detayı silindi.")
 
-            # TODO: Varsa Emotion History kayıtlarını sil (attendance_id veya course_id ile)
-            # num_emotion_deleted = data_service.delete_many(EMOTION_HISTORY_FILE, course_id=course_id) # veya attendance_id ile döngü
-            # current_app.logger.info(f"{course_id} ID'li ders için {num_emotion_deleted} duygu geçmişi kaydı silindi.")
+            # Dersin duygu geçmişi kayıtlarını sil
+            num_emotion_deleted = data_service.delete_many(EMOTION_HISTORY_FILE, course_id=course_id)
+            current_app.logger.info(f"{course_id} ID'li ders için {num_emotion_deleted} duygu geçmişi kaydı silindi.")
+            data_service.delete_many(TEMPLATE_CANDIDATES_FILE, course_id=course_id)
+            data_service.delete_many(STUDENT_COURSE_STATS_FILE, course_id=course_id)
+            unknown_face_service.delete_course_clusters(course_id)
             
             # Ana Yoklama Kayıtlarını sil
             num_att_deleted = 0
@@ -790,8 +840,11 @@ def delete_course(course_id):
             
             # İsteğe bağlı: İlişkili yoklama fotoğraflarını dosya sisteminden sil
             for att_record in attendance_records:
-                photo_path = att_record.get('photo_path')
-                if photo_path:
+                # Çok fotoğraflı oturumlarda tüm fotoğraflar photo_paths içindedir
+                record_photo_paths = att_record.get('photo_paths') or [att_record.get('photo_path')]
+                for photo_path in record_photo_paths:
+                    if not photo_path:
+                        continue
                     # Tam yolu dikkatlice oluştur
                     # photo_path'ın /uploads/attendance/file.jpg gibi köke göre veya 
                     # sadece file.jpg gibi yüklendiği klasöre göre saklandığını varsayalım
@@ -849,7 +902,7 @@ def get_course_students(course_id):
         example: 1
     responses:
       200:
-        description: Derse kayıtlı öğrencilerin listesi (detaylı).
+        description: Derse kayıtlı öğrencilerin listesi (detaylı). Her öğrenci bu dersteki katılım özetini (attendance_stats) içerir.
         schema:
           type: array
           items:
@@ -870,6 +923,12 @@ def get_course_students(course_id):
                 last_name: "Kaya"
                 role: "STUDENT"
                 is_active: true
+              attendance_stats:
+                sessions: 12
+                present: 10
+                late: 1
+                last_seen: "2024-03-18"
+                rate: 0.9167
             # ... (diğer öğrenciler) ...
       401:
         description: Yetkisiz. Geçerli bir token sağlanmadı.
@@ -894,20 +953,22 @@ def get_course_students(course_id):
     # users.py veya schemas/user.py içinde tanımlanmış olmalı
     # Swagger UI'ın doğru modeli göstermesi için bu gerekli
     from app.schemas.user import StudentResponse as PydanticStudentResponse 
-    from app.routes.students import _get_student_with_user # Yardımcı fonksiyonu kullan
-
-    for student_dict in all_students:
-        if student_dict['id'] in student_ids:
-            detailed_student = _get_student_with_user(student_dict.copy()) # Orijinali bozmamak için kopya kullan
-            if detailed_student:
-                 # Pydantic modeline dönüştürerek şemaya uygunluğu garanti et (isteğe bağlı)
-                 try:
-                    # validated_student = PydanticStudentResponse(**detailed_student).dict()
-                    enrolled_students_details.append(detailed_student) # Şimdilik dict olarak ekle
-                 except ValidationError as p_err:
-                     current_app.logger.error(f"Öğrenci {student_dict['id']} verisi StudentResponse şemasına uymuyor: {p_err}")
-                     # Hatalı veriyi atla veya logla
-            
+
+    # Kayıtlı öğrencilerin kullanıcıları ve bu dersteki katılım özetleri birer okumada eklenir
+    student_id_set = set(student_ids)
+    # Özet satırı olmayan (eski) öğrenciler bir kez detaylardan sayılıp kaydedilir
+    stats_rows = attendance_stats_service.rows_for((student_id, course_id) for student_id in student_id_set)
+    stats_by_student = {student_id: row for (student_id, _), row in stats_rows.items()}
+    for detailed_student in hydrate_students([s for s in all_students if s['id'] in student_id_set]):
+        detailed_student['attendance_stats'] = attendance_stats_service.public_stats(stats_by_student.get(detailed_student['id']))
+        # Pydantic modeline dönüştürerek şemaya uygunluğu garanti et (isteğe bağlı)
+        try:
+            # validated_student = PydanticStudentResponse(**detailed_student).dict()
+            enrolled_students_details.append(detailed_student) # Şimdilik dict olarak ekle
+        except ValidationError as p_err:
+            current_app.logger.error(f"Öğrenci {detailed_student['id']} verisi StudentResponse şemasına uymuyor: {p_err}")
+            # Hatalı veriyi atla veya logla
+
     return jsonify(enrolled_students_details), 200
 
 @courses_bp.route('/<int:course_id>/students', methods=['POST'])
@@ -1113,9 +1174,31 @@ def get_course_attendance_records(course_id):
         required: true
         description: Yoklama kayıtları alınacak dersin ID'si.
         example: 1
+      - in: query
+        name: page
+        type: integer
+        required: false
+        default: 1
+        description: Sayfa numarası (per_page ile birlikte kullanılır).
+      - in: query
+        name: per_page
+        type: integer
+        required: false
+        description: Sayfa başına yoklama oturumu sayısı. Verilmezse tüm oturumlar döner.
+        example: 20
+      - in: query
+        name: summary_only
+        type: boolean
+        required: false
+        default: false
+        description: true ise öğrenci listeleri yerine sadece durum sayıları (status_counts) döner.
     responses:
       200:
-        description: Ders için yoklama kayıtlarının listesi (detaylı öğrenci bilgileriyle).
+        description: Ders için yoklama kayıtlarının listesi (detaylı öğrenci bilgileriyle). Toplam oturum sayısı X-Total-Count başlığında döner.
+        headers:
+          X-Total-Count:
+            type: integer
+            description: Sayfalamadan önceki toplam yoklama oturumu sayısı.
         schema:
           type: array
           items:
@@ -1162,6 +1245,10 @@ def get_course_attendance_records(course_id):
                 type: string
                 format: date-time
                 example: "2024-03-05T10:05:00Z"
+              status_counts:
+                type: object
+                description: Detay sayıları (data_service tarafından her detay yazımında güncellenir).
+                example: {"PRESENT": 21, "ABSENT": 2, "LATE": 2, "EXCUSED": 0}
               present_students:
                 type: array
                 description: Sınıfta var olan öğrencilerin detaylı listesi
@@ -1278,6 +1365,8 @@ def get_course_attendance_records(course_id):
             # ... (diğer yoklama kayıtları) ...
       401:
         description: Yetkisiz. Geçerli bir token sağlanmadı.
+      400:
+        description: Geçersiz sayfalama parametresi.
       403:
         description: Yasak. Kullanıcı bu kayıtları görme yetkisine sahip değil.
       404:
@@ -1289,64 +1378,100 @@ def get_course_attendance_records(course_id):
 
     # Yetkilendirme decorator tarafından halledilir
 
+    summary_only = request.args.get('summary_only', 'false').lower() in ('1', 'true', 'yes')
+    page = request.args.get('page', 1, type=int)
+    per_page = request.args.get('per_page', type=int)
+    if page < 1 or (per_page is not None and per_page < 1):
+        return jsonify({"message": "page ve per_page 1 veya daha büyük olmalıdır"}), 400
+
     # Ders için yoklama kayıtlarını getir
     attendance_records = data_service.find_many(ATTENDANCE_FILE, course_id=course_id)
     # Tarih/ders numarasına göre sırala
     attendance_records.sort(key=lambda x: (x.get('date',''), x.get('lesson_number', 0)))
-    
-    # Her bir yoklama kaydı için detaylı öğrenci bilgilerini al
+    total_records = len(attendance_records)
+    if per_page is not None:
+        attendance_records = attendance_records[(page - 1) * per_page:page * per_page]
+
+    # Sayfadaki yoklamaların detayları tek okumada attendance_id'ye göre gruplanır.
+    # summary_only ise sayılar kayıttaki status_counts'tan gelir; detaylar sadece sayaçları olmayan eski kayıtlar için okunur.
+    detail_attendance_ids = [
+        record.get('id') for record in attendance_records
+        if not summary_only or record.get('status_counts') is None
+    ]
+    details_by_attendance = {}
+    if detail_attendance_ids:
+        details_by_attendance = data_service.group_by(ATTENDANCE_DETAILS_FILE, 'attendance_id', detail_attendance_ids)
+
+    students = {}
+    users = {}
+    if not summary_only:
+        # Öğrenciler ve kullanıcıları, detay sayısından bağımsız olarak birer kez okunur
+        students = data_service.fetch_by_ids(
+            STUDENTS_FILE, (d.get('student_id') for details in details_by_attendance.values() for d in details)
+        )
+        users = data_service.fetch_by_ids(USERS_FILE, (student.get('user_id') for student in students.values()))
+
     detailed_records = []
     for record in attendance_records:
-        attendance_id = record.get('id')
-        
-        # Yoklama detaylarını al
-        details = data_service.find_many(ATTENDANCE_DETAILS_FILE, attendance_id=attendance_id)
-        
+        details = details_by_attendance.get(record.get('id'), [])
+        record_copy = record.copy()
+
+        if summary_only:
+            # Sadece durum sayıları döner, öğrenci listeleri eklenmez
+            if record_copy.get('status_counts') is None:
+                status_counts = dict.fromkeys(data_service.ATTENDANCE_STATUSES, 0)
+                for detail in details:
+                    status = detail.get('status')
+                    status_counts[status] = status_counts.get(status, 0) + 1
+                record_copy["status_counts"] = status_counts
+            detailed_records.append(record_copy)
+            continue
+
         # Var olan ve olmayan öğrenci listelerini oluştur
         present_students = []
         absent_students = []
-        
+
         for detail in details:
             student_id = detail.get('student_id')
-            student = data_service.find_one(STUDENTS_FILE, id=student_id)
-            
-            if student:
-                # Öğrenci kullanıcı bilgilerini al
-                user = data_service.find_one(USERS_FILE, id=student.get('user_id'))
-                
-                # Temel öğrenci bilgileri
-                student_info = {
-                    "id": student_id,
-                    "student_number": student.get('student_number')
-                }
-                
-                # Kullanıcı bilgilerini ekle (varsa)
-                if user:
-                    student_info.update({
-                        "first_name": user.get('first_name'),
-                        "last_name": user.get('last_name'),
-                        "email": user.get('email')
-                    })
-                
-                # Öğrencinin durumuna göre listeye ekle
-                if detail.get('status') == 'PRESENT':
-                    # Eğer öğrenci varsa, yoklama detaylarını da ekle
-                    student_info.update({
-                        "confidence": detail.get('confidence'),
-                        "emotion": detail.get('emotion'),
-                        "estimated_age": detail.get('estimated_age'),
-                        "estimated_gender": detail.get('estimated_gender')
-                    })
-                    present_students.append(student_info)
-                else:
-                    # Öğrenci yoksa, temel bilgileri yeterli
-                    absent_students.append(student_info)
-        
+            student = students.get(student_id)
+            if not student:
+                continue
+
+            # Temel öğrenci bilgileri
+            student_info = {
+                "id": student_id,
+                "student_number": student.get('student_number')
+            }
+
+            # Kullanıcı bilgilerini ekle (varsa)
+            user = users.get(student.get('user_id'))
+            if user:
+                student_info.update({
+                    "first_name": user.get('first_name'),
+                    "last_name": user.get('last_name'),
+                    "email": user.get('email')
+                })
+
+            # Öğrencinin durumuna göre listeye ekle
+            if detail.get('status') == 'PRESENT':
+                # Eğer öğrenci varsa, yoklama detaylarını da ekle
+                student_info.update({
+                    "confidence": detail.get('confidence'),
+                    "emotion": detail.get('emotion'),
+                    "estimated_age": detail.get('estimated_age'),
+                    "estimated_gender": detail.get('estimated_gender')
+                })
+                present_students.append(student_info)
+            else:
+                # Öğrenci yoksa, temel bilgileri yeterli
+                absent_students.append(student_info)
+
         # Yoklama kaydını detaylı bilgilerle güncelle
-        record_copy = record.copy()
         record_copy["present_students"] = present_students
         record_copy["absent_students"] = absent_students
-        
+
         detailed_records.append(record_copy)
 
-    return jsonify(detailed_records), 200 
\ No newline at end of file
+    response = jsonify(detailed_records)
+    response.headers['X-Total-Count'] = str(total_records)
+    return response, 200 
\ No newline at end of file
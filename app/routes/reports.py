@@ -3,7 +3,7 @@ from pydantic import ValidationError
 from collections import defaultdict
 import datetime
 
-from app.services import data_service
+from app.services import data_service, attendance_stats_service, face_service
 from app.schemas.attendance import (
     DailyAttendanceReportResponse, DailyAttendanceReportItem, 
     CourseEmotionReportResponse, StudentAttendanceReportResponse,
@@ -19,7 +19,7 @@ STUDENTS_FILE = 'students.json'
 STUDENT_COURSE_FILE = 'student_course.json'
 ATTENDANCE_FILE = 'attendance.json'
 ATTENDANCE_DETAILS_FILE = 'attendance_details.json'
-# EMOTION_HISTORY_FILE = 'emotion_history.json' # Duygu raporları için gerekli
+EMOTION_HISTORY_FILE = 'emotion_history.json' # Duygu olasılık ortalamaları için
 USERS_FILE = 'users.json' # Öğrenci kullanıcı detayları için
 
 @reports_bp.route('/attendance/daily', methods=['GET'])
@@ -109,7 +109,14 @@ def get_daily_attendance_report():
             type: integer
             description: O gün derste "YOK" olarak işaretlenen öğrenci sayısı.
             example: 1
-          # İhtiyaç halinde geciken/izinli sayıları eklenebilir
+          late_count:
+            type: integer
+            description: O gün derste "GEÇ" olarak işaretlenen öğrenci sayısı.
+            example: 0
+          excused_count:
+            type: integer
+            description: O gün derste "İZİNLİ" olarak işaretlenen öğrenci sayısı.
+            example: 0
       DailyAttendanceReportResponse:
         type: object
         description: Belirli bir tarih için tüm ilgili derslerin yoklama özetlerini içeren yanıt.
@@ -177,15 +184,18 @@ def get_daily_attendance_report():
         course_info = courses_to_report[c_id]
         processed_course_ids.add(c_id)
 
-        # Ana kayıttan sayıları al (detayları saymaktan daha verimli)
-        # Not: Bu sayılar manuel güncellemelerle güncel tutulmalıdır.
-        present_count = record.get('recognized_students', 0) # Tanınan = VAR varsayımı
-        absent_count = record.get('unrecognized_students', 0) # Tanınmayan = YOK varsayımı
-
-        # Alternatif: Ana kayıt sayıları güvenilir değilse detaylardan say
-        # details = data_service.find_many(ATTENDANCE_DETAILS_FILE, attendance_id=record.get('id'))
-        # present_count = sum(1 for d in details if d.get('status') == 'PRESENT')
-        # absent_count = sum(1 for d in details if d.get('status') == 'ABSENT')
+        # Sayılar ana kayıttaki status_counts'tan alınır; data_service her detay yazımında bunları günceller
+        status_counts = record.get('status_counts')
+        if status_counts is not None:
+            present_count = status_counts.get('PRESENT', 0)
+            absent_count = status_counts.get('ABSENT', 0)
+            late_count = status_counts.get('LATE', 0)
+            excused_count = status_counts.get('EXCUSED', 0)
+        else:
+            # Sayaçlardan önce oluşturulmuş kayıtlar (bkz. flask rebuild-counters)
+            present_count = record.get('recognized_students', 0) # Tanınan = VAR varsayımı
+            absent_count = record.get('unrecognized_students', 0) # Tanınmayan = YOK varsayımı
+            late_count = excused_count = 0
 
         report_items.append(
             DailyAttendanceReportItem(
@@ -193,7 +203,9 @@ def get_daily_attendance_report():
                 course_code=course_info.get('code', 'Bilinmiyor'),
                 course_name=course_info.get('name', 'Bilinmiyor'),
                 present_count=present_count,
-                absent_count=absent_count
+                absent_count=absent_count,
+                late_count=late_count,
+                excused_count=excused_count
             ).dict()
         )
         
@@ -307,6 +319,15 @@ def get_course_emotion_report(course_id):
               HAPPY: 150
               NEUTRAL: 85
               SAD: 20
+          average_emotion_scores:
+            type: object
+            description: Kayıtlı duygu olasılık vektörlerinin (emotion_history) tüm oturumlar boyunca ortalaması.
+            additionalProperties:
+                type: number
+            example:
+              happy: 0.52
+              neutral: 0.31
+              sad: 0.08
           timeline:
             type: array
             description: Her yoklama oturumu için duygu istatistikleri.
@@ -335,6 +356,11 @@ def get_course_emotion_report(course_id):
                     HAPPY: 12
                     NEUTRAL: 5
                     SAD: 2
+                average_emotion_scores:
+                  type: object
+                  description: O oturumdaki duygu olasılık vektörlerinin ortalaması (varsa).
+                  additionalProperties:
+                    type: number
     """
     course = data_service.find_one(COURSES_FILE, id=course_id)
     if not course:
@@ -354,6 +380,17 @@ def get_course_emotion_report(course_id):
     # Tarihe göre sırala
     attendance_records.sort(key=lambda x: (x.get('date', ''), x.get('lesson_number', 0)))
 
+    # Kayıtlı olasılık vektörlerinden ortalamalar (modeller yeniden çalıştırılmaz)
+    scores_by_attendance = defaultdict(list)
+    for history in data_service.find_many(EMOTION_HISTORY_FILE, course_id=course_id):
+        if history.get('emotion_scores') and len(history['emotion_scores']) == len(face_service.EMOTION_LABELS):
+            scores_by_attendance[history.get('attendance_id')].append(history['emotion_scores'])
+
+    def _average_scores(vectors):
+        if not vectors:
+            return None
+        return {label: round(sum(v[i] for v in vectors) / len(vectors), 4) for i, label in enumerate(face_service.EMOTION_LABELS)}
+
     for record in attendance_records:
         session_stats = defaultdict(int)
         # İlgili yoklama ID'sine ait detayları getir
@@ -374,7 +411,8 @@ def get_course_emotion_report(course_id):
                 "date": record.get('date'),
                 "lesson_number": record.get('lesson_number'),
                 "attendance_id": record.get('id'),
-                "emotion_stats": dict(session_stats) # defaultdict'u dict'e çevir
+                "emotion_stats": dict(session_stats), # defaultdict'u dict'e çevir
+                "average_emotion_scores": _average_scores(scores_by_attendance.get(record.get('id')))
             })
 
     # Eğer hiç duygu verisi kaydedilmemişse, 501 Not Implemented veya boş istatistik döndür
@@ -388,6 +426,7 @@ def get_course_emotion_report(course_id):
         course_code=course.get('code', 'Bilinmiyor'),
         course_name=course.get('name', 'Bilinmiyor'),
         overall_emotion_stats=dict(overall_stats), # defaultdict'u dict'e çevir
+        average_emotion_scores=_average_scores([v for vectors in scores_by_attendance.values() for v in vectors]),
         timeline=timeline
     )
     
@@ -419,6 +458,12 @@ def get_student_attendance_report(student_id):
         required: false
         description: İsteğe bağlı. Raporu belirli bir ders ID'si için filtreler.
         example: 1
+      - in: query
+        name: details
+        type: boolean
+        required: false
+        default: true
+        description: false ise oturum bazında durumlar (details) yüklenmez; sadece ders özetleri döner.
     responses:
       200:
         description: Öğrenci yoklama raporu başarıyla alındı.
@@ -449,6 +494,8 @@ def get_student_attendance_report(student_id):
                 rate: 0.95 # Bu dersteki katılım oranı
                 total_sessions: 20
                 present_sessions: 19
+                late_sessions: 1
+                last_seen: "2024-03-18"
                 details:
                   - attendance_id: 15
                     date: "2024-03-15"
@@ -545,16 +592,26 @@ def get_student_attendance_report(student_id):
             type: number
             format: float
             nullable: true
-            description: Bu dersteki katılım oranı (VAR / Toplam Oturum).
+            description: Bu dersteki katılım oranı ((VAR + GEÇ) / Toplam Oturum, 0-1 arası).
             example: 0.95
           total_sessions:
              type: integer
-             description: Bu ders için yapılan toplam yoklama oturumu sayısı.
+             description: Öğrencinin yoklama kaydı olan oturum sayısı.
              example: 20
           present_sessions:
              type: integer
-             description: Öğrencinin "VAR" olduğu oturum sayısı.
+             description: Öğrencinin "VAR" veya "GEÇ" olduğu oturum sayısı.
              example: 19
+          late_sessions:
+             type: integer
+             description: Öğrencinin "GEÇ" olduğu oturum sayısı.
+             example: 1
+          last_seen:
+             type: string
+             format: date
+             nullable: true
+             description: Öğrencinin katıldığı son oturumun tarihi.
+             example: "2024-03-18"
           details:
             type: array
             description: Öğrencinin bu dersteki her yoklama oturumu için durumu.
@@ -594,6 +651,7 @@ def get_student_attendance_report(student_id):
     if not student: return jsonify({"message": "Öğrenci bulunamadı"}), 404
     
     course_id_filter = request.args.get('course_id', type=int)
+    include_details = request.args.get('details', 'true').lower() in ('1', 'true', 'yes')
     target_course_ids = []
     courses_info = {}
 
@@ -621,69 +679,45 @@ def get_student_attendance_report(student_id):
               
         target_course_ids = [e['course_id'] for e in enrollments]
         # Hedef derslerin temel bilgilerini getir
-        all_courses = data_service.read_data(COURSES_FILE)
-        courses_info = {c['id']: c for c in all_courses if c['id'] in target_course_ids}
-
-    # Öğrenci için TÜM yoklama detaylarını getir
-    all_student_details = data_service.find_many(ATTENDANCE_DETAILS_FILE, student_id=student_id)
-    
-    # İlgili ana yoklama kayıtlarını getir (ders_id ve tarih için)
-    # Sadece öğrencinin detaylarının ait olduğu ana kayıtları almak daha verimli olabilir
-    relevant_attendance_ids = {d['attendance_id'] for d in all_student_details}
-    all_attendance_records = data_service.read_data(ATTENDANCE_FILE)
-    # Sadece ilgili olanları map'te tut
-    attendance_record_map = {att['id']: att for att in all_attendance_records if att['id'] in relevant_attendance_ids}
+        courses_info = data_service.fetch_by_ids(COURSES_FILE, target_course_ids)
+
+    # Ders başına sayılar materyalize özet tablosundan (student_course_stats) okunur; detaylar yeniden sayılmaz.
+    # Tabloda henüz satırı olmayan (eski) öğrenci-ders çiftleri bir kez detaylardan sayılıp kaydedilir.
+    stats_rows = attendance_stats_service.rows_for((student_id, course_id) for course_id in target_course_ids)
+    stats_by_course = {course_id: row for (_, course_id), row in stats_rows.items()}
+
+    # Oturum bazında durumlar sadece istenirse yüklenir (öğrencinin detayları + ilgili oturumlar, birer okuma)
+    details_by_course = defaultdict(list)
+    if include_details:
+        all_student_details = data_service.find_many(ATTENDANCE_DETAILS_FILE, student_id=student_id)
+        attendance_record_map = data_service.fetch_by_ids(ATTENDANCE_FILE, (d.get('attendance_id') for d in all_student_details))
+        for detail in all_student_details:
+            att_record = attendance_record_map.get(detail.get('attendance_id'))
+            if not att_record or att_record.get('course_id') not in courses_info:
+                continue
+            details_by_course[att_record['course_id']].append({
+                "attendance_id": detail.get('attendance_id'),
+                "date": att_record.get('date'),
+                "status": detail.get('status')
+            })
 
     course_reports = []
     total_present = 0
     total_sessions = 0
 
-    present_statuses = ["PRESENT", "LATE"] # VAR sayılacak durumlar
-
     for course_id in target_course_ids:
         course_info = courses_info.get(course_id)
         if not course_info: continue # Ders bilgisi bulunamazsa atla (tutarlılık sorunu)
 
-        course_details_short = []
-        course_present_count = 0
-        course_session_count = 0
-
-        # *Bu derse* ait yoklama oturumlarını bul
-        # Ana kayıtları ders ID'sine göre filtrele
-        course_attendance_sessions = {att_id: att_rec for att_id, att_rec in attendance_record_map.items() if att_rec.get('course_id') == course_id}
-        course_attendance_ids = set(course_attendance_sessions.keys())
-        
-        if course_attendance_ids:
-             course_session_count = len(course_attendance_ids)
-             # Öğrencinin detaylarını bu dersin oturumları için filtrele
-             student_details_for_course = [
-                 detail for detail in all_student_details 
-                 if detail.get('attendance_id') in course_attendance_ids
-             ]
-             
-             for detail in student_details_for_course:
-                 att_record = course_attendance_sessions.get(detail['attendance_id'])
-                 # AttendanceDetailResponseShort şemasına uygun kısa rapor oluştur
-                 detail_short_report = {
-                      "attendance_id": detail.get('attendance_id'),
-                      "date": att_record.get('date') if att_record else None,
-                      "status": detail.get('status')
-                      # İstenirse başka alanlar eklenebilir (örn. confidence)
-                 }
-                 # Schema None değerlere izin vermiyorsa kaldır (isteğe bağlı)
-                 # detail_short_report = {k: v for k, v in detail_short_report.items() if v is not None}
-                 
-                 course_details_short.append(detail_short_report)
-                 # VAR sayılacak durumlardan biri mi kontrol et (.get ile güvenli)
-                 if detail.get('status') in present_statuses:
-                     course_present_count += 1
-
-        # Ders için katılım oranını hesapla
-        course_rate = (course_present_count / course_session_count * 100) if course_session_count > 0 else None # Yüzde olarak
+        stats = stats_by_course.get(course_id) or {}
+        course_session_count = stats.get('sessions', 0)
+        # VAR sayılacak durumlar: PRESENT ve LATE
+        course_present_count = stats.get('present', 0) + stats.get('late', 0)
         total_present += course_present_count
         total_sessions += course_session_count
 
         # Detayları tarihe göre sırala (en yeniden eskiye)
+        course_details_short = details_by_course.get(course_id, [])
         course_details_short.sort(key=lambda x: x.get('date') or '', reverse=True)
 
         course_reports.append(
@@ -691,15 +725,17 @@ def get_student_attendance_report(student_id):
                 course_id=course_id,
                 course_code=course_info.get('code', 'Bilinmiyor'),
                 course_name=course_info.get('name', 'Bilinmiyor'),
-                rate=round(course_rate, 2) if course_rate is not None else None, # Oranı yuvarla
+                rate=stats.get('rate'), # 0-1 arası oran
                 total_sessions=course_session_count,
                 present_sessions=course_present_count,
+                late_sessions=stats.get('late', 0),
+                last_seen=stats.get('last_seen'),
                 details=course_details_short
             ).dict()
         )
 
     # Genel katılım oranını hesapla
-    overall_rate = (total_present / total_sessions * 100) if total_sessions > 0 else None
+    overall_rate = (total_present / total_sessions) if total_sessions > 0 else None
 
     # Yanıt için öğrenci bilgilerini hazırla
     from app.routes.students import _get_student_with_user # Yardımcıyı yeniden kullan
@@ -712,7 +748,7 @@ def get_student_attendance_report(student_id):
 
     response = StudentAttendanceReportResponse(
         student_info=student_info_response, # Hazırlanan dict'i kullan
-        overall_attendance_rate=round(overall_rate, 2) if overall_rate is not None else None, # Oranı yuvarla
+        overall_attendance_rate=round(overall_rate, 4) if overall_rate is not None else None, # Oranı yuvarla
         course_reports=course_reports
     )
 
@@ -1,16 +1,18 @@
 import os
-from flask import Blueprint, request, jsonify, current_app
+import json
+from flask import Blueprint, request, jsonify, current_app, Response, stream_with_context
 from pydantic import ValidationError
 from werkzeug.utils import secure_filename
 import datetime
 
 from flask_jwt_extended import jwt_required
 
-from app.services import data_service, face_service
+from app.services import data_service, face_service, enrollment_service
 from app.schemas.user import StudentResponse, StudentUpdate, StudentFaceUploadResponse, UserResponse
 from app.schemas.course import CourseResponse # For listing student courses
 from app.models.user import Student, default_datetime
 from app.utils.auth import admin_required, teacher_required, student_required, get_current_user_role_and_id, self_or_admin_required
+from app.utils.hydration import hydrate_students
 
 students_bp = Blueprint('students_bp', __name__)
 
@@ -19,18 +21,16 @@ STUDENTS_FILE = 'students.json'
 STUDENT_COURSE_FILE = 'student_course.json'
 COURSES_FILE = 'courses.json'
 ATTENDANCE_DETAILS_FILE = 'attendance_details.json'
+EMOTION_HISTORY_FILE = 'emotion_history.json'
+TEMPLATE_CANDIDATES_FILE = 'template_candidates.json'
+STUDENT_COURSE_STATS_FILE = 'student_course_stats.json'
 
 def _get_student_with_user(student_dict):
     """Yardımcı fonksiyon: Öğrenci detaylarına kullanıcı bilgilerini ekler ve hassas verileri çıkarır."""
     if not student_dict:
         return None
-    user = data_service.find_one(USERS_FILE, id=student_dict.get('user_id'))
-    if user:
-        user.pop('password_hash', None)
-        student_dict['user'] = user
-    # Genel yanıtlardan yüz kodlamalarını güvenlik/kısalık için kaldır
-    student_dict.pop('face_encodings', None)
-    return student_dict
+    # Tek öğrenci için toplu hidratörü kullan (yüz kodlamaları genel yanıtlardan çıkarılır)
+    return hydrate_students([student_dict])[0]
 
 @students_bp.route('/', methods=['GET'])
 @teacher_required # Admin ve Öğretmenlerin listeyi görmesine izin ver
@@ -138,7 +138,7 @@ def get_students():
                   description: Öğrenciye ait kullanıcı hesabı detayları.
     """
     students_list = data_service.read_data(STUDENTS_FILE)
-    detailed_students = [_get_student_with_user(s.copy()) for s in students_list] # Kopya kullanmak iyi pratik
+    detailed_students = hydrate_students(students_list) # Kullanıcılar tek okumada eklenir
     return jsonify(detailed_students), 200
 
 @students_bp.route('/<int:student_id>', methods=['GET'])
@@ -230,45 +230,10 @@ def get_student(student_id):
     # Yetkilendirme decorator tarafından kontrol edilir
     detailed_student = _get_student_with_user(student.copy())
 
-    # --- Analyze Age and Gender --- 
-    estimated_age = None
-    estimated_gender = None
-    face_url = detailed_student.get('face_photo_url')
-
-    if face_url:
-        try:
-            # Convert relative URL to absolute path
-            # Assumes FACE_UPLOAD_FOLDER is configured correctly and accessible
-            # Note: face_photo_url might contain the base upload folder already or not.
-            # Adjust path joining logic based on how URLs are stored.
-            # Example Logic: If URL starts with configured static path segment
-            
-            # Simplistic approach: Assume URL is relative to upload folder base
-            # This needs careful adjustment based on your actual URL structure and file saving logic
-            upload_folder = current_app.config.get('FACE_UPLOAD_FOLDER') # Get abs path from config
-            if upload_folder:
-                 # Extract filename from URL (handle potential leading slashes)
-                 filename = os.path.basename(face_url.strip('/'))
-                 absolute_image_path = os.path.join(upload_folder, filename)
-
-                 if os.path.exists(absolute_image_path):
-                    analysis_result = face_service.analyze_age_and_gender(absolute_image_path)
-                    if analysis_result:
-                        estimated_age = analysis_result.get('age')
-                        estimated_gender = analysis_result.get('gender')
-                 else:
-                     current_app.logger.warning(f"Face photo file not found at expected path: {absolute_image_path} (derived from URL: {face_url})")
-            else:
-                 current_app.logger.error("FACE_UPLOAD_FOLDER is not configured.")
-
-        except Exception as e:
-            # Log error but don't fail the request, just return no age/gender
-            current_app.logger.error(f"Error analyzing age/gender for student {student_id} from {face_url}: {e}")
-    
-    # Add results to the response dictionary
-    detailed_student['estimated_age'] = estimated_age
-    detailed_student['estimated_gender'] = estimated_gender
-    # --- End Analyze Age and Gender ---
+    # Yaş/cinsiyet tahmini yüz fotoğrafı yüklenirken hesaplanıp kayda yazılır (bkz. upload_student_face);
+    # profil okumaları hiçbir modeli çalıştırmaz
+    detailed_student.setdefault('estimated_age', None)
+    detailed_student.setdefault('estimated_gender', None)
 
     return jsonify(detailed_student), 200
 
@@ -455,7 +420,10 @@ def delete_student(student_id):
         # Basamaklı silme mantığına daha sağlam bir şekilde ihtiyaç olup olmadığını düşünün.
         num_attendance_details_deleted = data_service.delete_many(ATTENDANCE_DETAILS_FILE, student_id=student_id)
         current_app.logger.info(f"{student_id} ID'li öğrenci için {num_attendance_details_deleted} yoklama detayı silindi.")
-        # TODO: Varsa Emotion History kayıtlarını da sil
+        num_emotion_deleted = data_service.delete_many(EMOTION_HISTORY_FILE, student_id=student_id)
+        current_app.logger.info(f"{student_id} ID'li öğrenci için {num_emotion_deleted} duygu geçmişi kaydı silindi.")
+        data_service.delete_many(TEMPLATE_CANDIDATES_FILE, student_id=student_id)
+        data_service.delete_many(STUDENT_COURSE_STATS_FILE, student_id=student_id)
 
         # 3. Öğrenci profilini sil
         deleted_student = data_service.delete_item(STUDENTS_FILE, student_id)
@@ -552,10 +520,12 @@ def upload_student_face(student_id):
           - Dosya türü desteklenmiyor (izin verilenler: jpg, jpeg, png).
           - Yüklenen resimde yüz tespit edilemedi.
           - Yüz kodlaması çıkarılamadı.
+          - Fotoğraf kalite kontrolünden geçemedi (reasons: blurry, face_too_small, too_dark, too_bright, head_turned, head_tilted).
         examples:
           application/json (No File): { "message": "İstekte dosya bölümü yok" }
           application/json (Invalid Type): { "message": "Dosya türüne izin verilmiyor..." }
           application/json (No Face): { "message": "Yüklenen resimde yüz tespit edilemedi." }
+          application/json (Low Quality): { "message": "Fotoğraf kalitesi yüz kaydı için yetersiz...", "reasons": ["blurry"], "quality": {"blur": 23.4, "face_size": 142, "brightness": 118.0, "yaw": 0.04, "roll": 2.1, "score": 0.61, "reasons": ["blurry"]} }
     definitions:
       StudentFaceUploadResponse:
           type: object
@@ -575,6 +545,19 @@ def upload_student_face(student_id):
                   type: integer
                   description: Yüzü yüklenen öğrencinin ID'si.
                   example: 5
+              quality_score:
+                  type: number
+                  format: float
+                  description: Fotoğrafın 0-1 arası kalite puanı (eşleştirmede kodlamayı ağırlıklandırmak için saklanır).
+                  example: 0.87
+              estimated_age:
+                  type: integer
+                  description: Fotoğraftan tahmin edilen yaş (öğrenci kaydında saklanır).
+                  example: 22
+              estimated_gender:
+                  type: string
+                  description: Fotoğraftan tahmin edilen cinsiyet (öğrenci kaydında saklanır).
+                  example: "Woman"
     """
     # --- Custom Authorization Check (REMOVED as per user request) ---
     # current_role, current_user_id = get_current_user_role_and_id()
@@ -614,17 +597,35 @@ def upload_student_face(student_id):
             
             # Mevcut implementasyon: dosyayı doğrudan işle
             file.seek(0) # Stream'i başa sar
-            encodings = face_service.find_face_encodings(file) # Bu, dosya içeriğini okur
+            # Kodlamadan önce ucuz kalite kontrolleri (bulanıklık, yüz boyutu, parlaklık, poz) yapılır
+            prepared = face_service.prepare_enrollment_face(file.read())
 
-            if not encodings:
+            if prepared['face_count'] == 0:
                 return jsonify({"message": "Yüklenen resimde yüz bulunamadı."}), 400
-            if len(encodings) > 1:
+            if prepared['face_count'] > 1:
                  # Politika: Profil fotoğrafları için birden fazla yüz içeren resimleri reddet
                  return jsonify({"message": "Resimde birden fazla yüz bulundu. Lütfen sadece bir yüz içeren bir resim yükleyin."}), 400
-
+            quality = prepared['quality']
+            if not prepared['encodings']:
+                return jsonify({
+                    "message": "Fotoğraf kalitesi yüz kaydı için yetersiz. Lütfen net, iyi aydınlatılmış ve kameraya dönük bir fotoğraf yükleyin.",
+                    "reasons": quality['reasons'],
+                    "quality": quality
+                }), 400
+
+            encodings = prepared['encodings']
             face_encoding = encodings[0] # İlk (ve tek) kodlamayı kullan
             encoding_str = face_service.encode_encodings_for_json([face_encoding])
 
+            # Yaş/cinsiyet tahmini sadece fotoğraf değiştiğinde (burada) bir kez hesaplanır
+            estimated = None
+            try:
+                # Kayıt için bulunan yüz kırpımı kullanılır; fotoğraf yeniden işlenmez
+                estimated = face_service.analyze_age_and_gender(prepared['face_crop'])
+            except Exception as analysis_e:
+                # Tahmin başarısız olsa da yüz kaydı devam eder
+                current_app.logger.error(f"{student_id} ID'li öğrenci için yaş/cinsiyet tahmini başarısız: {analysis_e}")
+
             # --- Dosyayı Kaydet --- 
             # Önce eski fotoğrafı silmek iyi bir pratik olabilir
             old_photo_path = student.get('face_photo_url')
@@ -660,7 +661,12 @@ def upload_student_face(student_id):
             # Öğrenci kaydını kodlama ve fotoğraf URL'si ile güncelle
             updates = {
                 "face_encodings": encoding_str,
+                "face_encoding_versions": [face_service.get_encoding_version()],
+                "face_encoding_qualities": [quality['score']], # Eşleştirmede kodlamayı ağırlıklandırır
                 "face_photo_url": face_photo_url,
+                "estimated_age": estimated.get('age') if estimated else None,
+                "estimated_gender": estimated.get('gender') if estimated else None,
+                **enrollment_service.template_reset_fields(), # Eski fotoğrafa göre öğrenilen şablonlar atılır
                 "updated_at": default_datetime()
             }
             updated_student = data_service.update_item(STUDENTS_FILE, student_id, updates)
@@ -673,7 +679,10 @@ def upload_student_face(student_id):
                 message="Yüz tanıma işlemi başarılı.",
                 face_photo_url=face_photo_url,
                 encodings_count=len(encodings),
-                student_id=student_id
+                student_id=student_id,
+                quality_score=quality['score'],
+                estimated_age=updates['estimated_age'],
+                estimated_gender=updates['estimated_gender']
             )
             return jsonify(response_data.dict()), 200
 
@@ -691,6 +700,64 @@ def upload_student_face(student_id):
         return jsonify({"message": f"Dosya türüne izin verilmiyor. İzin verilenler: {allowed_extensions_str}"}), 400
 
 
+@students_bp.route('/faces/bulk', methods=['POST'])
+@admin_required
+def bulk_upload_student_faces():
+    """
+    Bir ZIP arşivindeki fotoğraflarla çok sayıda öğrencinin yüzünü tek istekte kaydeder.
+    Dosyalar öğrenci numarasıyla adlandırılmalıdır (örn. 20231045.jpg). Fotoğraflar paralel
+    süreçlerde kodlanır, her dosyanın sonucu işlendikçe NDJSON satırı olarak akıtılır ve tüm
+    kodlamalar sonunda students.json dosyasına tek seferde yazılır. Son satır özet içerir.
+    ---
+    tags:
+      - Öğrenciler (Students)
+      - Yüz Tanıma (Face Recognition)
+    security:
+      - Bearer: []
+    consumes:
+      - multipart/form-data
+    produces:
+      - application/x-ndjson
+    parameters:
+      - in: formData
+        name: file
+        type: file
+        required: true
+        description: Öğrenci numarasıyla adlandırılmış yüz fotoğraflarını içeren ZIP arşivi (her fotoğrafta tek yüz).
+    responses:
+      200:
+        description: |-
+          Dosya başına bir JSON satırı, ardından özet satırı. Örnek:
+          {"file": "20231045.jpg", "student_number": "20231045", "student_id": 5, "status": "encoded"}
+          {"file": "20231046.jpg", "student_number": "20231046", "status": "error", "message": "no face found"}
+          {"summary": {"total": 2, "enrolled": 1, "failed": 1}}
+      400:
+        description: Dosya yok, ZIP değil veya arşivde çok fazla fotoğraf var.
+      401:
+        description: Yetkisiz.
+      403:
+        description: Yasak (Sadece Admin).
+    """
+    if 'file' not in request.files:
+        return jsonify({"message": "İstekte dosya bölümü yok"}), 400
+    file = request.files['file']
+    if file.filename == '':
+        return jsonify({"message": "Seçili dosya yok"}), 400
+    if not file.filename.lower().endswith('.zip'):
+        return jsonify({"message": "Dosya türüne izin verilmiyor. Sadece ZIP arşivi kabul edilir."}), 400
+
+    try:
+        results = enrollment_service.bulk_enroll_faces(file.read())
+    except ValueError as ve:
+        return jsonify({"message": str(ve)}), 400
+
+    def generate():
+        for result in results:
+            yield json.dumps(result, ensure_ascii=False) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+
 @students_bp.route('/<int:student_id>/courses', methods=['GET'])
 @self_or_admin_required(resource_id_param='student_id', resource_type='student') # Öğrencinin kendisi veya Admin
 def get_student_courses(student_id):
@@ -8,8 +8,9 @@ from app.schemas.user import TeacherResponse, TeacherUpdate, UserCreate, UserRes
 from app.schemas.course import CourseResponse # CourseResponse'u import et
 from app.models.user import Teacher, User, default_datetime
 from app.utils.auth import admin_required, teacher_required, self_or_admin_required
+from app.utils.hydration import hydrate_teachers
 # Ders saati bilgilerini çekmek için yardımcı fonksiyonu import edelim
-from app.routes.courses import _get_course_details, LESSON_TIMES_FILE
+from app.routes.courses import _get_course_details, _hydrate_courses
 
 teachers_bp = Blueprint('teachers_bp', __name__)
 
@@ -21,12 +22,7 @@ def _get_teacher_with_user(teacher_dict):
     """Yardımcı fonksiyon: Kullanıcı detaylarını alır ve öğretmen detaylarıyla birleştirir."""
     if not teacher_dict:
         return None
-    user = data_service.find_one(USERS_FILE, id=teacher_dict.get('user_id'))
-    if user:
-        # Şifre hash'inin dahil edilmediğinden emin olun
-        user.pop('password_hash', None)
-        teacher_dict['user'] = user
-    return teacher_dict
+    return hydrate_teachers([teacher_dict])[0] # password_hash hidratörde çıkarılır
 
 @teachers_bp.route('/', methods=['GET'])
 @teacher_required # Admin ve Öğretmenlerin listeyi görmesine izin ver
@@ -144,7 +140,7 @@ def get_teachers():
                   description: Öğretmene ait kullanıcı hesabı detayları.
     """
     teachers_list = data_service.read_data(TEACHERS_FILE)
-    detailed_teachers = [_get_teacher_with_user(t.copy()) for t in teachers_list] # Kopya kullan
+    detailed_teachers = hydrate_teachers(teachers_list) # Kullanıcılar tek okumada eklenir
     # Tutarlı yanıt yapısı için Pydantic kullan (isteğe bağlı ama iyi)
     # result = [TeacherResponse.from_orm(Teacher(**t)).dict() for t in detailed_teachers if t]
     return jsonify(detailed_teachers), 200
@@ -541,23 +537,6 @@ def get_teacher_courses(teacher_id):
     # Öğretmene ait tüm dersleri bul
     courses = data_service.find_many(COURSES_FILE, teacher_id=teacher_id)
     
-    # Her ders için ders saati bilgilerini ekle
-    detailed_courses = []
-    for course in courses:
-        # Her bir course dictionary'si için kopyasını al
-        course_copy = course.copy()
-        
-        # Ders saatlerini bul
-        lesson_times = data_service.find_many(LESSON_TIMES_FILE, course_id=course['id'])
-        
-        # Ders saatlerini ekle
-        course_copy['lesson_times'] = lesson_times
-        
-        # Detaylı ders listesine ekle
-        detailed_courses.append(course_copy)
-    
-    # Alternatif olarak _get_course_details fonksiyonunu kullanabilirsiniz:
-    # detailed_courses = [_get_course_details(course.copy()) for course in courses]
-    # Bu durumda öğretmen bilgisi de eklenecektir (muhtemelen gereksiz)
-    
+    # Ders saatlerini tüm dersler için tek okumada ekle (öğretmen bilgisi burada gereksiz)
+    detailed_courses = _hydrate_courses([course.copy() for course in courses], includes=('lesson_times',))
     return jsonify(detailed_courses), 200 
\ No newline at end of file
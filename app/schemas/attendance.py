@@ -4,10 +4,11 @@ import datetime
 
 # Re-use UserResponse, StudentResponse etc. if needed by importing
 from .user import StudentResponse # Assuming user schemas are defined
-from .course import CourseResponse # Assuming course schemas are defined
+from .course import CourseResponse, normalize_attributes # Assuming course schemas are defined
 
 VALID_ATTENDANCE_STATUS = ["PRESENT", "ABSENT", "LATE", "EXCUSED"]
 VALID_ATTENDANCE_TYPES = ["FACE", "EMOTION", "FACE_EMOTION", "MANUAL"]
+VALID_DETECTION_MODES = ["standard", "tiled"]
 
 class AttendanceDetailBase(BaseModel):
     student_id: int
@@ -15,9 +16,12 @@ class AttendanceDetailBase(BaseModel):
     confidence: Optional[float] = Field(None, ge=0.0, le=1.0)
     emotion: Optional[str] = None
     emotion_confidence: Optional[float] = Field(None, ge=0.0, le=1.0)
+    emotion_scores: Optional[List[float]] = None # Probabilities in face_service.EMOTION_LABELS order
     emotion_statistics: Optional[Dict[str, float]] = None
     estimated_age: Optional[int] = None
     estimated_gender: Optional[str] = None
+    spoof_suspected: Optional[bool] = None # Set only when the liveness check ran
+    spoof_reasons: Optional[List[str]] = None
 
     @validator('status')
     def status_must_be_valid(cls, v):
@@ -58,6 +62,29 @@ class AttendanceCreate(BaseModel):
     date: datetime.date
     type: str = Field(..., description=f"Must be one of {VALID_ATTENDANCE_TYPES}")
     # file: UploadFile = File(...) # Handled separately in Flask route
+    detection_mode: str = Field("standard", description=f"One of {VALID_DETECTION_MODES}")
+    tile_size: Optional[int] = Field(None, ge=200)
+    tile_overlap: Optional[int] = Field(None, ge=0)
+    # Comma separated in form data, e.g. "emotion,age"; None falls back to the course default
+    attributes: Optional[List[str]] = None
+    # Attributes are analyzed for matched faces only unless this is set
+    analyze_unmatched: bool = False
+    # Photo-of-photo heuristics before matching (photo sessions); None falls back to ATTENDANCE_LIVENESS_CHECK
+    liveness_check: Optional[bool] = None
+
+    @validator('attributes', pre=True)
+    def attributes_must_be_valid(cls, v):
+        return normalize_attributes(v)
+
+    @validator('detection_mode')
+    def detection_mode_must_be_valid(cls, v):
+        if v.lower() not in VALID_DETECTION_MODES:
+            raise ValueError(f'Detection mode must be one of {VALID_DETECTION_MODES}')
+        return v.lower()
+
+class AttendanceVideoCreate(AttendanceCreate):
+    # Schema for the POST /api/attendance/video endpoint (form data)
+    sample_fps: Optional[float] = Field(None, gt=0, le=30)
 
 class AttendanceManualUpdate(BaseModel):
     # Schema for POST /api/attendance/{id}/students/{sid}
@@ -71,9 +98,11 @@ class AttendanceManualUpdate(BaseModel):
 
 class AttendanceResponse(AttendanceBase):
     id: int
+    photo_paths: List[str] = [] # All photos of a multi-photo session (photo_path is the first)
     total_students: Optional[int] = None
     recognized_students: Optional[int] = None
     unrecognized_students: Optional[int] = None
+    status_counts: Optional[Dict[str, int]] = None # Detail counts per status (PRESENT, ABSENT, LATE, EXCUSED)
     emotion_statistics: Optional[Dict[str, int]] = None
     created_by: int # User ID (Teacher)
     created_at: datetime.datetime
@@ -96,8 +125,13 @@ class AttendanceResultDetail(BaseModel):
     status: str
     confidence: Optional[float] = None
     emotion: Optional[str] = None
+    emotion_confidence: Optional[float] = None
+    emotion_scores: Optional[List[float]] = None # face_service.EMOTION_LABELS sırasında duygu olasılıkları
     estimated_age: Optional[int] = None
     estimated_gender: Optional[str] = None
+    emotion_statistics: Optional[Dict[str, float]] = None # Öğrenci bazlı duygu dağılımı (video yoklaması)
+    spoof_suspected: Optional[bool] = None # Canlılık kontrolü çalıştıysa: yüz fotoğraf/ekran gibi görünüyor mu
+    spoof_reasons: Optional[List[str]] = None # 'moire', 'size'
     student: Optional[StudentInfo] = None  # Öğrenci detaylarını ekledik
 
 class AttendanceResultSummary(BaseModel):
@@ -106,6 +140,10 @@ class AttendanceResultSummary(BaseModel):
     recognized_count: int
     unrecognized_count: int
     total_students: int  # Toplam öğrenci sayısı eklendi
+    image_count: int = 1 # Oturumda işlenen fotoğraf sayısı
+    detected_face_count: Optional[int] = None # Tüm fotoğraflarda tespit edilen yüz sayısı
+    frame_count: Optional[int] = None # Video yoklamasında işlenen kare sayısı
+    suspicious_face_count: Optional[int] = None # Canlılık kontrolünde şüpheli bulunan yüz sayısı
     emotion_statistics: Optional[Dict[str, int]] = None # Added field for overall stats
     results: List[AttendanceResultDetail] # Use the specific model here
 
@@ -117,6 +155,8 @@ class EmotionHistoryBase(BaseModel):
     emotion: str
     confidence: float = Field(..., ge=0.0, le=1.0)
     timestamp: datetime.datetime
+    attendance_id: Optional[int] = None
+    emotion_scores: Optional[List[float]] = None # Probabilities in face_service.EMOTION_LABELS order
 
 class EmotionHistoryCreate(EmotionHistoryBase):
     # Used internally
@@ -136,7 +176,8 @@ class DailyAttendanceReportItem(BaseModel):
     course_name: str
     present_count: int
     absent_count: int
-    # Add more fields as needed (late, excused, etc.)
+    late_count: int = 0
+    excused_count: int = 0
 
 class DailyAttendanceReportResponse(BaseModel):
     date: datetime.date
@@ -147,13 +188,25 @@ class CourseEmotionReportResponse(BaseModel):
     course_code: str
     course_name: str
     overall_emotion_stats: Dict[str, int]
-    timeline: List[Dict[str, Any]] # List of {"date": ..., "emotion_stats": {...}}
+    average_emotion_scores: Optional[Dict[str, float]] = None # Mean probability per emotion over all sessions
+    timeline: List[Dict[str, Any]] # List of {"date": ..., "emotion_stats": {...}, "average_emotion_scores": {...}}
+
+class AttendanceDetailShort(BaseModel):
+    # Per-session status in the student attendance report
+    attendance_id: int
+    date: Optional[str] = None
+    status: str
 
 class StudentAttendanceCourseReport(BaseModel):
     course_id: int
     course_code: str
-    rate: Optional[float] = Field(None, ge=0.0, le=1.0)
-    details: List[AttendanceDetailResponse] # List all attendance details for this course
+    course_name: Optional[str] = None
+    rate: Optional[float] = Field(None, ge=0.0, le=1.0) # (present + late) / total_sessions
+    total_sessions: int = 0
+    present_sessions: int = 0 # PRESENT or LATE
+    late_sessions: int = 0
+    last_seen: Optional[str] = None # Date of the last attended session
+    details: List[AttendanceDetailShort] = [] # Only when the report is requested with details
 
 class StudentAttendanceReportResponse(BaseModel):
     student_info: StudentResponse
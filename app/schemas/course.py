@@ -7,6 +7,19 @@ import re # For time validation
 from .user import UserResponse, TeacherResponse, StudentResponse # Assuming user schemas are defined
 
 VALID_DAYS = ["MONDAY", "TUESDAY", "WEDNESDAY", "THURSDAY", "FRIDAY", "SATURDAY", "SUNDAY"]
+VALID_ATTRIBUTES = ["age", "gender", "emotion"] # Face attributes that can be analyzed in attendance sessions
+
+def normalize_attributes(v):
+    """Accepts a list or a comma separated string of attributes; returns a de-duplicated list in canonical order."""
+    if v is None:
+        return None
+    if isinstance(v, str):
+        v = [item for item in v.split(',') if item.strip()]
+    requested = {str(item).strip().lower() for item in v}
+    invalid = requested - set(VALID_ATTRIBUTES)
+    if invalid:
+        raise ValueError(f'Attributes must be a subset of {VALID_ATTRIBUTES}')
+    return [attribute for attribute in VALID_ATTRIBUTES if attribute in requested]
 
 class LessonTimeBase(BaseModel):
     lesson_number: int = Field(..., gt=0)
@@ -45,6 +58,11 @@ class CourseBase(BaseModel):
     code: str = Field(..., min_length=3)
     name: str = Field(..., min_length=3)
     semester: str
+    default_attributes: Optional[List[str]] = None # Attributes analyzed in EMOTION/FACE_EMOTION sessions by default
+
+    @validator('default_attributes', pre=True)
+    def default_attributes_must_be_valid(cls, v):
+        return normalize_attributes(v)
 
 class CourseCreate(CourseBase):
     teacher_id: Optional[int] = None # Make teacher_id optional in schema
@@ -54,6 +72,11 @@ class CourseUpdate(BaseModel):
     code: Optional[str] = Field(None, min_length=3)
     name: Optional[str] = Field(None, min_length=3)
     semester: Optional[str] = None
+    default_attributes: Optional[List[str]] = None
+
+    @validator('default_attributes', pre=True)
+    def default_attributes_must_be_valid(cls, v):
+        return normalize_attributes(v)
     # Potentially allow updating teacher_id or lesson_times (more complex)
     lesson_times: Optional[List[LessonTimeCreate]] = None # Allow replacing lesson times
 
@@ -102,4 +102,7 @@ class StudentResponse(StudentBase):
 class StudentFaceUploadResponse(BaseModel):
     message: str
     face_photo_url: Optional[str]
-    student_id: int 
\ No newline at end of file
+    student_id: int
+    quality_score: Optional[float] = None # Enrollment photo quality (0-1)
+    estimated_age: Optional[int] = None
+    estimated_gender: Optional[str] = None 
\ No newline at end of file
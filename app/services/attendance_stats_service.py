@@ -0,0 +1,175 @@
+from typing import Any, Dict, Iterable, List, Optional
+
+from app.models.user import default_datetime
+from app.services import data_service
+
+STUDENT_COURSE_STATS_FILE = 'student_course_stats.json'
+ATTENDANCE_FILE = 'attendance.json'
+ATTENDANCE_DETAILS_FILE = 'attendance_details.json'
+
+ATTENDED_STATUSES = ('PRESENT', 'LATE') # Statuses counted as attended in rates
+
+# One row per (student_id, course_id) with the student's attendance in that course:
+# sessions (sessions the student has a detail in), present, late, last_seen (date of the last
+# attended session) and rate ((present + late) / sessions). Rows are updated incrementally when
+# attendance is taken or corrected, so reports read one row per course instead of all details.
+
+
+def _new_row(student_id: int, course_id: int) -> Dict[str, Any]:
+    return {"student_id": student_id, "course_id": course_id, "sessions": 0, "present": 0, "late": 0,
+            "last_seen": None, "rate": None}
+
+
+def _apply_status(row: Dict[str, Any], date: Optional[str], old_status: Optional[str], new_status: Optional[str]) -> bool:
+    """
+    Moves one session of the row from old_status to new_status (None: no detail).
+    Returns False if last_seen can no longer be known from the row alone.
+    """
+    row['sessions'] += (new_status is not None) - (old_status is not None)
+    for status, change in ((old_status, -1), (new_status, 1)):
+        if status == 'PRESENT':
+            row['present'] += change
+        elif status == 'LATE':
+            row['late'] += change
+    row['rate'] = round((row['present'] + row['late']) / row['sessions'], 4) if row['sessions'] > 0 else None
+    if new_status in ATTENDED_STATUSES:
+        if date and (row['last_seen'] is None or date > row['last_seen']):
+            row['last_seen'] = date
+        return True
+    # The last attended session was un-attended: the previous one is only in the details
+    return not (old_status in ATTENDED_STATUSES and date is not None and date == row['last_seen'])
+
+
+def _count_rows(selected, course_ids: Optional[set] = None, pairs: Iterable[tuple] = ()) -> Dict[tuple, Dict[str, Any]]:
+    """
+    Counts rows from the attendance records and their details: {(student_id, course_id): row}
+    for every selected pair with details, plus a (possibly empty) row for each given pair.
+    course_ids limits the sessions read.
+    """
+    sessions = {
+        record['id']: record for record in data_service.read_data(ATTENDANCE_FILE)
+        if course_ids is None or record.get('course_id') in course_ids
+    }
+    rows = {pair: _new_row(*pair) for pair in pairs}
+    # Oldest session first so last_seen ends up at the latest attended date
+    details = sorted(
+        (d for d in data_service.read_data(ATTENDANCE_DETAILS_FILE) if d.get('attendance_id') in sessions),
+        key=lambda d: sessions[d['attendance_id']].get('date') or ''
+    )
+    for detail in details:
+        session = sessions[detail['attendance_id']]
+        key = (detail.get('student_id'), session.get('course_id'))
+        if not detail.get('status') or not selected(*key):
+            continue
+        row = rows.setdefault(key, _new_row(*key))
+        _apply_status(row, session.get('date'), None, detail['status'])
+    return rows
+
+
+def _add_missing_rows(all_rows: List[Dict[str, Any]], pairs: Iterable[tuple]) -> Dict[tuple, Dict[str, Any]]:
+    """
+    Counts the rows of the given pairs that are not in all_rows yet (students and courses with
+    sessions from before the table existed, or none at all) from the details and appends them to
+    all_rows. Returns {pair: row} for the added rows; the caller writes all_rows.
+    """
+    existing = {(row.get('student_id'), row.get('course_id')) for row in all_rows}
+    missing = {pair for pair in pairs if pair not in existing}
+    if not missing:
+        return {}
+    rows = _count_rows(lambda *pair: pair in missing, {course_id for _, course_id in missing}, missing)
+    now = default_datetime()
+    next_id = max((row.get('id', 0) for row in all_rows), default=0) + 1
+    for row in rows.values():
+        row['id'] = next_id
+        row['updated_at'] = now
+        next_id += 1
+        all_rows.append(row)
+    return rows
+
+
+def record_session(course_id: int, date: str, details: Iterable[Dict[str, Any]]) -> int:
+    """
+    Adds a new attendance session (its detail records, already stored) to the students' rows
+    of the course with a single read and write. Students without a row yet are counted from
+    all their details in the course, this session included. Returns the number of rows updated.
+    """
+    details = [d for d in details if d.get('student_id') is not None and d.get('status')]
+    if not details:
+        return 0
+    now = default_datetime()
+    all_rows = data_service.read_data(STUDENT_COURSE_STATS_FILE)
+    rows = {row['student_id']: row for row in all_rows if row.get('course_id') == course_id}
+    added = _add_missing_rows(all_rows, [(detail['student_id'], course_id) for detail in details])
+    for detail in details:
+        if (detail['student_id'], course_id) in added:
+            continue # Already counted from the details
+        row = rows[detail['student_id']]
+        _apply_status(row, date, None, detail['status'])
+        row['updated_at'] = now
+    data_service.write_data(STUDENT_COURSE_STATS_FILE, all_rows)
+    return len(details)
+
+
+def update_student_status(course_id: int, student_id: int, date: Optional[str],
+                          old_status: Optional[str], new_status: str) -> Dict[str, Any]:
+    """
+    Applies a manual status change of one session (old_status None if the student had no
+    detail in it) to the student's row. Returns the updated row.
+    """
+    row = data_service.find_one(STUDENT_COURSE_STATS_FILE, student_id=student_id, course_id=course_id)
+    if row is None:
+        # No row yet (e.g. sessions taken before the table existed): counted from the details
+        return rows_for([(student_id, course_id)])[(student_id, course_id)]
+    if old_status == new_status:
+        return row
+    if not _apply_status(row, date, old_status, new_status):
+        rebuild_stats(course_id=course_id, student_ids=[student_id])
+        return data_service.find_one(STUDENT_COURSE_STATS_FILE, student_id=student_id, course_id=course_id)
+    row['updated_at'] = default_datetime()
+    return data_service.update_item(STUDENT_COURSE_STATS_FILE, row['id'], row)
+
+
+def rebuild_stats(course_id: Optional[int] = None, student_ids: Optional[List[int]] = None) -> int:
+    """
+    Recounts the rows (of one course and/or some students, or all) from the attendance records
+    and their details, e.g. after sessions were rolled back. Returns the number of rows written.
+    """
+    student_filter = set(student_ids) if student_ids is not None else None
+
+    def selected(row_student_id, row_course_id):
+        return ((course_id is None or row_course_id == course_id)
+                and (student_filter is None or row_student_id in student_filter))
+
+    rows = _count_rows(selected, {course_id} if course_id is not None else None)
+    now = default_datetime()
+    all_rows = [row for row in data_service.read_data(STUDENT_COURSE_STATS_FILE)
+                if not selected(row.get('student_id'), row.get('course_id'))]
+    next_id = max((row.get('id', 0) for row in all_rows), default=0) + 1
+    for row in rows.values():
+        row['id'] = next_id
+        row['updated_at'] = now
+        next_id += 1
+        all_rows.append(row)
+    data_service.write_data(STUDENT_COURSE_STATS_FILE, all_rows)
+    return len(rows)
+
+
+def rows_for(pairs: Iterable[tuple]) -> Dict[tuple, Dict[str, Any]]:
+    """
+    Rows of the given (student_id, course_id) pairs as {pair: row}, with a single read when
+    all rows exist. Missing rows (data from before the table existed, or pairs without
+    sessions) are counted from the details once and stored, so later reads find them.
+    """
+    pairs = set(pairs)
+    all_rows = data_service.read_data(STUDENT_COURSE_STATS_FILE)
+    if _add_missing_rows(all_rows, pairs):
+        data_service.write_data(STUDENT_COURSE_STATS_FILE, all_rows)
+    return {(row.get('student_id'), row.get('course_id')): row for row in all_rows
+            if (row.get('student_id'), row.get('course_id')) in pairs}
+
+
+def public_stats(row: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """API view of a row (None if the student has no sessions yet)."""
+    if not row or not row.get('sessions'):
+        return None
+    return {key: row.get(key) for key in ('sessions', 'present', 'late', 'last_seen', 'rate')}
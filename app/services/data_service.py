@@ -1,7 +1,7 @@
 import os
 import json
 import threading
-from typing import List, Dict, Optional, Any
+from typing import List, Dict, Optional, Any, Iterable
 from flask import current_app
 
 # Simple file-based locking mechanism
@@ -9,6 +9,15 @@ from flask import current_app
 _locks = {}
 _lock_lock = threading.Lock()
 
+ATTENDANCE_STATUSES = ('PRESENT', 'ABSENT', 'LATE', 'EXCUSED')
+
+# Counters kept on parent records and maintained by every write to the child file, so readers
+# never have to recount the children:
+# child file -> (parent file, foreign key, counted field, counter field, counted values)
+_COUNTERS = {
+    'attendance_details.json': ('attendance.json', 'attendance_id', 'status', 'status_counts', ATTENDANCE_STATUSES),
+}
+
 def _get_file_lock(file_path: str) -> threading.Lock:
     """Returns a lock specific to a file path."""
     with _lock_lock:
@@ -23,6 +32,72 @@ def _get_file_path(file_name: str) -> str:
         file_name += '.json'
     return os.path.join(current_app.config['DATA_DIR'], file_name)
 
+def _counter_spec(file_name: str) -> Optional[tuple]:
+    if not file_name.endswith('.json'):
+        file_name += '.json'
+    return _COUNTERS.get(file_name)
+
+def _count_children(spec: tuple, children: List[Dict[str, Any]]) -> Dict[str, int]:
+    """Counts the given children of one parent from scratch."""
+    _, _, field_name, _, values = spec
+    counts = {value: 0 for value in values}
+    for child in children:
+        if child.get(field_name) is not None:
+            counts[child[field_name]] = counts.get(child[field_name], 0) + 1
+    return counts
+
+def _update_counters(file_name: str, removed: List[Dict[str, Any]], added: List[Dict[str, Any]],
+                     child_data: List[Dict[str, Any]]) -> None:
+    """
+    Applies a write to a counted child file to the counters of its parents: removed are the
+    children (as they were) leaving the counts, added the children entering them. Parents
+    written before they had counters are counted once from child_data (the file after the write).
+    """
+    spec = _counter_spec(file_name)
+    if spec is None or not (removed or added):
+        return
+    parent_file, foreign_key, field_name, counter_field, _ = spec
+    deltas: Dict[Any, Dict[str, int]] = {}
+    for sign, children in ((-1, removed), (1, added)):
+        for child in children:
+            if child.get(field_name) is None:
+                continue
+            delta = deltas.setdefault(child.get(foreign_key), {})
+            delta[child[field_name]] = delta.get(child[field_name], 0) + sign
+
+    parents = read_data(parent_file)
+    changed = False
+    for parent in parents:
+        delta = {value: change for value, change in deltas.get(parent.get('id'), {}).items() if change}
+        if not delta:
+            continue
+        if parent.get(counter_field) is None:
+            counts = _count_children(spec, [child for child in child_data if child.get(foreign_key) == parent['id']])
+        else:
+            counts = dict(parent[counter_field])
+            for value, change in delta.items():
+                counts[value] = max(0, counts.get(value, 0) + change)
+        parent[counter_field] = counts
+        changed = True
+    if changed:
+        write_data(parent_file, parents)
+
+def rebuild_counters(file_name: str) -> int:
+    """
+    Recounts the counters maintained for a child file (see _COUNTERS) on all parent records,
+    e.g. for records created before the counters existed. Returns the number of parents updated.
+    """
+    spec = _counter_spec(file_name)
+    if spec is None:
+        raise ValueError(f"No counters are maintained for {file_name}")
+    parent_file, foreign_key, _, counter_field, _ = spec
+    children_by_parent = group_by(file_name, foreign_key)
+    parents = read_data(parent_file)
+    for parent in parents:
+        parent[counter_field] = _count_children(spec, children_by_parent.get(parent.get('id'), []))
+    write_data(parent_file, parents)
+    return len(parents)
+
 def read_data(file_name: str) -> List[Dict[str, Any]]:
     """Reads all data from a JSON file."""
     file_path = _get_file_path(file_name)
@@ -84,6 +159,39 @@ def find_many(file_name: str, **kwargs) -> List[Dict[str, Any]]:
             results.append(item)
     return results
 
+def fetch_by_ids(file_name: str, ids: Iterable[Any]) -> Dict[Any, Dict[str, Any]]:
+    """Loads the items with the given IDs in a single read. Returns {id: item}; unknown IDs are left out."""
+    wanted = {item_id for item_id in ids if item_id is not None}
+    if not wanted:
+        return {}
+    return {item['id']: item for item in read_data(file_name) if item.get('id') in wanted}
+
+def group_by(file_name: str, key: str, values: Optional[Iterable[Any]] = None) -> Dict[Any, List[Dict[str, Any]]]:
+    """
+    Groups the items of file_name by item[key] in a single read. Returns {value: [items]}
+    in file order; if values is given only those groups are kept.
+    """
+    wanted = None if values is None else set(values)
+    groups: Dict[Any, List[Dict[str, Any]]] = {}
+    for item in read_data(file_name):
+        value = item.get(key)
+        if wanted is None or value in wanted:
+            groups.setdefault(value, []).append(item)
+    return groups
+
+def join(rows: List[Dict[str, Any]], file_name: str, key: str, as_field: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    Attaches the item of file_name referenced by row[key] to every row, loading all referenced
+    items with a single read (instead of one find_one per row). The item is stored under
+    as_field (default: key without '_id', e.g. 'student_id' -> 'student'); None if it does not exist.
+    Returns the same rows.
+    """
+    as_field = as_field or (key[:-3] if key.endswith('_id') else key)
+    related = fetch_by_ids(file_name, (row.get(key) for row in rows))
+    for row in rows:
+        row[as_field] = related.get(row.get(key))
+    return rows
+
 def add_item(file_name: str, item: Dict[str, Any], assign_id: bool = True) -> Dict[str, Any]:
     """Adds a new item to the data file, assigning a new ID if requested."""
     data = read_data(file_name)
@@ -103,14 +211,30 @@ def add_item(file_name: str, item: Dict[str, Any], assign_id: bool = True) -> Di
 
     data.append(item)
     write_data(file_name, data)
+    _update_counters(file_name, [], [item], data)
     return item
 
+def add_items(file_name: str, items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Adds several new items with a single read and write, assigning consecutive IDs."""
+    if not items:
+        return []
+    data = read_data(file_name)
+    next_id = max((item.get('id', 0) for item in data), default=0) + 1
+    for item in items:
+        item['id'] = next_id
+        next_id += 1
+    data.extend(items)
+    write_data(file_name, data)
+    _update_counters(file_name, [], items, data)
+    return items
+
 def update_item(file_name: str, item_id: int, updates: Dict[str, Any]) -> Optional[Dict[str, Any]]:
     """Updates an existing item identified by its ID."""
     data = read_data(file_name)
     updated = False
     for i, item in enumerate(data):
         if item.get('id') == item_id:
+            previous = dict(item)
             # Prevent changing the ID via update
             updates.pop('id', None)
             item.update(updates)
@@ -120,9 +244,28 @@ def update_item(file_name: str, item_id: int, updates: Dict[str, Any]) -> Option
 
     if updated:
         write_data(file_name, data)
+        _update_counters(file_name, [previous], [data[i]], data)
         return data[i] # Return the updated item
     return None # Item not found
 
+def update_items(file_name: str, updates_by_id: Dict[int, Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Updates several items (item ID -> updates) with a single read and write. Returns the updated items."""
+    if not updates_by_id:
+        return []
+    data = read_data(file_name)
+    previous_items = []
+    updated_items = []
+    for item in data:
+        updates = updates_by_id.get(item.get('id'))
+        if updates:
+            previous_items.append(dict(item))
+            item.update({key: value for key, value in updates.items() if key != 'id'})
+            updated_items.append(item)
+    if updated_items:
+        write_data(file_name, data)
+        _update_counters(file_name, previous_items, updated_items, data)
+    return updated_items
+
 def delete_item(file_name: str, item_id: int) -> bool:
     """Deletes an item identified by its ID."""
     data = read_data(file_name)
@@ -132,6 +275,7 @@ def delete_item(file_name: str, item_id: int) -> bool:
 
     if len(new_data) < initial_length:
         write_data(file_name, new_data)
+        _update_counters(file_name, [item for item in data if item.get('id') == item_id], [], new_data)
         return True # Deletion successful
     return False # Item not found
 
@@ -140,12 +284,16 @@ def delete_many(file_name: str, **kwargs) -> int:
     data = read_data(file_name)
     initial_length = len(data)
     # Keep items that *don't* match all criteria
-    new_data = [
-        item for item in data
-        if not all(item.get(key) == value for key, value in kwargs.items())
-    ]
+    new_data = []
+    deleted = []
+    for item in data:
+        if all(item.get(key) == value for key, value in kwargs.items()):
+            deleted.append(item)
+        else:
+            new_data.append(item)
 
     if len(new_data) < initial_length:
         write_data(file_name, new_data)
+        _update_counters(file_name, deleted, [], new_data)
         return initial_length - len(new_data) # Return number of deleted items
     return 0 # No items matched 
\ No newline at end of file
@@ -0,0 +1,383 @@
+import io
+import os
+import random
+import datetime
+import zipfile
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from typing import Any, Dict, Iterable, Iterator, Optional
+
+import numpy as np
+from flask import current_app
+from werkzeug.utils import secure_filename
+
+from app.models.user import default_datetime
+from app.services import data_service, face_service
+
+STUDENTS_FILE = 'students.json'
+ATTENDANCE_DETAILS_FILE = 'attendance_details.json'
+TEMPLATE_CANDIDATES_FILE = 'template_candidates.json'
+
+# Detail statuses that confirm an automatic match; a matched detail later set to any
+# other status was corrected by a teacher and counts as a false accept
+CONFIRMED_STATUSES = ('PRESENT', 'LATE')
+
+
+def face_photo_url(filename: str) -> str:
+    """Web URL of a photo saved in FACE_UPLOAD_FOLDER (same layout as single uploads)."""
+    upload_dir = current_app.config['FACE_UPLOAD_FOLDER']
+    relative_url_part = os.path.relpath(upload_dir, current_app.static_folder if current_app.static_folder else current_app.root_path)
+    return f"/{relative_url_part.replace(os.sep, '/')}/{filename}"
+
+
+def _archive_entries(archive: zipfile.ZipFile):
+    """Image entries of the archive in file name order (directories and hidden files skipped)."""
+    return sorted(
+        (info for info in archive.infolist()
+         if not info.is_dir() and face_service.allowed_file(info.filename)
+         and not os.path.basename(info.filename).startswith('.')),
+        key=lambda info: info.filename
+    )
+
+
+def bulk_enroll_faces(archive_bytes: bytes, workers: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Enrolls face photos from a ZIP archive whose files are named by student_number
+    (e.g. 20231045.jpg). Photos are encoded in a process pool and one result dict is
+    yielded per file as it completes; all successful encodings are then committed to
+    students.json in a single batched write and a final {'summary': {...}} is yielded.
+
+    The archive is validated before this returns, so errors surface before streaming starts.
+
+    Raises:
+        ValueError: If the archive is invalid or has too many files.
+    """
+    max_files = current_app.config.get('BULK_ENROLLMENT_MAX_FILES', 5000)
+    try:
+        archive = zipfile.ZipFile(io.BytesIO(archive_bytes))
+    except zipfile.BadZipFile:
+        raise ValueError("Uploaded archive is not a valid ZIP file.")
+    entries = _archive_entries(archive)
+    if len(entries) > max_files:
+        archive.close()
+        raise ValueError(f"Archive contains {len(entries)} photos; at most {max_files} are allowed per request.")
+    return _enroll_archive(archive, entries, workers)
+
+
+def _enroll_archive(archive: zipfile.ZipFile, entries, workers: Optional[int]) -> Iterator[Dict[str, Any]]:
+    """Generator behind bulk_enroll_faces."""
+    max_file_bytes = current_app.config.get('BULK_ENROLLMENT_MAX_FILE_BYTES', 20 * 1024 * 1024)
+    workers = workers or current_app.config.get('BULK_ENROLLMENT_WORKERS') or os.cpu_count()
+
+    with archive:
+        students_by_number = {
+            str(student.get('student_number')): student
+            for student in data_service.read_data(STUDENTS_FILE) if student.get('student_number')
+        }
+        version = face_service.get_encoding_version()
+        upload_dir = current_app.config['FACE_UPLOAD_FOLDER']
+        os.makedirs(upload_dir, exist_ok=True)
+        timestamp = datetime.datetime.now().strftime('%Y%m%d%H%M%S')
+
+        pending_updates = {} # student_id -> record updates, written once at the end
+        saved_paths = []
+        old_photo_paths = []
+        failed = 0
+        seen_numbers = set()
+
+        def _error(info, student_number, message):
+            return {"file": info.filename, "student_number": student_number, "status": "error", "message": message}
+
+        jobs = []
+        for info in entries:
+            student_number = os.path.splitext(os.path.basename(info.filename))[0]
+            student = students_by_number.get(student_number)
+            if not student:
+                failed += 1
+                yield _error(info, student_number, "No student with this student_number.")
+            elif student_number in seen_numbers:
+                failed += 1
+                yield _error(info, student_number, "Duplicate photo for this student in the archive.")
+            elif info.file_size > max_file_bytes:
+                failed += 1
+                yield _error(info, student_number, "File is too large.")
+            else:
+                seen_numbers.add(student_number)
+                jobs.append((info, student))
+
+        # Bounded number of in-flight photos so the whole archive is not decoded/pickled at once
+        max_in_flight = max(1, workers) * 4
+        with ProcessPoolExecutor(max_workers=workers, initializer=face_service._init_pipeline_worker) as pool:
+            in_flight = {}
+            job_iter = iter(jobs)
+            while True:
+                while len(in_flight) < max_in_flight:
+                    job = next(job_iter, None)
+                    if job is None:
+                        break
+                    info, student = job
+                    future = pool.submit(face_service.encode_enrollment_photo, info.filename, archive.read(info))
+                    in_flight[future] = job
+                if not in_flight:
+                    break
+
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    info, student = in_flight.pop(future)
+                    _, result, error = future.result()
+                    if error or not result or not result['encodings']:
+                        failed += 1
+                        yield _error(info, student['student_number'], error or "No face encoding could be extracted.")
+                        continue
+
+                    extension = info.filename.rsplit('.', 1)[1].lower()
+                    filename = secure_filename(f"student_{student['id']}_{timestamp}.{extension}")
+                    file_path = os.path.join(upload_dir, filename)
+                    with open(file_path, 'wb') as f:
+                        f.write(archive.read(info))
+                    saved_paths.append(file_path)
+                    if student.get('face_photo_url'):
+                        old_photo_paths.append(os.path.join(upload_dir, os.path.basename(student['face_photo_url'].strip('/'))))
+
+                    encodings = result['encodings']
+                    pending_updates[student['id']] = {
+                        "face_encodings": face_service.encode_encodings_for_json([np.asarray(e) for e in encodings]),
+                        "face_encoding_versions": [version] * len(encodings),
+                        "face_encoding_qualities": [result['quality']['score']] * len(encodings),
+                        "face_photo_url": face_photo_url(filename),
+                        # Estimates belong to the previous photo; they are refreshed on the next single upload
+                        "estimated_age": None,
+                        "estimated_gender": None,
+                        **template_reset_fields(),
+                        "updated_at": default_datetime()
+                    }
+                    yield {"file": info.filename, "student_number": student['student_number'],
+                           "student_id": student['id'], "status": "encoded", "quality": result['quality']['score']}
+
+    try:
+        committed = len(data_service.update_items(STUDENTS_FILE, pending_updates))
+    except Exception as e:
+        current_app.logger.error(f"Bulk enrollment commit failed: {e}")
+        for path in saved_paths:
+            if os.path.exists(path):
+                os.remove(path)
+        yield {"summary": {"total": len(entries), "enrolled": 0, "failed": len(entries), "error": "Saving the encodings failed."}}
+        return
+
+    for path in old_photo_paths:
+        if path not in saved_paths and os.path.exists(path):
+            try:
+                os.remove(path)
+            except OSError as e:
+                current_app.logger.warning(f"Could not delete replaced face photo {path}: {e}")
+
+    current_app.logger.info(f"Bulk enrollment: {committed} students enrolled, {failed} files failed.")
+    yield {"summary": {"total": len(entries), "enrolled": committed, "failed": failed}}
+
+
+def calibrate_match_thresholds(student_ids: Optional[Iterable[int]] = None) -> Dict[int, float]:
+    """
+    Learns each student's match_threshold (see face_service.compute_match_threshold) and
+    stores it on the student record. Genuine distances come from confirmed automatic matches
+    in attendance_details (confidence = 1 - match distance); impostor distances from matches
+    teachers corrected and from the nearest enrollment encoding of every other student.
+
+    Args:
+        student_ids: Students to calibrate; all students with current encodings if None.
+
+    Returns:
+        {student_id: threshold} for the updated students.
+    """
+    students = data_service.read_data(STUDENTS_FILE)
+    known_encodings = []
+    known_labels = []
+    for student in students:
+        try:
+            encodings = face_service.get_current_encodings(student, include_templates=True)
+        except Exception as e:
+            current_app.logger.error(f"Could not decode face encodings of student {student.get('id')}: {e}")
+            continue
+        known_encodings.extend(encodings)
+        known_labels.extend([student['id']] * len(encodings))
+    if not known_encodings:
+        return {}
+
+    targets = set(known_labels) if student_ids is None else set(known_labels) & set(student_ids)
+    genuine = defaultdict(list)
+    impostor = defaultdict(list)
+    for detail in data_service.read_data(ATTENDANCE_DETAILS_FILE):
+        if detail.get('student_id') not in targets or detail.get('confidence') is None:
+            continue
+        distance = 1.0 - detail['confidence']
+        (genuine if detail.get('status') in CONFIRMED_STATUSES else impostor)[detail['student_id']].append(distance)
+
+    known = np.asarray(known_encodings)
+    labels = np.asarray(known_labels)
+    default_tolerance = current_app.config.get('FACE_RECOGNITION_TOLERANCE', 0.6)
+    thresholds = {}
+    for student_id in targets:
+        own = labels == student_id
+        if not own.all():
+            distances = face_service.face_distance_matrix(known[own], known)
+            impostor[student_id].append(float(distances[:, ~own].min()))
+        thresholds[student_id] = face_service.compute_match_threshold(
+            genuine[student_id], impostor[student_id], default_tolerance
+        )
+
+    now = default_datetime()
+    data_service.update_items(STUDENTS_FILE, {
+        student_id: {"match_threshold": threshold, "updated_at": now} for student_id, threshold in thresholds.items()
+    })
+    return thresholds
+
+
+def template_reset_fields() -> Dict[str, Any]:
+    """
+    Student updates that drop the adaptive templates. Applied whenever the enrollment encodings
+    are replaced (new photo, re-encoding, enrolled unknown face cluster), so templates learned
+    for the old encodings are not mixed with the new ones.
+    """
+    return {"template_encodings": None, "template_version": None, "template_seen": 0, "template_attendance_ids": []}
+
+
+def _template_attendance_ids(student: Dict[str, Any], count: int) -> list:
+    """Attendance session of each of the student's `count` current templates (None if unknown)."""
+    ids = list(student.get('template_attendance_ids') or [])
+    return (ids + [None] * count)[:count]
+
+
+def update_templates(encodings_by_student: Dict[int, Any], attendance_id: Optional[int] = None) -> int:
+    """
+    Adds confirmed match encodings to the students' adaptive template sets, so that matching
+    follows appearance drift without reprocessing photos. Each set keeps at most
+    FACE_TEMPLATE_MAX encodings as a uniform reservoir sample of all confirmed matches
+    (template_seen counts them); sets of another encoding version are restarted. The session
+    each template came from is kept in template_attendance_ids, so a template can be removed
+    when its match is corrected (see remove_session_template).
+    All students are updated with a single read and write of students.json.
+
+    Returns:
+        Number of students whose template set changed.
+    """
+    if not encodings_by_student:
+        return 0
+    max_templates = current_app.config.get('FACE_TEMPLATE_MAX', 5)
+    version = face_service.get_encoding_version()
+    now = default_datetime()
+
+    updates = {}
+    for student in data_service.read_data(STUDENTS_FILE):
+        encoding = encodings_by_student.get(student['id'])
+        if encoding is None:
+            continue
+        templates = face_service.get_current_templates(student)
+        sources = _template_attendance_ids(student, len(templates))
+        seen = student.get('template_seen', 0) if student.get('template_version') == version else 0
+        seen += 1
+        if len(templates) < max_templates:
+            templates.append(np.asarray(encoding))
+            sources.append(attendance_id)
+        else:
+            slot = random.randrange(seen)
+            if slot >= max_templates:
+                updates[student['id']] = {"template_seen": seen} # Counted, but not sampled
+                continue
+            templates[slot] = np.asarray(encoding)
+            sources[slot] = attendance_id
+        updates[student['id']] = {
+            "template_encodings": face_service.encode_encodings_for_json(templates),
+            "template_version": version,
+            "template_seen": seen,
+            "template_attendance_ids": sources,
+            "updated_at": now
+        }
+
+    data_service.update_items(STUDENTS_FILE, updates)
+    return sum(1 for update in updates.values() if 'template_encodings' in update)
+
+
+def record_attendance_matches(course_id: int, attendance_id: int, matches: Dict[int, Dict[str, Any]]) -> None:
+    """
+    Feeds the encodings of an attendance session's matches into the template sets.
+    Matches with confidence >= FACE_TEMPLATE_MIN_CONFIDENCE update the templates right away;
+    the others are kept in template_candidates.json until a teacher confirms or rejects
+    them through the manual attendance update (see resolve_template_candidate).
+
+    Args:
+        matches: {student_id: {'confidence': float, 'encoding': encoding or None, ...}}
+    """
+    if not current_app.config.get('FACE_TEMPLATE_UPDATES', True):
+        return
+    min_confidence = current_app.config.get('FACE_TEMPLATE_MIN_CONFIDENCE', 0.55)
+    version = face_service.get_encoding_version()
+    now = default_datetime()
+
+    confirmed = {}
+    candidates = []
+    for student_id, match in matches.items():
+        encoding = match.get('encoding')
+        if encoding is None or match.get('confidence') is None:
+            continue
+        if (match.get('liveness') or {}).get('suspicious'):
+            continue # Possibly a photo of the student; never learned from
+        if match['confidence'] >= min_confidence:
+            confirmed[student_id] = encoding
+        else:
+            candidates.append({
+                "attendance_id": attendance_id,
+                "course_id": course_id,
+                "student_id": student_id,
+                "encoding": np.asarray(encoding).tolist(),
+                "encoding_version": version,
+                "confidence": match['confidence'],
+                "created_at": now
+            })
+
+    updated = update_templates(confirmed, attendance_id)
+    data_service.add_items(TEMPLATE_CANDIDATES_FILE, candidates)
+    current_app.logger.info(f"Attendance {attendance_id}: {updated} template sets updated, {len(candidates)} candidates awaiting confirmation.")
+
+
+def remove_session_template(attendance_id: int, student_id: int) -> bool:
+    """
+    Removes the template the student's match in an attendance session contributed, e.g. after
+    a teacher corrected that match (a false accept must not keep pulling the face towards the
+    student). Returns True if a template was removed.
+    """
+    student = data_service.find_one(STUDENTS_FILE, id=student_id)
+    if not student:
+        return False
+    templates = face_service.get_current_templates(student)
+    sources = _template_attendance_ids(student, len(templates))
+    if attendance_id not in sources:
+        return False
+    slot = sources.index(attendance_id)
+    del templates[slot]
+    del sources[slot]
+    data_service.update_item(STUDENTS_FILE, student_id, {
+        "template_encodings": face_service.encode_encodings_for_json(templates),
+        "template_seen": max(0, student.get('template_seen', 0) - 1),
+        "template_attendance_ids": sources,
+        "updated_at": default_datetime()
+    })
+    return True
+
+
+def resolve_template_candidate(attendance_id: int, student_id: int, confirmed: bool) -> bool:
+    """
+    Applies a teacher's decision on a student's match in an attendance session to the
+    templates: a pending candidate is promoted (confirmed=True) or discarded, and a rejected
+    match that already became a template is removed again. Returns True if the student's
+    template set changed.
+    """
+    if not confirmed:
+        removed = remove_session_template(attendance_id, student_id)
+        data_service.delete_many(TEMPLATE_CANDIDATES_FILE, attendance_id=attendance_id, student_id=student_id)
+        return removed
+    candidate = data_service.find_one(TEMPLATE_CANDIDATES_FILE, attendance_id=attendance_id, student_id=student_id)
+    if not candidate:
+        return False
+    data_service.delete_item(TEMPLATE_CANDIDATES_FILE, candidate['id'])
+    if candidate.get('encoding_version') != face_service.get_encoding_version():
+        return False
+    return update_templates({student_id: candidate['encoding']}, attendance_id) > 0
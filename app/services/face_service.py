@@ -1,21 +1,1119 @@
 import face_recognition
 import numpy as np
-from PIL import Image
+from PIL import Image, ImageOps, UnidentifiedImageError
 import io
 import json
+import os
+import time
+import threading
+import zipfile
+import hashlib
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
 from flask import current_app
 from typing import List, Optional, Dict, Any
 
-from deepface import DeepFace
 import cv2 # Import OpenCV for potential cropping/conversion
 
 # Supported image formats (adjust as needed)
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
+# Supported video containers and frame archives for video attendance
+VIDEO_EXTENSIONS = {'mp4', 'avi', 'mov', 'mkv', 'webm'}
+FRAME_ARCHIVE_EXTENSIONS = {'zip'}
 
 def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def allowed_video_file(filename):
+    return '.' in filename and \
+           filename.rsplit('.', 1)[1].lower() in (VIDEO_EXTENSIONS | FRAME_ARCHIVE_EXTENSIONS)
+
+# Encoder settings per use case: enrollment can favour stable encodings (more jitters),
+# attendance favours speed. See FACE_ENCODER_* in config. Both use the same landmark model,
+# since probes aligned with another model are not comparable to the stored encodings.
+ENCODER_USE_CASES = ('enrollment', 'attendance')
+LANDMARK_MODELS = ('large', 'small')
+DEFAULT_LANDMARK_MODEL = 'small' # face_recognition's default, used by all legacy encodings
+_model_mismatch_warned = False
+
+def get_encoder_settings(use_case: str) -> Dict[str, Any]:
+    """
+    Returns {'num_jitters': int, 'model': str} for 'enrollment' or 'attendance'. The attendance
+    landmark model always follows the enrollment one (a differing FACE_ENCODER_ATTENDANCE_MODEL
+    is ignored with a warning), so the encoding version covers both.
+    """
+    global _model_mismatch_warned
+    if use_case not in ENCODER_USE_CASES:
+        raise ValueError(f"Unknown encoder use case '{use_case}'. Expected one of {ENCODER_USE_CASES}")
+    prefix = f"FACE_ENCODER_{use_case.upper()}"
+    model = current_app.config.get(f"{prefix}_MODEL", DEFAULT_LANDMARK_MODEL)
+    if model not in LANDMARK_MODELS:
+        current_app.logger.warning(f"Invalid {prefix}_MODEL '{model}', falling back to '{DEFAULT_LANDMARK_MODEL}'.")
+        model = DEFAULT_LANDMARK_MODEL
+    if use_case == 'attendance':
+        enrollment_model = get_encoder_settings('enrollment')['model']
+        if model != enrollment_model:
+            if not _model_mismatch_warned:
+                current_app.logger.warning(
+                    f"{prefix}_MODEL '{model}' differs from the enrollment landmark model; "
+                    f"using '{enrollment_model}' so probes stay comparable to stored encodings."
+                )
+                _model_mismatch_warned = True
+            model = enrollment_model
+    return {
+        'num_jitters': max(1, int(current_app.config.get(f"{prefix}_JITTERS", 1))),
+        'model': model,
+    }
+
+# --- Pipeline stage timing metrics ---
+# Per-stage counters (count, total/max duration in ms) kept in process memory.
+_metrics_lock = threading.Lock()
+_stage_metrics: Dict[str, Dict[str, float]] = {}
+_cache_counters = Counter() # Cache hit/miss counters, see get_cache_stats
+
+def _count(counter: str, amount: int = 1) -> None:
+    """Increments a cache counter."""
+    with _metrics_lock:
+        _cache_counters[counter] += amount
+
+def _record_stage_timing(stage: str, elapsed_seconds: float) -> None:
+    """Adds one timing sample for a pipeline stage."""
+    elapsed_ms = elapsed_seconds * 1000.0
+    with _metrics_lock:
+        metrics = _stage_metrics.setdefault(stage, {'count': 0, 'total_ms': 0.0, 'max_ms': 0.0})
+        metrics['count'] += 1
+        metrics['total_ms'] += elapsed_ms
+        metrics['max_ms'] = max(metrics['max_ms'], elapsed_ms)
+
+@contextmanager
+def timed_stage(stage: str):
+    """Context manager that records the duration of the wrapped block under `stage`."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _record_stage_timing(stage, time.perf_counter() - start)
+
+def get_pipeline_metrics() -> Dict[str, Dict[str, float]]:
+    """Returns a snapshot of the stage timing metrics (with average duration per stage)."""
+    with _metrics_lock:
+        snapshot = {}
+        for stage, metrics in _stage_metrics.items():
+            avg_ms = metrics['total_ms'] / metrics['count'] if metrics['count'] else 0.0
+            snapshot[stage] = {
+                'count': int(metrics['count']),
+                'total_ms': round(metrics['total_ms'], 2),
+                'avg_ms': round(avg_ms, 2),
+                'max_ms': round(metrics['max_ms'], 2),
+            }
+        return snapshot
+
+# --- Image preprocessing (shared by enrollment and attendance) ---
+
+def _should_equalize(img_array: np.ndarray, mode: str) -> bool:
+    """Decides whether histogram equalization applies for the configured mode ('off', 'on', 'auto')."""
+    if mode == 'on':
+        return True
+    if mode == 'auto':
+        threshold = current_app.config.get('IMAGE_EQUALIZE_BRIGHTNESS_THRESHOLD', 80)
+        return float(img_array.mean()) < threshold
+    return False
+
+def preprocess_image(image_bytes: bytes, max_dimension: Optional[int] = None) -> np.ndarray:
+    """
+    Normalizes raw image bytes into the RGB array used by detection, encoding and analysis.
+
+    Steps: EXIF orientation transpose, colour mode normalization to RGB (transparent
+    areas are flattened onto white), clamping the longest side to `max_dimension`
+    and optional CLAHE histogram equalization for dark classroom photos.
+
+    Args:
+        image_bytes: Raw bytes of the uploaded image.
+        max_dimension: Longest allowed side in pixels. Defaults to IMAGE_MAX_DIMENSION;
+                       0 or None in config disables clamping.
+
+    Returns:
+        The preprocessed image as a uint8 RGB numpy array.
+    Raises:
+        ValueError: If the bytes cannot be decoded as an image.
+    """
+    with timed_stage('preprocess'):
+        try:
+            img = Image.open(io.BytesIO(image_bytes))
+            # Phone cameras store rotation in EXIF instead of rotating the pixels
+            img = ImageOps.exif_transpose(img)
+            # Pixels are decoded lazily: truncated or corrupt files fail here, not at Image.open
+            if img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info):
+                rgba = img.convert('RGBA')
+                background = Image.new('RGB', rgba.size, (255, 255, 255))
+                background.paste(rgba, mask=rgba.split()[3])
+                img = background
+            elif img.mode != 'RGB':
+                img = img.convert('RGB')
+            else:
+                img.load()
+        except UnidentifiedImageError:
+            raise ValueError("Uploaded file is not a valid image.")
+        except Image.DecompressionBombError:
+            raise ValueError("Uploaded image is too large to decode.")
+        except (OSError, SyntaxError, ValueError) as e:
+            # Truncated/corrupt image data (PIL raises OSError or SyntaxError from its decoders)
+            raise ValueError(f"Uploaded image could not be decoded: {e}")
+
+        if max_dimension is None:
+            max_dimension = current_app.config.get('IMAGE_MAX_DIMENSION', 0)
+        if max_dimension and max(img.size) > max_dimension:
+            original_size = img.size
+            img.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+            current_app.logger.debug(f"Image downscaled from {original_size} to {img.size}.")
+
+        return _equalize_if_needed(np.array(img))
+
+def _equalize_if_needed(img_array: np.ndarray) -> np.ndarray:
+    """Applies CLAHE on the lightness channel when IMAGE_EQUALIZE_HISTOGRAM asks for it."""
+    equalize_mode = str(current_app.config.get('IMAGE_EQUALIZE_HISTOGRAM', 'off')).lower()
+    if _should_equalize(img_array, equalize_mode):
+        with timed_stage('preprocess.equalize'):
+            # Equalize only the lightness channel so colours stay natural
+            lab = cv2.cvtColor(img_array, cv2.COLOR_RGB2LAB)
+            lightness, a_channel, b_channel = cv2.split(lab)
+            clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
+            lab = cv2.merge((clahe.apply(lightness), a_channel, b_channel))
+            img_array = cv2.cvtColor(lab, cv2.COLOR_LAB2RGB)
+    return np.ascontiguousarray(img_array)
+
+def preprocess_frame(rgb_array: np.ndarray, max_dimension: Optional[int] = None) -> np.ndarray:
+    """
+    Preprocessing for already-decoded video frames (RGB): size clamp and optional equalization.
+    Video frames carry no EXIF orientation, so only the array-level steps of preprocess_image apply.
+    """
+    with timed_stage('preprocess'):
+        if max_dimension is None:
+            max_dimension = current_app.config.get('IMAGE_MAX_DIMENSION', 0)
+        height, width = rgb_array.shape[:2]
+        if max_dimension and max(height, width) > max_dimension:
+            scale = max_dimension / float(max(height, width))
+            rgb_array = cv2.resize(rgb_array, (int(width * scale), int(height * scale)), interpolation=cv2.INTER_AREA)
+        return _equalize_if_needed(rgb_array)
+
+# --- Face detection (standard and tiled) ---
+
+DETECTION_MODES = ('standard', 'tiled')
+
+_detection_pool = None
+_detection_pool_lock = threading.Lock()
+
+def _get_detection_pool() -> ProcessPoolExecutor:
+    """
+    Returns the shared process pool used for detection (HOG holds the GIL, so threads do not help).
+    It is sized once from FACE_DETECTION_TILE_WORKERS and never replaced, since other requests may be
+    submitting to it; per-call worker counts only limit how much work a caller has in flight.
+    """
+    global _detection_pool
+    with _detection_pool_lock:
+        if _detection_pool is None:
+            _detection_pool = ProcessPoolExecutor(max_workers=max(1, current_app.config.get('FACE_DETECTION_TILE_WORKERS', 4)))
+        return _detection_pool
+
+def _detect_tile(tile: np.ndarray, offset_y: int, offset_x: int, model: str, upsample: int):
+    """Process pool worker: detects faces in one tile and maps the boxes back to image coordinates."""
+    locations = face_recognition.face_locations(tile, number_of_times_to_upsample=upsample, model=model)
+    return [(top + offset_y, right + offset_x, bottom + offset_y, left + offset_x)
+            for (top, right, bottom, left) in locations]
+
+def _tile_origins(length: int, tile_size: int, step: int) -> List[int]:
+    """Start offsets along one axis so that tiles of `tile_size` cover `length` with the given step."""
+    if length <= tile_size:
+        return [0]
+    origins = list(range(0, length - tile_size + 1, step))
+    if origins[-1] + tile_size < length:
+        origins.append(length - tile_size)
+    return origins
+
+def non_max_suppression(locations: List[tuple], overlap_threshold: float = 0.5) -> List[tuple]:
+    """
+    Merges duplicate face boxes (top, right, bottom, left) produced by overlapping tiles.
+
+    HOG boxes carry no score, so larger boxes are preferred. A box is dropped when its
+    IoU with a kept box exceeds `overlap_threshold`, or when it lies mostly inside a kept
+    box (a face cut by a tile border).
+    """
+    if not locations:
+        return []
+    boxes = np.array(locations, dtype=np.float64)
+    tops, rights, bottoms, lefts = boxes[:, 0], boxes[:, 1], boxes[:, 2], boxes[:, 3]
+    areas = (bottoms - tops) * (rights - lefts)
+    order = np.argsort(-areas)
+
+    kept = []
+    while order.size > 0:
+        current = order[0]
+        kept.append(current)
+        rest = order[1:]
+        inter_h = np.clip(np.minimum(bottoms[current], bottoms[rest]) - np.maximum(tops[current], tops[rest]), 0, None)
+        inter_w = np.clip(np.minimum(rights[current], rights[rest]) - np.maximum(lefts[current], lefts[rest]), 0, None)
+        intersection = inter_h * inter_w
+        iou = intersection / (areas[current] + areas[rest] - intersection)
+        containment = intersection / np.minimum(areas[current], areas[rest])
+        order = rest[(iou <= overlap_threshold) & (containment <= 0.7)]
+
+    return [tuple(int(v) for v in locations[i]) for i in sorted(kept)]
+
+def detect_faces_tiled(img_array: np.ndarray, tile_size: Optional[int] = None, overlap: Optional[int] = None,
+                       workers: Optional[int] = None, model: str = "hog") -> List[tuple]:
+    """
+    Detects faces in a large image by splitting it into overlapping tiles.
+
+    Each tile is processed in a worker process at the same upsampling as a small image,
+    so small faces in wide lecture-hall photos are found without running HOG on the
+    whole upscaled image. Boxes are merged with non-maximum suppression.
+
+    Args:
+        img_array: RGB image as a numpy array.
+        tile_size: Tile side in pixels (default FACE_DETECTION_TILE_SIZE).
+        overlap: Overlap between neighbouring tiles in pixels; should exceed the
+                 largest expected face (default FACE_DETECTION_TILE_OVERLAP).
+        workers: 1 runs inline; otherwise tiles go to the shared detection pool (sized by FACE_DETECTION_TILE_WORKERS).
+        model: Detector model passed to face_recognition ('hog' or 'cnn').
+
+    Returns:
+        A list of (top, right, bottom, left) face locations in image coordinates.
+    """
+    config = current_app.config
+    tile_size = tile_size or config.get('FACE_DETECTION_TILE_SIZE', 800)
+    overlap = overlap if overlap is not None else config.get('FACE_DETECTION_TILE_OVERLAP', 200)
+    workers = workers or config.get('FACE_DETECTION_TILE_WORKERS', 4)
+    upsample = config.get('FACE_DETECTION_TILE_UPSAMPLE', 1)
+    if overlap >= tile_size:
+        raise ValueError("Tile overlap must be smaller than the tile size.")
+
+    height, width = img_array.shape[:2]
+    step = tile_size - overlap
+    jobs = [
+        (np.ascontiguousarray(img_array[y:y + tile_size, x:x + tile_size]), y, x, model, upsample)
+        for y in _tile_origins(height, tile_size, step)
+        for x in _tile_origins(width, tile_size, step)
+    ]
+
+    with timed_stage('detect.tiled'):
+        if workers <= 1 or len(jobs) == 1:
+            tile_results = [_detect_tile(*job) for job in jobs]
+        else:
+            pool = _get_detection_pool()
+            tile_results = list(pool.map(_detect_tile, *zip(*jobs)))
+
+        raw_locations = [location for locations in tile_results for location in locations]
+        merged = non_max_suppression(raw_locations, config.get('FACE_DETECTION_NMS_THRESHOLD', 0.3))
+
+    current_app.logger.info(f"Tiled detection: {len(jobs)} tiles, {len(raw_locations)} raw boxes, {len(merged)} faces after NMS.")
+    return merged
+
+def detect_faces(img_array: np.ndarray, mode: str = 'standard', model: str = "hog",
+                 use_pool: bool = False, **tile_options) -> List[tuple]:
+    """
+    Detects face locations using the requested detection mode.
+
+    Args:
+        img_array: RGB image as a numpy array.
+        mode: 'standard' (single pass over the whole image) or 'tiled' (see detect_faces_tiled).
+        model: Detector model passed to face_recognition ('hog' or 'cnn').
+        use_pool: Run standard detection in the shared worker process pool, so several
+                  images of one request are detected in parallel.
+        **tile_options: tile_size / overlap / workers overrides for tiled mode.
+
+    Returns:
+        A list of (top, right, bottom, left) face locations.
+    """
+    if mode == 'tiled':
+        return detect_faces_tiled(img_array, model=model, **tile_options)
+    with timed_stage('detect'):
+        if use_pool:
+            pool = _get_detection_pool()
+            return pool.submit(_detect_tile, img_array, 0, 0, model, 1).result()
+        return face_recognition.face_locations(img_array, model=model)
+
+# --- Encoding cache keyed by face crop ---
+# The same face crop recurs across re-analysis and multi-photo sessions; its encoding
+# depends only on the pixels around the face, the landmark model and the jitter count.
+_encoding_cache: "OrderedDict[str, np.ndarray]" = OrderedDict()
+_encoding_cache_lock = threading.Lock()
+
+def _encoding_cache_key(img_array: np.ndarray, location: tuple, model: str, num_jitters: int) -> str:
+    """Hash of the face crop (with a margin for landmarks and alignment) plus encoder settings."""
+    top, right, bottom, left = location
+    height, width = img_array.shape[:2]
+    margin = int(0.25 * max(bottom - top, right - left))
+    y0, y1 = max(0, top - margin), min(height, bottom + margin)
+    x0, x1 = max(0, left - margin), min(width, right + margin)
+    crop = np.ascontiguousarray(img_array[y0:y1, x0:x1])
+    digest = hashlib.blake2b(crop.tobytes(), digest_size=16)
+    digest.update(f"{crop.shape}|{top - y0},{right - x0},{bottom - y0},{left - x0}|{model}|{num_jitters}".encode())
+    return digest.hexdigest()
+
+def encode_faces(img_array: np.ndarray, locations: List[tuple], num_jitters: int = 1, model: str = 'large',
+                 use_cache: bool = True) -> List[np.ndarray]:
+    """
+    Computes 128-d face encodings for the given face locations.
+
+    Encodings are served from a bounded LRU cache (ENCODING_CACHE_SIZE) keyed by a hash of
+    the face crop and the encoder settings; only cache misses are sent to dlib, in one call.
+
+    Args:
+        img_array: RGB image as a numpy array.
+        locations: (top, right, bottom, left) face locations.
+        num_jitters: Times to re-sample the face when encoding (higher is slower, more stable).
+        model: Landmark model used for alignment, 'large' (68 points) or 'small' (5 points).
+        use_cache: Set False to always run the encoder (e.g. for benchmarking).
+    """
+    if not locations:
+        return []
+    max_entries = current_app.config.get('ENCODING_CACHE_SIZE', 2048) if use_cache else 0
+
+    with timed_stage('encode'):
+        keys = [_encoding_cache_key(img_array, location, model, num_jitters) for location in locations] if max_entries > 0 else []
+        encodings = [None] * len(locations)
+        if max_entries > 0:
+            with _encoding_cache_lock:
+                for i, key in enumerate(keys):
+                    cached = _encoding_cache.get(key)
+                    if cached is not None:
+                        _encoding_cache.move_to_end(key)
+                        encodings[i] = cached
+                hits = sum(1 for e in encodings if e is not None)
+                _count('encoding.hits', hits)
+                _count('encoding.misses', len(locations) - hits)
+
+        missing = [i for i, encoding in enumerate(encodings) if encoding is None]
+        if missing:
+            computed = face_recognition.face_encodings(
+                img_array, known_face_locations=[locations[i] for i in missing],
+                num_jitters=num_jitters, model=model
+            )
+            for i, encoding in zip(missing, computed):
+                encodings[i] = encoding
+            if max_entries > 0:
+                with _encoding_cache_lock:
+                    for i in missing:
+                        _encoding_cache[keys[i]] = encodings[i]
+                        _encoding_cache.move_to_end(keys[i])
+                    while len(_encoding_cache) > max_entries:
+                        _encoding_cache.popitem(last=False)
+
+    return encodings
+
+def crop_face(img_array: np.ndarray, location: tuple) -> np.ndarray:
+    """Returns the face region for a (top, right, bottom, left) location."""
+    top, right, bottom, left = location
+    return img_array[top:bottom, left:right]
+
+# --- Duplicate upload cache (exact content hash, optionally perceptual hash) ---
+# Teachers often re-submit the same photo after a network failure; the analysis result of
+# a recent identical upload is returned from memory. Near-identical uploads (e.g. re-compressed)
+# are only reused when IMAGE_CACHE_PHASH_DISTANCE > 0, and then only if the image size and
+# pixels also match: shots of the same classroom seconds apart share a dHash but not their faces.
+_analysis_cache: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+_analysis_cache_lock = threading.Lock()
+
+NEAR_DUPLICATE_THUMBNAIL_SIZE = (64, 64)
+
+def _image_signature(image_bytes: bytes) -> Optional[Dict[str, Any]]:
+    """
+    Near-duplicate signature of the image: 64-bit difference hash (dHash), original size and a
+    grayscale thumbnail for the pixel check. None if the bytes cannot be decoded.
+    """
+    try:
+        img = Image.open(io.BytesIO(image_bytes))
+        size = img.size
+        img.draft('L', (128, 128)) # Fast reduced-size JPEG decoding
+        img = ImageOps.exif_transpose(img).convert('L')
+        thumbnail = np.asarray(img.resize(NEAR_DUPLICATE_THUMBNAIL_SIZE, Image.LANCZOS), dtype=np.int16)
+        pixels = np.asarray(img.resize((9, 8), Image.LANCZOS), dtype=np.int16)
+    except Exception:
+        return None
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+    return {'phash': int(''.join('1' if bit else '0' for bit in bits), 2), 'size': size, 'thumbnail': thumbnail}
+
+def _is_near_duplicate(cached: Dict[str, Any], signature: Dict[str, Any], max_distance: int) -> bool:
+    """Same size, dHash within max_distance bits and no thumbnail pixel differing beyond IMAGE_CACHE_MAX_PIXEL_DIFF."""
+    if cached['size'] != signature['size'] or bin(cached['phash'] ^ signature['phash']).count('1') > max_distance:
+        return False
+    max_pixel_diff = current_app.config.get('IMAGE_CACHE_MAX_PIXEL_DIFF', 12)
+    return int(np.abs(cached['thumbnail'] - signature['thumbnail']).max()) <= max_pixel_diff
+
+def _analysis_cache_lookup(content_hash: str, signature: Optional[Dict[str, Any]], options_key: str) -> Optional[Dict[str, Any]]:
+    """Returns a cached result for an exact or (if enabled) near-duplicate upload analyzed with the same options."""
+    ttl = current_app.config.get('IMAGE_CACHE_TTL_SECONDS', 600)
+    max_distance = current_app.config.get('IMAGE_CACHE_PHASH_DISTANCE', 0)
+    now = time.monotonic()
+    with _analysis_cache_lock:
+        for key in [k for k, entry in _analysis_cache.items() if now - entry['created'] > ttl]:
+            del _analysis_cache[key]
+
+        exact_key = f"{content_hash}:{options_key}"
+        entry = _analysis_cache.get(exact_key)
+        if entry is not None:
+            _analysis_cache.move_to_end(exact_key)
+            _count('analysis.exact_hits')
+            return entry['result']
+
+        if signature is not None and max_distance > 0:
+            for key, entry in reversed(_analysis_cache.items()):
+                if entry['options_key'] == options_key and entry['signature'] is not None \
+                        and _is_near_duplicate(entry['signature'], signature, max_distance):
+                    _analysis_cache.move_to_end(key)
+                    _count('analysis.near_hits')
+                    return entry['result']
+
+        _count('analysis.misses')
+        return None
+
+def _analysis_cache_store(content_hash: str, signature: Optional[Dict[str, Any]], options_key: str, result: Dict[str, Any]) -> None:
+    """Stores an analysis result, evicting the least recently used entries beyond IMAGE_CACHE_SIZE."""
+    max_entries = current_app.config.get('IMAGE_CACHE_SIZE', 128)
+    if max_entries <= 0:
+        return
+    with _analysis_cache_lock:
+        key = f"{content_hash}:{options_key}"
+        _analysis_cache[key] = {'signature': signature, 'options_key': options_key, 'result': result, 'created': time.monotonic()}
+        _analysis_cache.move_to_end(key)
+        while len(_analysis_cache) > max_entries:
+            _analysis_cache.popitem(last=False)
+            _count('analysis.evictions')
+
+def get_cache_stats() -> Dict[str, int]:
+    """Returns hit/miss counters of the in-process caches."""
+    with _metrics_lock:
+        stats = dict(_cache_counters)
+    with _analysis_cache_lock:
+        stats['analysis.entries'] = len(_analysis_cache)
+    with _encoding_cache_lock:
+        stats['encoding.entries'] = len(_encoding_cache)
+    with _attribute_cache_lock:
+        stats['attribute.entries'] = len(_attribute_cache)
+    return stats
+
+def analyze_image(image_bytes: bytes, detection_mode: str = 'standard', tile_options: Optional[Dict[str, Any]] = None,
+                  actions: Optional[List[str]] = None, use_pool: bool = False) -> Dict[str, Any]:
+    """
+    Runs the full per-image pipeline: preprocess, detect, encode and (optionally) analyze attributes.
+
+    Results are cached by content hash (and optionally perceptual hash, see IMAGE_CACHE_*), so a
+    re-submitted photo returns the previous faces, encodings and attributes without
+    running any model.
+
+    Args:
+        image_bytes: Raw bytes of the uploaded image.
+        detection_mode: 'standard' or 'tiled' (see detect_faces).
+        tile_options: tile_size / overlap overrides for tiled mode.
+        actions: Attributes to analyze for every face (e.g. ['emotion']); None or empty skips
+            analysis. Attendance analyzes only matched faces afterwards via analyze_face_crops.
+        use_pool: Run standard detection in the shared worker process pool.
+
+    Returns:
+        A dict with parallel lists 'locations', 'encodings', 'crops' (face regions for later
+        attribute analysis) and 'attributes' (None per face when analysis was not requested or failed).
+    """
+    with timed_stage('cache.lookup'):
+        content_hash = hashlib.sha256(image_bytes).hexdigest()
+        # The near-duplicate signature costs a second decode; skipped when only exact hits are enabled
+        signature = _image_signature(image_bytes) if current_app.config.get('IMAGE_CACHE_PHASH_DISTANCE', 0) > 0 else None
+        encoder_settings = get_encoder_settings('attendance')
+        options_key = json.dumps([detection_mode, tile_options or {}, sorted(actions or []), encoder_settings], sort_keys=True)
+        cached = _analysis_cache_lookup(content_hash, signature, options_key)
+    if cached is not None:
+        current_app.logger.info("Duplicate upload detected; returning cached face analysis.")
+        return {key: list(value) for key, value in cached.items()}
+
+    max_dimension = current_app.config.get('IMAGE_MAX_DIMENSION_TILED', 4000) if detection_mode == 'tiled' else None
+    img_array = preprocess_image(image_bytes, max_dimension=max_dimension)
+    locations = detect_faces(img_array, mode=detection_mode, model="hog", use_pool=use_pool, **(tile_options or {}))
+    encodings = encode_faces(img_array, locations, **encoder_settings)
+
+    crops = [crop_face(img_array, location).copy() for location in locations] # Copies: the full image is not kept
+    attributes = analyze_face_crops(crops, actions) if actions else [None] * len(locations)
+
+    result = {'locations': locations, 'encodings': encodings, 'crops': crops, 'attributes': attributes}
+    _analysis_cache_store(content_hash, signature, options_key, result)
+    return {key: list(value) for key, value in result.items()}
+
+def analyze_images(images: List[bytes], workers: Optional[int] = None, **options) -> List[Dict[str, Any]]:
+    """
+    Runs analyze_image for several images of one request in parallel.
+
+    Decoding and attribute analysis run in threads; detection is dispatched to the
+    shared process pool. Results are returned in input order; the first failure is re-raised.
+    """
+    if len(images) == 1:
+        return [analyze_image(images[0], **options)]
+
+    app = current_app._get_current_object()
+    workers = workers or app.config.get('ATTENDANCE_IMAGE_WORKERS', 4)
+
+    def _run(image_bytes):
+        with app.app_context():
+            return analyze_image(image_bytes, use_pool=True, **options)
+
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(images)))) as executor:
+        return list(executor.map(_run, images))
+
+# Attribute results keyed by face crop hash, backend and actions, so re-submitted photos and
+# re-analyzed faces do not run the attribute models again (see ATTRIBUTE_CACHE_SIZE).
+_attribute_cache: "OrderedDict[str, Optional[Dict[str, Any]]]" = OrderedDict()
+_attribute_cache_lock = threading.Lock()
+
+def analyze_face_crops(crops: List[np.ndarray], actions: Optional[List[str]]) -> List[Optional[Dict[str, Any]]]:
+    """
+    Runs attribute analysis for the given face crops (see analyze_face_attributes), using a
+    bounded LRU cache keyed by crop content. Returns one result (or None) per crop.
+    """
+    if not actions:
+        return [None] * len(crops)
+    max_entries = current_app.config.get('ATTRIBUTE_CACHE_SIZE', 512)
+    settings_key = f"{current_app.config.get('ATTRIBUTE_BACKEND', 'deepface')}:{','.join(sorted(actions))}"
+
+    results = []
+    for crop in crops:
+        key = None
+        if max_entries > 0:
+            digest = hashlib.blake2b(crop.tobytes(), digest_size=16)
+            digest.update(repr(crop.shape).encode())
+            key = f"{digest.hexdigest()}:{settings_key}"
+            with _attribute_cache_lock:
+                if key in _attribute_cache:
+                    _attribute_cache.move_to_end(key)
+                    _count('attribute.hits')
+                    results.append(_attribute_cache[key])
+                    continue
+            _count('attribute.misses')
+
+        with timed_stage('analyze'):
+            attributes = analyze_face_attributes(crop, actions=actions)
+        results.append(attributes)
+        if key is not None:
+            with _attribute_cache_lock:
+                _attribute_cache[key] = attributes
+                while len(_attribute_cache) > max_entries:
+                    _attribute_cache.popitem(last=False)
+    return results
+
+# --- Liveness (photo-of-photo) heuristics ---
+# Cheap checks on the detected crops before matching: periodic high-frequency peaks in the
+# spectrum (moire of screens and prints) and faces far smaller than the others in the same
+# photo (a picture held up in the room). They flag detections for review; they do not reject.
+LIVENESS_PATCH_SIZE = 128
+
+def check_liveness(crops: List[np.ndarray], locations: List[tuple], image_indices: List[int]) -> List[Dict[str, Any]]:
+    """
+    Runs the liveness heuristics on all detected faces of a session in one batch.
+
+    Args:
+        crops: Face crops (RGB).
+        locations: (top, right, bottom, left) of each face in its photo.
+        image_indices: Photo each face was detected in (size consistency is checked per photo).
+
+    Returns:
+        Per face {'moire': spectral peak ratio, 'size_ratio': face size / median size in the photo
+        (None with fewer than LIVENESS_MIN_FACES_FOR_SIZE faces), 'reasons': ['moire', 'size'],
+        'suspicious': bool}
+    """
+    config = current_app.config
+    peak_threshold = config.get('LIVENESS_MOIRE_PEAK_RATIO', 12.0)
+    min_size_ratio = config.get('LIVENESS_MIN_SIZE_RATIO', 0.5)
+    min_faces_for_size = config.get('LIVENESS_MIN_FACES_FOR_SIZE', 3)
+    if not crops:
+        return []
+
+    with timed_stage('liveness'):
+        size = LIVENESS_PATCH_SIZE
+        patches = np.stack([
+            cv2.resize(cv2.cvtColor(crop, cv2.COLOR_RGB2GRAY), (size, size), interpolation=cv2.INTER_LINEAR)
+            for crop in crops
+        ]).astype(np.float32)
+        patches -= patches.mean(axis=(1, 2), keepdims=True)
+        patches *= np.outer(np.hanning(size), np.hanning(size)).astype(np.float32) # Limits edge leakage
+        spectra = np.abs(np.fft.fftshift(np.fft.fft2(patches), axes=(1, 2)))
+        yy, xx = np.ogrid[-size // 2:size // 2, -size // 2:size // 2]
+        radius = np.sqrt(xx ** 2 + yy ** 2)
+        band = spectra[:, (radius > size / 8) & (radius < size / 2 - 1)] # Mid/high frequencies only
+        moire = band.max(axis=1) / (band.mean(axis=1) + 1e-6)
+
+        face_sizes = np.array([min(bottom - top, right - left) for top, right, bottom, left in locations], dtype=np.float64)
+        image_indices = np.asarray(image_indices)
+        size_ratios = [None] * len(crops)
+        for image_index in set(image_indices.tolist()):
+            members = np.flatnonzero(image_indices == image_index)
+            if len(members) < min_faces_for_size:
+                continue
+            median_size = float(np.median(face_sizes[members]))
+            for member in members:
+                size_ratios[member] = float(face_sizes[member] / median_size) if median_size else None
+
+    results = []
+    for index in range(len(crops)):
+        reasons = []
+        if moire[index] > peak_threshold:
+            reasons.append('moire')
+        if size_ratios[index] is not None and size_ratios[index] < min_size_ratio:
+            reasons.append('size')
+        results.append({
+            'moire': round(float(moire[index]), 2),
+            'size_ratio': round(size_ratios[index], 3) if size_ratios[index] is not None else None,
+            'reasons': reasons,
+            'suspicious': bool(reasons),
+        })
+    return results
+
+def face_distance_matrix(face_encodings, known_encodings) -> np.ndarray:
+    """Euclidean distances (faces x known) computed without a (faces x known x 128) intermediate."""
+    known = np.asarray(known_encodings, dtype=np.float64)
+    faces = np.asarray(face_encodings, dtype=np.float64)
+    # ||a - b||^2 = |a|^2 + |b|^2 - 2ab
+    squared = (faces ** 2).sum(axis=1)[:, None] + (known ** 2).sum(axis=1)[None, :] - 2.0 * faces @ known.T
+    return np.sqrt(np.clip(squared, 0.0, None))
+
+def match_faces(known_encodings: List[np.ndarray], known_labels: List[Any], face_encodings: List[np.ndarray],
+                tolerance: float = 0.6, known_qualities: Optional[List[Optional[float]]] = None,
+                known_tolerances: Optional[List[Optional[float]]] = None) -> Dict[str, Any]:
+    """
+    Vectorized matching of detected faces against known encodings.
+
+    Each face is assigned to the label (e.g. student ID) of its nearest known encoding
+    if that distance is within the encoding's tolerance. When several faces reach the same label
+    (the same student in several photos, or a look-alike), the closest face wins.
+
+    Args:
+        known_encodings: Known encodings, several per label allowed.
+        known_labels: Label for each known encoding (same length as known_encodings).
+        face_encodings: Encodings of the detected faces.
+        tolerance: Maximum distance for a match.
+        known_qualities: Optional enrollment quality score (0-1, None if unknown) per known encoding.
+            Distances to lower quality encodings are scaled up by up to FACE_QUALITY_DISTANCE_PENALTY.
+        known_tolerances: Optional per known encoding tolerance (e.g. the student's learned match_threshold,
+            see compute_match_threshold); None entries fall back to `tolerance`.
+
+    Returns:
+        A dict with:
+          'matches': {label: {'face_index': int, 'distance': float}} (best face per label),
+          'face_labels': per-face nearest label within tolerance (None if no match),
+          'face_distances': per-face distance to the nearest known encoding (None if nothing to compare).
+    """
+    face_count = len(face_encodings)
+    result = {'matches': {}, 'face_labels': [None] * face_count, 'face_distances': [None] * face_count}
+    if not known_encodings or not face_count:
+        return result
+
+    with timed_stage('match'):
+        distances = face_distance_matrix(face_encodings, known_encodings)
+        if known_qualities is not None:
+            penalty = current_app.config.get('FACE_QUALITY_DISTANCE_PENALTY', 0.1)
+            qualities = np.array([1.0 if q is None else min(1.0, max(0.0, q)) for q in known_qualities])
+            distances = distances * (1.0 + penalty * (1.0 - qualities))[None, :]
+
+        nearest = distances.argmin(axis=1)
+        nearest_distances = distances[np.arange(face_count), nearest]
+        tolerances = np.full(len(known_encodings), tolerance, dtype=np.float64)
+        if known_tolerances is not None:
+            tolerances = np.array([tolerance if t is None else t for t in known_tolerances], dtype=np.float64)
+
+        for face_index in range(face_count):
+            distance = float(nearest_distances[face_index])
+            result['face_distances'][face_index] = distance
+            if distance > tolerances[nearest[face_index]]:
+                continue
+            label = known_labels[int(nearest[face_index])]
+            result['face_labels'][face_index] = label
+            existing = result['matches'].get(label)
+            if existing is None or distance < existing['distance']:
+                result['matches'][label] = {'face_index': face_index, 'distance': distance}
+
+    return result
+
+def compute_match_threshold(genuine_distances: List[float], impostor_distances: List[float],
+                            default_tolerance: float = 0.6) -> float:
+    """
+    Learns a per-student match threshold from observed distances.
+
+    Starts from the FACE_THRESHOLD_PERCENTILE of the student's confirmed match distances
+    plus FACE_THRESHOLD_MARGIN when there are at least FACE_THRESHOLD_MIN_SAMPLES of them
+    (default_tolerance otherwise), stays FACE_THRESHOLD_MARGIN below the closest impostor
+    distance (other students' encodings, matches corrected to absent) and is clamped to
+    [FACE_THRESHOLD_MIN, FACE_THRESHOLD_MAX].
+    """
+    config = current_app.config
+    margin = config.get('FACE_THRESHOLD_MARGIN', 0.05)
+    threshold = default_tolerance
+    if len(genuine_distances) >= config.get('FACE_THRESHOLD_MIN_SAMPLES', 5):
+        threshold = float(np.percentile(genuine_distances, config.get('FACE_THRESHOLD_PERCENTILE', 95))) + margin
+    if impostor_distances:
+        threshold = min(threshold, float(min(impostor_distances)) - margin)
+    threshold = min(max(threshold, config.get('FACE_THRESHOLD_MIN', 0.4)), config.get('FACE_THRESHOLD_MAX', 0.65))
+    return round(threshold, 4)
+
+
+# --- Video / frame-sequence attendance ---
+
+def iter_video_frames(video_path: str, sample_fps: Optional[float] = None, max_frames: Optional[int] = None):
+    """
+    Yields preprocessed RGB frames sampled from a video file at `sample_fps`.
+
+    Skipped frames are only grabbed (not decoded), so sampling cost scales with the
+    sample rate rather than the native frame rate.
+
+    Raises:
+        ValueError: If the video cannot be opened.
+    """
+    sample_fps = sample_fps or current_app.config.get('VIDEO_SAMPLE_FPS', 2.0)
+    max_frames = max_frames or current_app.config.get('VIDEO_MAX_FRAMES', 120)
+    capture = cv2.VideoCapture(video_path)
+    if not capture.isOpened():
+        raise ValueError("Video file could not be opened.")
+    try:
+        native_fps = capture.get(cv2.CAP_PROP_FPS) or 25.0
+        step = max(1, int(round(native_fps / sample_fps)))
+        frame_index = 0
+        yielded = 0
+        while yielded < max_frames:
+            if frame_index % step == 0:
+                ok, frame = capture.read()
+                if not ok:
+                    break
+                yielded += 1
+                yield preprocess_frame(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+            elif not capture.grab():
+                break
+            frame_index += 1
+    finally:
+        capture.release()
+
+def iter_archive_frames(archive_bytes: bytes, max_frames: Optional[int] = None):
+    """
+    Yields preprocessed RGB frames from a ZIP of images, in file name order.
+
+    Raises:
+        ValueError: If the archive is invalid.
+    """
+    max_frames = max_frames or current_app.config.get('VIDEO_MAX_FRAMES', 120)
+    max_entry_bytes = current_app.config.get('VIDEO_ARCHIVE_MAX_FRAME_BYTES', 20 * 1024 * 1024)
+    try:
+        archive = zipfile.ZipFile(io.BytesIO(archive_bytes))
+    except zipfile.BadZipFile:
+        raise ValueError("Uploaded archive is not a valid ZIP file.")
+    with archive:
+        entries = sorted(
+            (info for info in archive.infolist()
+             if not info.is_dir() and allowed_file(info.filename) and not os.path.basename(info.filename).startswith('.')),
+            key=lambda info: info.filename
+        )
+        for info in entries[:max_frames]:
+            if info.file_size > max_entry_bytes:
+                current_app.logger.warning(f"Skipping oversized frame in archive: {info.filename}")
+                continue
+            yield preprocess_image(archive.read(info))
+
+def _box_iou(box_a: tuple, box_b: tuple) -> float:
+    """Intersection over union of two (top, right, bottom, left) boxes."""
+    inter_h = max(0, min(box_a[2], box_b[2]) - max(box_a[0], box_b[0]))
+    inter_w = max(0, min(box_a[1], box_b[1]) - max(box_a[3], box_b[3]))
+    intersection = inter_h * inter_w
+    area_a = (box_a[2] - box_a[0]) * (box_a[1] - box_a[3])
+    area_b = (box_b[2] - box_b[0]) * (box_b[1] - box_b[3])
+    union = area_a + area_b - intersection
+    return intersection / union if union > 0 else 0.0
+
+def _pipelined_detections(frames, lookahead: int):
+    """Yields (frame, locations) in order while detection of the next frames runs in the process pool."""
+    if lookahead <= 1:
+        for frame in frames:
+            with timed_stage('detect'):
+                locations = face_recognition.face_locations(frame, model="hog")
+            yield frame, locations
+        return
+
+    pool = _get_detection_pool()
+    pending = deque()
+    for frame in frames:
+        pending.append((frame, pool.submit(_detect_tile, frame, 0, 0, "hog", 1)))
+        if len(pending) > lookahead:
+            ready_frame, future = pending.popleft()
+            yield ready_frame, future.result()
+    while pending:
+        ready_frame, future = pending.popleft()
+        yield ready_frame, future.result()
+
+def track_faces_in_frames(frames, keep_crops: bool = False) -> Dict[str, Any]:
+    """
+    Streaming detection/encoding over a frame sequence with IoU-based face tracking.
+
+    Detections are associated with tracks from recent frames by box overlap. A track is
+    encoded when it starts and then only every VIDEO_TRACK_REENCODE_INTERVAL sampled frames,
+    instead of re-encoding every person in every frame. Frames are not retained after they
+    are processed; with keep_crops the face region of each encoded sample is kept so that
+    attributes can be analyzed after identity voting (see aggregate_track_identities).
+
+    Args:
+        frames: Iterable of preprocessed RGB frames (see iter_video_frames / iter_archive_frames).
+        keep_crops: Keep the face crop of each encoded sample.
+
+    Returns:
+        {'frame_count': int, 'tracks': [{'encodings': [...], 'crops': [...], 'frames': int}]}
+    """
+    config = current_app.config
+    iou_threshold = config.get('VIDEO_TRACK_IOU_THRESHOLD', 0.3)
+    max_gap = config.get('VIDEO_TRACK_MAX_GAP', 3)
+    reencode_interval = config.get('VIDEO_TRACK_REENCODE_INTERVAL', 5)
+    lookahead = config.get('FACE_DETECTION_TILE_WORKERS', 4)
+
+    encoder_settings = get_encoder_settings('attendance')
+
+    tracks = []
+    frame_count = 0
+    for frame_index, (frame, locations) in enumerate(_pipelined_detections(frames, lookahead)):
+        frame_count += 1
+        active = [t for t in tracks if frame_index - t['last_seen'] <= max_gap]
+
+        # Greedy association: highest overlap first, one detection per track
+        pairs = sorted(
+            ((_box_iou(track['location'], location), t_idx, d_idx)
+             for t_idx, track in enumerate(active) for d_idx, location in enumerate(locations)),
+            reverse=True
+        )
+        assigned_tracks, assigned_detections = set(), set()
+        to_encode = []
+        for iou, t_idx, d_idx in pairs:
+            if iou < iou_threshold:
+                break
+            if t_idx in assigned_tracks or d_idx in assigned_detections:
+                continue
+            assigned_tracks.add(t_idx)
+            assigned_detections.add(d_idx)
+            track = active[t_idx]
+            track['location'] = locations[d_idx]
+            track['last_seen'] = frame_index
+            track['frames'] += 1
+            if frame_index - track['last_encoded'] >= reencode_interval:
+                to_encode.append((track, locations[d_idx]))
+
+        for d_idx, location in enumerate(locations):
+            if d_idx in assigned_detections:
+                continue
+            track = {'location': location, 'last_seen': frame_index, 'last_encoded': frame_index,
+                     'frames': 1, 'encodings': [], 'crops': []}
+            tracks.append(track)
+            to_encode.append((track, location))
+
+        if to_encode:
+            encodings = encode_faces(frame, [location for _, location in to_encode], **encoder_settings)
+            for (track, location), encoding in zip(to_encode, encodings):
+                track['encodings'].append(encoding)
+                track['last_encoded'] = frame_index
+                if keep_crops:
+                    track['crops'].append(crop_face(frame, location).copy())
+
+    current_app.logger.info(f"Frame sequence processed: {frame_count} frames, {len(tracks)} face tracks.")
+    return {
+        'frame_count': frame_count,
+        'tracks': [{'encodings': t['encodings'], 'crops': t['crops'], 'frames': t['frames']} for t in tracks]
+    }
+
+def aggregate_track_identities(tracks: List[Dict[str, Any]], known_encodings: List[np.ndarray], known_labels: List[Any],
+                               tolerance: float = 0.6, actions: Optional[List[str]] = None,
+                               analyze_unmatched: bool = False,
+                               known_qualities: Optional[List[Optional[float]]] = None,
+                               known_tolerances: Optional[List[Optional[float]]] = None) -> Dict[str, Any]:
+    """
+    Turns face tracks into per-label (student) results by identity voting.
+
+    Every encoding of a track votes for its nearest label within tolerance; the track is
+    assigned to the majority label if it has at least VIDEO_MIN_VOTES votes and at least
+    VIDEO_MIN_VOTE_RATIO of the track's samples. Tracks of the same label are merged.
+    Attributes (actions) are analyzed on the kept crops after voting, only for assigned
+    tracks unless analyze_unmatched is set.
+
+    Returns:
+        {'matches': {label: {'confidence', 'votes', 'encoding', 'analysis', 'emotion_statistics'}},
+         'emotion_statistics': {emotion: count} over the dominant emotion of every analyzed track}
+    """
+    min_votes = current_app.config.get('VIDEO_MIN_VOTES', 2)
+    min_vote_ratio = current_app.config.get('VIDEO_MIN_VOTE_RATIO', 0.5)
+
+    # Identity voting first, so attribute models only run for tracks that matter
+    assignments = []
+    for track in tracks:
+        if not track['encodings']:
+            continue
+
+        # A single short track can only cast one vote; allow it when it is the whole track
+        required_votes = min(min_votes, len(track['encodings']))
+        match_result = match_faces(known_encodings, known_labels, track['encodings'], tolerance=tolerance,
+                                   known_qualities=known_qualities, known_tolerances=known_tolerances)
+        votes = Counter(label for label in match_result['face_labels'] if label is not None)
+        label, label_votes = votes.most_common(1)[0] if votes else (None, 0)
+        if label is not None and (label_votes < required_votes or label_votes / len(track['encodings']) < min_vote_ratio):
+            label = None
+        label_samples = [(d, e) for d, l, e in zip(match_result['face_distances'], match_result['face_labels'], track['encodings'])
+                         if label is not None and l == label]
+        assignments.append((track, label, label_votes, label_samples))
+
+    per_label = {}
+    overall_emotions = Counter()
+    for track, label, label_votes, label_samples in assignments:
+        track_attributes = []
+        if actions and (label is not None or analyze_unmatched):
+            track_attributes = analyze_face_crops(track.get('crops', []), actions)
+        track_emotions = Counter(a['emotion'] for a in track_attributes if a and a.get('emotion'))
+        if track_emotions:
+            overall_emotions[track_emotions.most_common(1)[0][0]] += 1
+        if label is None:
+            continue
+
+        entry = per_label.setdefault(label, {'votes': 0, 'distances': [], 'best': None, 'emotions': Counter(),
+                                             'emotion_scores': [], 'ages': [], 'genders': Counter()})
+        entry['votes'] += label_votes
+        entry['distances'].extend(distance for distance, _ in label_samples)
+        for distance, encoding in label_samples:
+            if entry['best'] is None or distance < entry['best'][0]:
+                entry['best'] = (distance, encoding)
+        entry['emotions'].update(track_emotions)
+        for attributes in track_attributes:
+            if not attributes:
+                continue
+            if attributes.get('emotion_scores'):
+                entry['emotion_scores'].append(attributes['emotion_scores'])
+            if attributes.get('age') is not None:
+                entry['ages'].append(attributes['age'])
+            if attributes.get('gender'):
+                entry['genders'][attributes['gender']] += 1
+
+    matches = {}
+    for label, entry in per_label.items():
+        analysis = None
+        emotion_statistics = None
+        total_emotions = sum(entry['emotions'].values())
+        if total_emotions or entry['ages'] or entry['genders']:
+            analysis = {
+                'emotion': entry['emotions'].most_common(1)[0][0] if total_emotions else None,
+                'age': int(np.median(entry['ages'])) if entry['ages'] else None,
+                'gender': entry['genders'].most_common(1)[0][0] if entry['genders'] else None,
+            }
+            if entry['emotion_scores']:
+                # Mean probability vector over all analyzed samples of the student
+                mean_scores = np.mean(np.asarray(entry['emotion_scores']), axis=0)
+                analysis['emotion_scores'] = [round(float(p), 4) for p in mean_scores]
+                if analysis['emotion'] in EMOTION_LABELS:
+                    analysis['emotion_confidence'] = analysis['emotion_scores'][EMOTION_LABELS.index(analysis['emotion'])]
+        if total_emotions:
+            emotion_statistics = {emotion: round(count / total_emotions, 4) for emotion, count in entry['emotions'].items()}
+        matches[label] = {
+            'confidence': max(0.0, 1.0 - float(np.median(entry['distances']))),
+            'votes': entry['votes'],
+            'encoding': entry['best'][1], # Closest sample, used for template updates
+            'analysis': analysis,
+            'emotion_statistics': emotion_statistics,
+        }
+
+    return {'matches': matches, 'emotion_statistics': dict(overall_emotions) if overall_emotions else None}
+
+# --- Enrollment quality gate ---
+# Cheap checks run before encoding so that blurry, tiny, badly lit or turned faces are
+# rejected with reasons instead of producing poor encodings. See ENROLLMENT_* in config.
+QUALITY_REASONS = ('blurry', 'face_too_small', 'too_dark', 'too_bright', 'head_turned', 'head_tilted')
+
+def assess_face_quality(img_array: np.ndarray, location: tuple) -> Dict[str, Any]:
+    """
+    Measures sharpness (variance of the Laplacian), face box size, mean brightness and head
+    pose (yaw from the nose position between the eyes, roll from the eye line; 5-point landmarks).
+
+    Returns:
+        {'blur', 'face_size', 'brightness', 'yaw', 'roll', 'score': 0-1 overall quality,
+         'reasons': failed checks (see QUALITY_REASONS)}
+    """
+    config = current_app.config
+    min_blur = config.get('ENROLLMENT_MIN_BLUR_SCORE', 60.0)
+    min_face_size = config.get('ENROLLMENT_MIN_FACE_SIZE', 80)
+    min_brightness = config.get('ENROLLMENT_MIN_BRIGHTNESS', 40.0)
+    max_brightness = config.get('ENROLLMENT_MAX_BRIGHTNESS', 220.0)
+    max_yaw = config.get('ENROLLMENT_MAX_YAW', 0.25)
+    max_roll = config.get('ENROLLMENT_MAX_ROLL_DEGREES', 20.0)
+
+    with timed_stage('quality'):
+        top, right, bottom, left = location
+        gray = cv2.cvtColor(crop_face(img_array, location), cv2.COLOR_RGB2GRAY)
+        blur = float(cv2.Laplacian(gray, cv2.CV_64F).var())
+        face_size = int(min(bottom - top, right - left))
+        brightness = float(gray.mean())
+
+        yaw = roll = None
+        landmarks = face_recognition.face_landmarks(img_array, [location], model='small')
+        if landmarks:
+            left_eye = np.mean(landmarks[0]['left_eye'], axis=0)
+            right_eye = np.mean(landmarks[0]['right_eye'], axis=0)
+            nose = np.mean(landmarks[0]['nose_tip'], axis=0)
+            eye_vector = right_eye - left_eye
+            eye_distance_sq = float(np.dot(eye_vector, eye_vector))
+            if eye_distance_sq > 0:
+                roll = float(np.degrees(np.arctan2(eye_vector[1], eye_vector[0])))
+                roll = roll - 180.0 if roll > 90.0 else roll + 180.0 if roll < -90.0 else roll
+                # Nose offset from the eye midpoint along the eye line, relative to eye distance (0 = frontal)
+                yaw = float(np.dot(nose - (left_eye + right_eye) / 2.0, eye_vector) / eye_distance_sq)
+
+    reasons = []
+    if blur < min_blur:
+        reasons.append('blurry')
+    if face_size < min_face_size:
+        reasons.append('face_too_small')
+    if brightness < min_brightness:
+        reasons.append('too_dark')
+    elif brightness > max_brightness:
+        reasons.append('too_bright')
+    if yaw is not None and abs(yaw) > max_yaw:
+        reasons.append('head_turned')
+    if roll is not None and abs(roll) > max_roll:
+        reasons.append('head_tilted')
+
+    components = [
+        min(1.0, blur / (2.0 * min_blur)) if min_blur > 0 else 1.0,
+        min(1.0, face_size / (2.0 * min_face_size)) if min_face_size > 0 else 1.0,
+        max(0.0, 1.0 - abs(brightness - 128.0) / 128.0),
+        max(0.0, 1.0 - abs(yaw) / (2.0 * max_yaw)) if yaw is not None and max_yaw > 0 else 1.0,
+    ]
+    return {
+        'blur': round(blur, 1),
+        'face_size': face_size,
+        'brightness': round(brightness, 1),
+        'yaw': round(yaw, 3) if yaw is not None else None,
+        'roll': round(roll, 1) if roll is not None else None,
+        'score': round(float(np.mean(components)), 3),
+        'reasons': reasons,
+    }
+
+def prepare_enrollment_face(image_bytes: bytes) -> Dict[str, Any]:
+    """
+    Detects, quality-checks and encodes the face of an enrollment photo with the enrollment
+    encoder settings. Encoding is skipped when the photo does not contain exactly one face or
+    when the quality gate (ENROLLMENT_QUALITY_GATE) rejects it.
+
+    Returns:
+        {'face_count': int, 'quality': dict or None (see assess_face_quality),
+         'encodings': list of encodings (empty if skipped),
+         'face_crop': the face region (None unless exactly one face), e.g. for analyze_age_and_gender}
+    """
+    img_array = preprocess_image(image_bytes)
+    with timed_stage('detect'):
+        locations = face_recognition.face_locations(img_array, model="hog")
+    result = {'face_count': len(locations), 'quality': None, 'encodings': [], 'face_crop': None}
+    if len(locations) != 1:
+        return result
+
+    result['face_crop'] = crop_face(img_array, locations[0])
+    result['quality'] = assess_face_quality(img_array, locations[0])
+    if result['quality']['reasons'] and current_app.config.get('ENROLLMENT_QUALITY_GATE', True):
+        current_app.logger.info(f"Enrollment photo rejected by quality gate: {result['quality']['reasons']}")
+        return result
+    result['encodings'] = encode_faces(img_array, locations, use_cache=False, **get_encoder_settings('enrollment'))
+    return result
+
 def find_face_encodings(image_file_storage):
     """
     Finds face locations and extracts encodings from an image file.
@@ -34,16 +1132,14 @@ def find_face_encodings(image_file_storage):
         raise ValueError(f"Invalid file type. Allowed types: {ALLOWED_EXTENSIONS}")
 
     try:
-        # Read the image file into memory
+        # Read the image file into memory and run the shared preprocessing stage
         img_bytes = image_file_storage.read()
-        img = Image.open(io.BytesIO(img_bytes))
-
-        # Convert PIL image to numpy array (RGB format)
-        img_array = np.array(img.convert('RGB'))
+        img_array = preprocess_image(img_bytes)
 
         # Find face locations
         # model can be 'cnn' (more accurate, slower, requires dlib compiled with CUDA) or 'hog' (faster, less accurate)
-        face_locations = face_recognition.face_locations(img_array, model="hog") 
+        with timed_stage('detect'):
+            face_locations = face_recognition.face_locations(img_array, model="hog")
 
         if not face_locations:
             current_app.logger.info("No faces found in the uploaded image.")
@@ -55,7 +1151,7 @@ def find_face_encodings(image_file_storage):
 
         # Extract face encodings (using the first face found for simplicity)
         # Specify known_face_locations to only encode the found faces
-        face_encodings = face_recognition.face_encodings(img_array, known_face_locations=face_locations)
+        face_encodings = encode_faces(img_array, face_locations, **get_encoder_settings('enrollment'))
         
         current_app.logger.info(f"Found {len(face_encodings)} face encodings.")
         return face_encodings
@@ -64,6 +1160,24 @@ def find_face_encodings(image_file_storage):
         current_app.logger.error(f"Error processing image: {e}")
         raise # Re-raise the exception to be handled by the route
 
+def analyze_age_and_gender(face_crop: np.ndarray) -> Optional[Dict[str, Any]]:
+    """
+    Estimates age and gender from the face crop of an enrollment photo
+    (prepare_enrollment_face()['face_crop']), without detecting the face again.
+
+    Meant to run once when a face photo is uploaded; the result is stored on the
+    student record so that profile reads never run a model.
+
+    Returns:
+        {'age': int or None, 'gender': str or None}, or None if no attributes were found.
+    """
+    if face_crop is None or not face_crop.size:
+        return None
+    analysis = analyze_face_crops([face_crop], ['age', 'gender'])[0]
+    if not analysis:
+        return None
+    return {'age': analysis.get('age'), 'gender': analysis.get('gender')}
+
 def encode_encodings_for_json(encodings: List[np.ndarray]) -> Optional[str]:
     """Converts a list of numpy array encodings to a JSON serializable string."""
     if not encodings:
@@ -83,6 +1197,122 @@ def decode_encodings_from_json(json_string: Optional[str]) -> List[np.ndarray]:
         current_app.logger.error("Failed to decode face encodings from JSON string.")
         return []
 
+# --- Encoding version tags ---
+# Every stored encoding is tagged with the encoding version it was produced with
+# (student['face_encoding_versions'], parallel to face_encodings). Matching only uses
+# encodings of the current version; `flask reencode-faces` migrates the rest.
+LEGACY_ENCODING_VERSION = 'dlib-v1' # Version of encodings stored before tags existed
+# face_recognition's default encoder settings, used for all encodings stored before tags existed
+LEGACY_ENCODER_SETTINGS = {'num_jitters': 1, 'model': 'small'}
+
+def get_encoding_version() -> str:
+    """
+    Returns the encoding version produced by the current encoder settings. FACE_ENCODING_VERSION
+    overrides it (e.g. after a detector change); otherwise it is derived from the enrollment
+    landmark model and jitters, so changing them re-tags new encodings and flags the stored ones
+    for re-encoding. The landmark model also applies to attendance probes (see get_encoder_settings).
+    The legacy settings (the defaults) keep the legacy tag.
+    """
+    configured = current_app.config.get('FACE_ENCODING_VERSION')
+    if configured:
+        return configured
+    settings = get_encoder_settings('enrollment')
+    if settings == LEGACY_ENCODER_SETTINGS:
+        return LEGACY_ENCODING_VERSION
+    return f"dlib-{settings['model']}-j{settings['num_jitters']}"
+
+def get_encoding_versions(student: Dict[str, Any], count: int) -> List[str]:
+    """Version tag of each of the `count` stored encodings of a student record."""
+    versions = list(student.get('face_encoding_versions') or [])
+    return (versions + [LEGACY_ENCODING_VERSION] * count)[:count]
+
+def get_current_templates(student: Dict[str, Any]) -> List[np.ndarray]:
+    """
+    Decodes the student's adaptive templates (encodings of confirmed attendance matches,
+    see enrollment_service.update_templates); empty if they belong to another version.
+    """
+    if student.get('template_version') != get_encoding_version():
+        return []
+    return decode_encodings_from_json(student.get('template_encodings'))
+
+def get_current_encodings(student: Dict[str, Any], with_qualities: bool = False, include_templates: bool = False):
+    """
+    Decodes the student's stored encodings, keeping only those of the current version.
+    With include_templates, the student's adaptive templates are appended.
+    With with_qualities, returns (encodings, qualities) where qualities holds the stored
+    enrollment quality score of each encoding (student['face_encoding_qualities'], None if unknown).
+    """
+    decoded = decode_encodings_from_json(student.get('face_encodings'))
+    current_version = get_encoding_version()
+    indices = [i for i, version in enumerate(get_encoding_versions(student, len(decoded))) if version == current_version]
+    encodings = [decoded[i] for i in indices]
+    stored_qualities = list(student.get('face_encoding_qualities') or [])
+    qualities = [stored_qualities[i] if i < len(stored_qualities) else None for i in indices]
+    if include_templates and encodings:
+        templates = get_current_templates(student)
+        encodings.extend(templates)
+        qualities.extend([None] * len(templates))
+    if not with_qualities:
+        return encodings
+    return encodings, qualities
+
+def needs_reencoding(student: Dict[str, Any]) -> bool:
+    """True if the student has a face photo but no encodings, or encodings of another version."""
+    if not student.get('face_photo_url'):
+        return False
+    decoded = decode_encodings_from_json(student.get('face_encodings'))
+    current_version = get_encoding_version()
+    return not decoded or any(version != current_version for version in get_encoding_versions(student, len(decoded)))
+
+_worker_app = None
+
+def _init_pipeline_worker():
+    """Process pool initializer: each worker builds its own app so the full pipeline (and config) is available."""
+    global _worker_app
+    from app import create_app
+    _worker_app = create_app()
+
+def reencode_face_photo(student_id: int, photo_path: str):
+    """
+    Process pool worker: re-encodes the largest face of a stored enrollment photo with the
+    current enrollment settings. Returns (student_id, {'encodings': lists, 'quality': dict} or None, error or None).
+    """
+    app = _worker_app or current_app._get_current_object()
+    with app.app_context():
+        try:
+            with open(photo_path, 'rb') as f:
+                img_array = preprocess_image(f.read())
+            locations = face_recognition.face_locations(img_array, model="hog")
+            if not locations:
+                return student_id, None, "no face found"
+            largest = max(locations, key=lambda loc: (loc[2] - loc[0]) * (loc[1] - loc[3]))
+            quality = assess_face_quality(img_array, largest) # Stored, but not enforced for existing enrollments
+            encodings = encode_faces(img_array, [largest], use_cache=False, **get_encoder_settings('enrollment'))
+            return student_id, {'encodings': [encoding.tolist() for encoding in encodings], 'quality': quality}, None
+        except Exception as e:
+            return student_id, None, str(e)
+
+def encode_enrollment_photo(key: Any, image_bytes: bytes):
+    """
+    Process pool worker: checks and encodes an enrollment photo (see prepare_enrollment_face).
+    Like a single upload, the photo must contain exactly one face and pass the quality gate.
+    Returns (key, {'encodings': lists, 'quality': dict} or None, error or None).
+    """
+    app = _worker_app or current_app._get_current_object()
+    with app.app_context():
+        try:
+            prepared = prepare_enrollment_face(image_bytes)
+            if prepared['face_count'] == 0:
+                return key, None, "no face found"
+            if prepared['face_count'] > 1:
+                return key, None, f"multiple faces found ({prepared['face_count']})"
+            if not prepared['encodings']:
+                return key, None, f"low quality: {', '.join(prepared['quality']['reasons'])}"
+            return key, {'encodings': [encoding.tolist() for encoding in prepared['encodings']],
+                         'quality': prepared['quality']}, None
+        except Exception as e:
+            return key, None, str(e)
+
 def compare_faces(known_face_encodings: List[np.ndarray], face_encoding_to_check: np.ndarray, tolerance=0.6) -> List[bool]:
     """
     Compares a face encoding against a list of known encodings.
@@ -126,38 +1356,68 @@ def face_distance(known_face_encodings: List[np.ndarray], face_encoding_to_check
     distances = face_recognition.face_distance(known_face_encodings, face_encoding_to_check)
     return distances.tolist() # Convert numpy array to list 
 
-def analyze_face_attributes(image_data: Any, actions: List[str] = ['age', 'gender', 'emotion']) -> Optional[Dict[str, Any]]:
+# --- Face attribute analysis backends ---
+# analyze_face_attributes delegates to the backend selected by ATTRIBUTE_BACKEND. Backends are
+# created once per process and load their models lazily, so a worker only pays for what it uses.
+ATTRIBUTE_ACTIONS = ('age', 'gender', 'emotion')
+# Fixed class order of the persisted emotion probability vectors ('emotion_scores')
+EMOTION_LABELS = ('angry', 'disgust', 'fear', 'happy', 'sad', 'surprise', 'neutral')
+
+def emotion_scores_vector(scores: Dict[str, float]) -> Optional[List[float]]:
+    """
+    Converts {emotion: score} into probabilities in EMOTION_LABELS order. Labels outside
+    EMOTION_LABELS (e.g. FER+ 'contempt') are dropped and the rest re-normalized.
     """
-    Analyzes a face image (path or numpy array) to predict attributes using DeepFace.
+    vector = np.array([max(0.0, float(scores.get(label, 0.0))) for label in EMOTION_LABELS])
+    total = vector.sum()
+    if total <= 0:
+        return None
+    return [round(float(p), 4) for p in vector / total]
 
-    Args:
-        image_data: Path to the image file (str) or image as NumPy array.
-        actions: List of attributes to analyze (e.g., ['age', 'gender', 'emotion']).
+class AttributeBackend:
+    """Interface for face attribute analysis (age, gender, emotion) on a single face image."""
+    name = None
 
-    Returns:
-        A dictionary containing the analyzed attributes (e.g., 'age', 'gender', 'dominant_emotion')
-        if analysis is successful, otherwise None.
-    """
-    # Define default result keys based on potential actions
+    def analyze(self, image_data: Any, actions: List[str]) -> Optional[Dict[str, Any]]:
+        """
+        Returns a dict with one key per requested action ('age', 'gender', 'emotion'), a value
+        of None for actions that could not be computed, or None if nothing could be computed.
+        With 'emotion', 'emotion_scores' (see EMOTION_LABELS) and 'emotion_confidence' are added.
+        """
+        raise NotImplementedError
+
+
+class DeepFaceAttributeBackend(AttributeBackend):
+    """DeepFace (TensorFlow/Keras) backend. DeepFace is imported on first use."""
+    name = 'deepface'
+
+    # DeepFace result keys per action
     result_keys = {
         'age': 'age',
         'gender': 'dominant_gender',
         'emotion': 'dominant_emotion'
     }
-    try:
-        # Ensure actions list is not empty
-        if not actions:
-            current_app.logger.warning("No actions specified for DeepFace analysis.")
+
+    def analyze(self, image_data: Any, actions: List[str]) -> Optional[Dict[str, Any]]:
+        from deepface import DeepFace # Heavy import (TensorFlow); only when this backend is used
+
+        try:
+            # Use DeepFace.analyze
+            results = DeepFace.analyze(
+                img_path=image_data, # Can be path or numpy array
+                actions=actions, 
+                enforce_detection=False, # Don't raise error if no face or multiple faces
+                detector_backend='opencv', # Choose a backend
+                silent=True # Suppress DeepFace progress bars/messages in logs
+            )
+        except FileNotFoundError:
+            current_app.logger.error(f"Image file not found for attribute analysis: {image_data}")
+            return None
+        except ValueError as ve:
+            # DeepFace might raise ValueError for issues like multiple faces with enforce_detection=True
+            # or other internal problems. Let's log it specifically.
+            current_app.logger.error(f"ValueError during DeepFace analysis: {ve}")
             return None
-            
-        # Use DeepFace.analyze
-        results = DeepFace.analyze(
-            img_path=image_data, # Can be path or numpy array
-            actions=actions, 
-            enforce_detection=False, # Don't raise error if no face or multiple faces
-            detector_backend='opencv', # Choose a backend
-            silent=True # Suppress DeepFace progress bars/messages in logs
-        )
 
         # Handle list vs dict output (take first result if list)
         if isinstance(results, list) and len(results) > 0:
@@ -172,33 +1432,172 @@ def analyze_face_attributes(image_data: Any, actions: List[str] = ['age', 'gende
 
         # Extract requested attributes
         analysis_output = {}
-        analysis_successful = False
         for action in actions:
-            result_key = result_keys.get(action)
+            result_key = self.result_keys.get(action)
             if result_key and result_key in result:
                 analysis_output[action] = result[result_key]
-                analysis_successful = True # Mark success if at least one attribute is found
             else:
                 analysis_output[action] = None # Indicate if a specific action failed
                 current_app.logger.debug(f"DeepFace analysis did not return key '{result_key}' for action '{action}'.")
 
-        if analysis_successful:
-             # Add region for context if needed (though less useful for cropped faces)
-             # analysis_output['region'] = result.get('region') 
-             return analysis_output
+        if 'emotion' in actions and isinstance(result.get('emotion'), dict):
+            # DeepFace reports per-class percentages
+            analysis_output['emotion_scores'] = emotion_scores_vector(result['emotion'])
+            dominant = analysis_output.get('emotion')
+            if analysis_output['emotion_scores'] and dominant in EMOTION_LABELS:
+                analysis_output['emotion_confidence'] = analysis_output['emotion_scores'][EMOTION_LABELS.index(dominant)]
+        return analysis_output
+
+
+class OnnxAttributeBackend(AttributeBackend):
+    """
+    Lightweight CPU backend running one small (optionally quantized) ONNX model per action with
+    ONNX Runtime. Model paths, labels and input scaling come from the ATTRIBUTE_ONNX_* config keys;
+    the input layout (NCHW/NHWC, gray/RGB, size) is read from each model's input signature.
+    Classification models (emotion, gender) map softmax outputs to labels; an age model may output
+    either a single regressed value or a distribution over ages 0..N-1 (expected value is used).
+    """
+    name = 'onnx'
+
+    def __init__(self):
+        try:
+            import onnxruntime
+        except ImportError as e:
+            raise RuntimeError("ATTRIBUTE_BACKEND 'onnx' requires the onnxruntime package.") from e
+        self._ort = onnxruntime
+        self._sessions = {}
+        self._sessions_lock = threading.Lock()
+
+    def _get_session(self, action: str):
+        """Loads the ONNX session for an action on first use (None if no model is configured)."""
+        with self._sessions_lock:
+            if action not in self._sessions:
+                model_path = current_app.config.get(f"ATTRIBUTE_ONNX_{action.upper()}_MODEL")
+                if not model_path or not os.path.exists(model_path):
+                    current_app.logger.warning(f"No ONNX model found for attribute '{action}' (path: {model_path}).")
+                    self._sessions[action] = None
+                else:
+                    options = self._ort.SessionOptions()
+                    options.intra_op_num_threads = int(current_app.config.get('ATTRIBUTE_ONNX_THREADS', 1))
+                    options.inter_op_num_threads = 1
+                    self._sessions[action] = self._ort.InferenceSession(
+                        model_path, sess_options=options, providers=['CPUExecutionProvider']
+                    )
+                    current_app.logger.info(f"Loaded ONNX attribute model for '{action}' from {model_path}")
+            return self._sessions[action]
+
+    @staticmethod
+    def _prepare_input(face_rgb: np.ndarray, input_shape: List[Any], scale: float) -> np.ndarray:
+        """Resizes/converts an RGB face crop to the model's input shape, as a float32 batch of one."""
+        dims = [d if isinstance(d, int) and d > 0 else None for d in input_shape]
+        channels_first = len(dims) == 4 and dims[1] in (1, 3)
+        if channels_first:
+            channels, height, width = dims[1], dims[2], dims[3]
         else:
-             current_app.logger.warning(f"DeepFace analysis completed but found no requested attributes.")
-             return None
+            height, width, channels = dims[1], dims[2], dims[3] if len(dims) == 4 else 1
+        height, width = height or 64, width or 64
+
+        face = cv2.resize(face_rgb, (width, height), interpolation=cv2.INTER_AREA)
+        if channels == 1:
+            face = cv2.cvtColor(face, cv2.COLOR_RGB2GRAY)[:, :, None]
+        tensor = face.astype(np.float32) * scale
+        if channels_first:
+            tensor = tensor.transpose(2, 0, 1)
+        elif len(dims) == 3:
+            tensor = tensor[:, :, 0] # (N, H, W) grayscale input
+        return tensor[None, ...]
+
+    @staticmethod
+    def _softmax(values: np.ndarray) -> np.ndarray:
+        # Leave outputs that are already probabilities untouched
+        if values.min() >= 0 and abs(float(values.sum()) - 1.0) < 1e-3:
+            return values
+        exp = np.exp(values - values.max())
+        return exp / exp.sum()
+
+    def _run(self, action: str, face_rgb: np.ndarray) -> Optional[np.ndarray]:
+        session = self._get_session(action)
+        if session is None:
+            return None
+        model_input = session.get_inputs()[0]
+        scale = float(current_app.config.get(f"ATTRIBUTE_ONNX_{action.upper()}_SCALE", 1.0))
+        tensor = self._prepare_input(face_rgb, model_input.shape, scale)
+        output = session.run(None, {model_input.name: tensor})[0]
+        return np.asarray(output, dtype=np.float32).reshape(-1)
+
+    def analyze(self, image_data: Any, actions: List[str]) -> Optional[Dict[str, Any]]:
+        if isinstance(image_data, str):
+            with open(image_data, 'rb') as f:
+                image_data = np.array(Image.open(f).convert('RGB'))
+
+        analysis_output = {}
+        for action in actions:
+            output = self._run(action, image_data) if action in ATTRIBUTE_ACTIONS else None
+            if output is None or output.size == 0:
+                analysis_output[action] = None
+            elif action == 'age':
+                if output.size == 1:
+                    analysis_output['age'] = int(round(float(output[0])))
+                else:
+                    probabilities = self._softmax(output)
+                    analysis_output['age'] = int(round(float(np.dot(probabilities, np.arange(output.size)))))
+            else:
+                labels = current_app.config.get(f"ATTRIBUTE_ONNX_{action.upper()}_LABELS", '').split(',')
+                probabilities = self._softmax(output)
+                best = int(probabilities.argmax())
+                analysis_output[action] = labels[best].strip() if best < len(labels) else str(best)
+                if action == 'emotion':
+                    analysis_output['emotion_scores'] = emotion_scores_vector(
+                        {label.strip(): float(p) for label, p in zip(labels, probabilities)}
+                    )
+                    analysis_output['emotion_confidence'] = round(float(probabilities[best]), 4)
+        return analysis_output
+
+
+ATTRIBUTE_BACKENDS = {
+    DeepFaceAttributeBackend.name: DeepFaceAttributeBackend,
+    OnnxAttributeBackend.name: OnnxAttributeBackend,
+}
+_attribute_backends: Dict[str, AttributeBackend] = {}
+_attribute_backends_lock = threading.Lock()
+
+def get_attribute_backend(name: Optional[str] = None) -> AttributeBackend:
+    """Returns the process-wide attribute backend instance (default: ATTRIBUTE_BACKEND config)."""
+    name = name or current_app.config.get('ATTRIBUTE_BACKEND', 'deepface')
+    if name not in ATTRIBUTE_BACKENDS:
+        raise ValueError(f"Unknown attribute backend '{name}'. Expected one of {sorted(ATTRIBUTE_BACKENDS)}")
+    with _attribute_backends_lock:
+        if name not in _attribute_backends:
+            _attribute_backends[name] = ATTRIBUTE_BACKENDS[name]()
+        return _attribute_backends[name]
+
+def analyze_face_attributes(image_data: Any, actions: List[str] = ['age', 'gender', 'emotion']) -> Optional[Dict[str, Any]]:
+    """
+    Analyzes a face image (path or RGB numpy array) to predict attributes using the configured
+    attribute backend (see ATTRIBUTE_BACKEND).
+
+    Args:
+        image_data: Path to the image file (str) or image as NumPy array.
+        actions: List of attributes to analyze (e.g., ['age', 'gender', 'emotion']).
+
+    Returns:
+        A dictionary containing the analyzed attributes keyed by action (e.g., 'age', 'gender', 'emotion')
+        if analysis is successful, otherwise None.
+    """
+    try:
+        # Ensure actions list is not empty
+        if not actions:
+            current_app.logger.warning("No actions specified for attribute analysis.")
+            return None
+
+        backend = get_attribute_backend()
+        analysis_output = backend.analyze(image_data, actions)
+        if not analysis_output or all(value is None for value in analysis_output.values()):
+            current_app.logger.warning(f"Attribute analysis ({backend.name}) completed but found no requested attributes.")
+            return None
+        return analysis_output
 
-    except FileNotFoundError:
-        current_app.logger.error(f"Image file not found for attribute analysis: {image_data}")
-        return None
-    except ValueError as ve:
-        # DeepFace might raise ValueError for issues like multiple faces with enforce_detection=True
-        # or other internal problems. Let's log it specifically.
-        current_app.logger.error(f"ValueError during DeepFace analysis: {ve}")
-        return None
     except Exception as e:
         # Log other unexpected errors
-        current_app.logger.error(f"Unexpected error during DeepFace analysis: {e}")
-        return None 
\ No newline at end of file
+        current_app.logger.error(f"Unexpected error during attribute analysis: {e}")
+        return None 
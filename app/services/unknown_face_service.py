@@ -0,0 +1,232 @@
+import os
+import datetime
+from typing import Any, Dict, List, Optional
+
+import cv2
+import numpy as np
+from flask import current_app
+from werkzeug.utils import secure_filename
+
+from app.models.user import default_datetime
+from app.services import data_service, enrollment_service, face_service
+
+UNKNOWN_FACE_CLUSTERS_FILE = 'unknown_face_clusters.json'
+STUDENTS_FILE = 'students.json'
+STUDENT_COURSE_FILE = 'student_course.json'
+
+# Faces that match no enrolled student are clustered per course with an online centroid
+# (leader) clustering: each face joins the nearest cluster of the course within
+# UNKNOWN_FACE_CLUSTER_DISTANCE, or starts a new one. A cluster keeps its running centroid,
+# the sessions it was seen in and at most UNKNOWN_FACE_CLUSTER_MAX_FACES sample faces
+# (encoding + thumbnail) used when it is enrolled.
+
+
+def _thumbnail_url(filename: str) -> str:
+    """Web URL of a thumbnail saved in UNKNOWN_FACE_UPLOAD_FOLDER."""
+    upload_dir = current_app.config['UNKNOWN_FACE_UPLOAD_FOLDER']
+    relative_url_part = os.path.relpath(upload_dir, current_app.static_folder if current_app.static_folder else current_app.root_path)
+    return f"/{relative_url_part.replace(os.sep, '/')}/{filename}"
+
+
+def _thumbnail_path(url: str) -> str:
+    return os.path.join(current_app.config['UNKNOWN_FACE_UPLOAD_FOLDER'], os.path.basename(url.strip('/')))
+
+
+def _save_thumbnail(crop: np.ndarray, filename: str) -> Optional[str]:
+    """Saves a face crop as a small JPEG and returns its URL (None on failure)."""
+    size = current_app.config.get('UNKNOWN_FACE_THUMBNAIL_SIZE', 112)
+    height, width = crop.shape[:2]
+    if not height or not width:
+        return None
+    scale = min(1.0, size / float(max(height, width)))
+    if scale < 1.0:
+        crop = cv2.resize(crop, (max(1, int(width * scale)), max(1, int(height * scale))), interpolation=cv2.INTER_AREA)
+    ok, buffer = cv2.imencode('.jpg', cv2.cvtColor(crop, cv2.COLOR_RGB2BGR), [cv2.IMWRITE_JPEG_QUALITY, 85])
+    if not ok:
+        return None
+    upload_dir = current_app.config['UNKNOWN_FACE_UPLOAD_FOLDER']
+    os.makedirs(upload_dir, exist_ok=True)
+    with open(os.path.join(upload_dir, filename), 'wb') as f:
+        f.write(buffer.tobytes())
+    return _thumbnail_url(filename)
+
+
+def record_unknown_faces(course_id: int, attendance_id: int, encodings: List[np.ndarray], crops: List[np.ndarray]) -> int:
+    """
+    Adds the unmatched faces of an attendance session to the course's unknown face clusters.
+    All clusters are updated with a single read and write. Clusters of another encoding
+    version are left alone (they can no longer be compared).
+
+    Returns:
+        Number of faces recorded.
+    """
+    if not encodings or not current_app.config.get('UNKNOWN_FACE_TRACKING', True):
+        return 0
+    max_distance = current_app.config.get('UNKNOWN_FACE_CLUSTER_DISTANCE', 0.5)
+    max_faces = current_app.config.get('UNKNOWN_FACE_CLUSTER_MAX_FACES', 10)
+    version = face_service.get_encoding_version()
+    now = default_datetime()
+    timestamp = datetime.datetime.now().strftime('%Y%m%d%H%M%S')
+
+    all_clusters = data_service.read_data(UNKNOWN_FACE_CLUSTERS_FILE)
+    clusters = [c for c in all_clusters if c.get('course_id') == course_id and c.get('encoding_version') == version]
+    next_id = max((c.get('id', 0) for c in all_clusters), default=0) + 1
+
+    for face_index, (encoding, crop) in enumerate(zip(encodings, crops)):
+        encoding = np.asarray(encoding, dtype=np.float64)
+        cluster = None
+        if clusters:
+            distances = face_service.face_distance_matrix([encoding], [c['centroid'] for c in clusters])[0]
+            nearest = int(distances.argmin())
+            if distances[nearest] <= max_distance:
+                cluster = clusters[nearest]
+        if cluster is None:
+            cluster = {
+                "id": next_id,
+                "course_id": course_id,
+                "encoding_version": version,
+                "centroid": encoding.tolist(),
+                "face_count": 0,
+                "attendance_ids": [],
+                "faces": [],
+                "created_at": now
+            }
+            next_id += 1
+            clusters.append(cluster)
+            all_clusters.append(cluster)
+
+        # Running mean keeps the centroid exact without the stored faces
+        cluster['face_count'] += 1
+        centroid = np.asarray(cluster['centroid'])
+        cluster['centroid'] = (centroid + (encoding - centroid) / cluster['face_count']).tolist()
+        if attendance_id not in cluster['attendance_ids']:
+            cluster['attendance_ids'].append(attendance_id)
+        if len(cluster['faces']) < max_faces:
+            filename = secure_filename(f"unknown_{course_id}_{attendance_id}_{timestamp}_{face_index + 1}.jpg")
+            cluster['faces'].append({
+                "attendance_id": attendance_id,
+                "encoding": encoding.tolist(),
+                "thumbnail_url": _save_thumbnail(crop, filename) if crop is not None else None,
+                "created_at": now
+            })
+        cluster['updated_at'] = now
+
+    data_service.write_data(UNKNOWN_FACE_CLUSTERS_FILE, all_clusters)
+    return len(encodings)
+
+
+def cluster_summary(cluster: Dict[str, Any]) -> Dict[str, Any]:
+    """Public view of a cluster (no encodings)."""
+    return {
+        "id": cluster['id'],
+        "course_id": cluster['course_id'],
+        "face_count": cluster.get('face_count', 0),
+        "session_count": len(cluster.get('attendance_ids', [])),
+        "attendance_ids": cluster.get('attendance_ids', []),
+        "thumbnail_urls": [face['thumbnail_url'] for face in cluster.get('faces', []) if face.get('thumbnail_url')],
+        "created_at": cluster.get('created_at'),
+        "updated_at": cluster.get('updated_at'),
+    }
+
+
+def list_clusters(course_id: int, min_sessions: int = 1) -> List[Dict[str, Any]]:
+    """Clusters of a course seen in at least min_sessions sessions, most recurring first."""
+    version = face_service.get_encoding_version()
+    clusters = [
+        cluster_summary(c) for c in data_service.find_many(UNKNOWN_FACE_CLUSTERS_FILE, course_id=course_id)
+        if c.get('encoding_version') == version and len(c.get('attendance_ids', [])) >= min_sessions
+    ]
+    return sorted(clusters, key=lambda c: (c['session_count'], c['face_count']), reverse=True)
+
+
+def delete_cluster(cluster: Dict[str, Any]) -> None:
+    """Deletes a cluster and its thumbnails."""
+    data_service.delete_item(UNKNOWN_FACE_CLUSTERS_FILE, cluster['id'])
+    for face in cluster.get('faces', []):
+        if not face.get('thumbnail_url'):
+            continue
+        path = _thumbnail_path(face['thumbnail_url'])
+        if os.path.exists(path):
+            try:
+                os.remove(path)
+            except OSError as e:
+                current_app.logger.warning(f"Could not delete unknown face thumbnail {path}: {e}")
+
+
+def delete_course_clusters(course_id: int) -> int:
+    """Deletes all unknown face clusters (and thumbnails) of a course."""
+    clusters = data_service.find_many(UNKNOWN_FACE_CLUSTERS_FILE, course_id=course_id)
+    for cluster in clusters:
+        delete_cluster(cluster)
+    return len(clusters)
+
+
+def has_enrollment(student: Dict[str, Any]) -> bool:
+    """True if the student already has face encodings or a face photo."""
+    return bool(student.get('face_encodings') or student.get('face_photo_url'))
+
+
+def _remove_face_photo(student: Dict[str, Any]) -> None:
+    """Deletes the student's face photo file (the encodings no longer come from it)."""
+    path = os.path.join(current_app.config['FACE_UPLOAD_FOLDER'], os.path.basename(student['face_photo_url'].strip('/')))
+    if os.path.exists(path):
+        try:
+            os.remove(path)
+        except OSError as e:
+            current_app.logger.warning(f"Could not delete replaced face photo {path}: {e}")
+
+
+def enroll_cluster(cluster: Dict[str, Any], student: Dict[str, Any], replace: bool = False) -> Dict[str, Any]:
+    """
+    Enrolls an unknown face cluster as the given student: the cluster's sample faces closest
+    to its centroid (at most FACE_TEMPLATE_MAX) become the student's face encodings, the
+    student is enrolled in the cluster's course if needed and the cluster is deleted.
+
+    A student who is already enrolled (encodings or face photo) is only overwritten with
+    replace=True. The old face photo is then deleted, since `flask reencode-faces` would
+    otherwise re-encode it and drop the cluster encodings. Templates learned for the old
+    encodings are cleared and the match threshold is recalibrated.
+
+    Returns:
+        The updated student record.
+
+    Raises:
+        ValueError: If the cluster has no sample faces of the current encoding version, or
+            the student is already enrolled and replace is False.
+    """
+    if cluster.get('encoding_version') != face_service.get_encoding_version() or not cluster.get('faces'):
+        raise ValueError("Cluster has no face samples of the current encoding version.")
+    if has_enrollment(student) and not replace:
+        raise ValueError("Student already has face encodings; pass replace to overwrite them.")
+    max_encodings = current_app.config.get('FACE_TEMPLATE_MAX', 5)
+    samples = np.asarray([face['encoding'] for face in cluster['faces']])
+    distances = face_service.face_distance_matrix(samples, [cluster['centroid']])[:, 0]
+    chosen = [samples[i] for i in np.argsort(distances)[:max_encodings]]
+
+    if student.get('face_photo_url'):
+        _remove_face_photo(student)
+    data_service.update_item(STUDENTS_FILE, student['id'], {
+        "face_encodings": face_service.encode_encodings_for_json(chosen),
+        "face_encoding_versions": [cluster['encoding_version']] * len(chosen),
+        "face_encoding_qualities": [None] * len(chosen),
+        "face_photo_url": None,
+        # Estimates belonged to the removed photo
+        "estimated_age": None,
+        "estimated_gender": None,
+        **enrollment_service.template_reset_fields(),
+        "updated_at": default_datetime()
+    })
+    if not data_service.find_one(STUDENT_COURSE_FILE, student_id=student['id'], course_id=cluster['course_id']):
+        now = default_datetime()
+        data_service.add_item(STUDENT_COURSE_FILE, {
+            "student_id": student['id'],
+            "course_id": cluster['course_id'],
+            "created_at": now,
+            "updated_at": now
+        })
+    delete_cluster(cluster)
+    try:
+        enrollment_service.calibrate_match_thresholds([student['id']])
+    except Exception as e:
+        current_app.logger.error(f"Could not recalibrate the match threshold of student {student['id']}: {e}")
+    return data_service.find_one(STUDENTS_FILE, id=student['id'])
@@ -0,0 +1,46 @@
+from typing import Any, Dict, List, Optional
+
+from app.services import data_service
+
+USERS_FILE = 'users.json'
+
+# Student fields used only by the face pipeline; never returned by the API
+STUDENT_PRIVATE_FIELDS = (
+    'face_encodings', 'face_encoding_versions', 'face_encoding_qualities',
+    'template_encodings', 'template_version', 'template_seen', 'template_attendance_ids', 'match_threshold',
+)
+
+
+def attach_users(profiles: List[Dict[str, Any]], users: Optional[Dict[int, Dict[str, Any]]] = None) -> List[Dict[str, Any]]:
+    """
+    Attaches the user of every profile (student or teacher) under 'user', without password_hash.
+    Users are loaded with a single read of users.json unless a {user_id: user} map that the
+    request already loaded is passed. Profiles are modified in place and returned.
+    """
+    if users is None:
+        users = data_service.fetch_by_ids(USERS_FILE, (profile.get('user_id') for profile in profiles if profile))
+    for profile in profiles:
+        if not profile:
+            continue
+        user = users.get(profile.get('user_id'))
+        if user:
+            user = dict(user)
+            user.pop('password_hash', None)
+            profile['user'] = user
+    return profiles
+
+
+def hydrate_students(students: List[Dict[str, Any]], users: Optional[Dict[int, Dict[str, Any]]] = None) -> List[Dict[str, Any]]:
+    """Copies of the student profiles with their users attached and face pipeline fields removed."""
+    hydrated = []
+    for student in students:
+        student = dict(student)
+        for field_name in STUDENT_PRIVATE_FIELDS:
+            student.pop(field_name, None)
+        hydrated.append(student)
+    return attach_users(hydrated, users)
+
+
+def hydrate_teachers(teachers: List[Dict[str, Any]], users: Optional[Dict[int, Dict[str, Any]]] = None) -> List[Dict[str, Any]]:
+    """Copies of the teacher profiles with their users attached."""
+    return attach_users([dict(teacher) for teacher in teachers], users)
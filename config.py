@@ -15,6 +15,7 @@ class Config:
     UPLOAD_FOLDER = os.environ.get('UPLOAD_FOLDER', 'uploads')
     FACE_UPLOAD_FOLDER = os.path.join(UPLOAD_FOLDER, 'faces')
     ATTENDANCE_UPLOAD_FOLDER = os.path.join(UPLOAD_FOLDER, 'attendance')
+    UNKNOWN_FACE_UPLOAD_FOLDER = os.path.join(UPLOAD_FOLDER, 'unknown_faces') # Thumbnails of unmatched faces
 
     # Ensure upload directories exist
     if not os.path.exists(UPLOAD_FOLDER):
@@ -22,4 +23,124 @@ class Config:
     if not os.path.exists(FACE_UPLOAD_FOLDER):
         os.makedirs(FACE_UPLOAD_FOLDER)
     if not os.path.exists(ATTENDANCE_UPLOAD_FOLDER):
-        os.makedirs(ATTENDANCE_UPLOAD_FOLDER) 
\ No newline at end of file
+        os.makedirs(ATTENDANCE_UPLOAD_FOLDER)
+
+    # Image preprocessing (shared by enrollment and attendance uploads)
+    # Longest image side in pixels after preprocessing; 0 (default) disables clamping. Downscaling
+    # speeds up detection but can push small back-row faces below HOG's minimum face size.
+    IMAGE_MAX_DIMENSION = int(os.environ.get('IMAGE_MAX_DIMENSION', 0))
+    # Histogram equalization for dark photos: 'off', 'on' or 'auto' (only below the brightness threshold)
+    IMAGE_EQUALIZE_HISTOGRAM = os.environ.get('IMAGE_EQUALIZE_HISTOGRAM', 'off')
+    IMAGE_EQUALIZE_BRIGHTNESS_THRESHOLD = int(os.environ.get('IMAGE_EQUALIZE_BRIGHTNESS_THRESHOLD', 80))
+
+    # Tiled face detection for large group photos (selected per attendance request)
+    FACE_DETECTION_TILE_SIZE = int(os.environ.get('FACE_DETECTION_TILE_SIZE', 800))
+    FACE_DETECTION_TILE_OVERLAP = int(os.environ.get('FACE_DETECTION_TILE_OVERLAP', 200))
+    # Size of the shared detection process pool (tiled, multi-photo and video detection)
+    FACE_DETECTION_TILE_WORKERS = int(os.environ.get('FACE_DETECTION_TILE_WORKERS', 4))
+    FACE_DETECTION_TILE_UPSAMPLE = int(os.environ.get('FACE_DETECTION_TILE_UPSAMPLE', 1))
+    FACE_DETECTION_NMS_THRESHOLD = float(os.environ.get('FACE_DETECTION_NMS_THRESHOLD', 0.3))
+    # Tiled mode keeps more resolution so small faces survive preprocessing
+    IMAGE_MAX_DIMENSION_TILED = int(os.environ.get('IMAGE_MAX_DIMENSION_TILED', 4000))
+
+    # Multi-photo attendance sessions
+    ATTENDANCE_MAX_IMAGES = int(os.environ.get('ATTENDANCE_MAX_IMAGES', 10))
+    ATTENDANCE_IMAGE_WORKERS = int(os.environ.get('ATTENDANCE_IMAGE_WORKERS', 4))
+
+    # Video / frame-sequence attendance
+    VIDEO_SAMPLE_FPS = float(os.environ.get('VIDEO_SAMPLE_FPS', 2.0))
+    VIDEO_MAX_FRAMES = int(os.environ.get('VIDEO_MAX_FRAMES', 120))
+    VIDEO_TRACK_IOU_THRESHOLD = float(os.environ.get('VIDEO_TRACK_IOU_THRESHOLD', 0.3))
+    VIDEO_TRACK_MAX_GAP = int(os.environ.get('VIDEO_TRACK_MAX_GAP', 3)) # Sampled frames a track may be missed
+    VIDEO_TRACK_REENCODE_INTERVAL = int(os.environ.get('VIDEO_TRACK_REENCODE_INTERVAL', 5))
+    VIDEO_MIN_VOTES = int(os.environ.get('VIDEO_MIN_VOTES', 2))
+    VIDEO_MIN_VOTE_RATIO = float(os.environ.get('VIDEO_MIN_VOTE_RATIO', 0.5))
+
+    # Duplicate upload cache for attendance photo analysis (per process)
+    IMAGE_CACHE_SIZE = int(os.environ.get('IMAGE_CACHE_SIZE', 128)) # 0 disables the cache
+    IMAGE_CACHE_TTL_SECONDS = int(os.environ.get('IMAGE_CACHE_TTL_SECONDS', 600))
+    # Max dHash Hamming distance (of 64 bits) treated as the same photo; 0 (default) allows exact
+    # content matches only. Near-duplicate candidates must also have the same image size and no
+    # 64x64 grayscale thumbnail pixel differing by more than IMAGE_CACHE_MAX_PIXEL_DIFF.
+    IMAGE_CACHE_PHASH_DISTANCE = int(os.environ.get('IMAGE_CACHE_PHASH_DISTANCE', 0))
+    IMAGE_CACHE_MAX_PIXEL_DIFF = int(os.environ.get('IMAGE_CACHE_MAX_PIXEL_DIFF', 12))
+    # Face encoding cache keyed by face crop hash (per process); 0 disables it
+    ENCODING_CACHE_SIZE = int(os.environ.get('ENCODING_CACHE_SIZE', 2048))
+    # Face attribute (age/gender/emotion) result cache keyed by face crop hash (per process); 0 disables it
+    ATTRIBUTE_CACHE_SIZE = int(os.environ.get('ATTRIBUTE_CACHE_SIZE', 512))
+
+    # Face encoder settings per use case. More jitters give more stable enrollment encodings
+    # at the cost of speed; model is the landmark model used for alignment ('large' or 'small').
+    # The defaults are the legacy small/1 settings of the stored encodings: switching enrollment
+    # to e.g. large/5 changes the encoding version and needs `flask reencode-faces` (see below).
+    # The attendance model must equal the enrollment model; a different value is ignored.
+    FACE_ENCODER_ENROLLMENT_JITTERS = int(os.environ.get('FACE_ENCODER_ENROLLMENT_JITTERS', 1))
+    FACE_ENCODER_ENROLLMENT_MODEL = os.environ.get('FACE_ENCODER_ENROLLMENT_MODEL', 'small')
+    FACE_ENCODER_ATTENDANCE_JITTERS = int(os.environ.get('FACE_ENCODER_ATTENDANCE_JITTERS', 1))
+    FACE_ENCODER_ATTENDANCE_MODEL = os.environ.get('FACE_ENCODER_ATTENDANCE_MODEL', 'small')
+    # Version tag stored with every face encoding. When unset it is derived from the enrollment
+    # landmark model and jitters (e.g. 'dlib-large-j5'; 'dlib-v1' for the legacy small/1 settings),
+    # so changing them re-tags new encodings. Set it explicitly when the detector changes. Stored
+    # encodings of other versions are ignored by matching until `flask reencode-faces` migrates them.
+    FACE_ENCODING_VERSION = os.environ.get('FACE_ENCODING_VERSION') or None
+
+    # Enrollment photo quality gate, checked before encoding (single and bulk uploads)
+    ENROLLMENT_QUALITY_GATE = os.environ.get('ENROLLMENT_QUALITY_GATE', 'True').lower() in ('true', '1', 't')
+    ENROLLMENT_MIN_BLUR_SCORE = float(os.environ.get('ENROLLMENT_MIN_BLUR_SCORE', 60.0)) # Variance of the Laplacian
+    ENROLLMENT_MIN_FACE_SIZE = int(os.environ.get('ENROLLMENT_MIN_FACE_SIZE', 80)) # Pixels, shorter side of the face box
+    ENROLLMENT_MIN_BRIGHTNESS = float(os.environ.get('ENROLLMENT_MIN_BRIGHTNESS', 40.0)) # Mean gray level of the face
+    ENROLLMENT_MAX_BRIGHTNESS = float(os.environ.get('ENROLLMENT_MAX_BRIGHTNESS', 220.0))
+    ENROLLMENT_MAX_YAW = float(os.environ.get('ENROLLMENT_MAX_YAW', 0.25)) # Nose offset relative to eye distance
+    ENROLLMENT_MAX_ROLL_DEGREES = float(os.environ.get('ENROLLMENT_MAX_ROLL_DEGREES', 20.0))
+    # Distances to lower quality encodings are scaled by up to (1 + penalty) during matching
+    FACE_QUALITY_DISTANCE_PENALTY = float(os.environ.get('FACE_QUALITY_DISTANCE_PENALTY', 0.1))
+
+    # Per-student match thresholds learned from enrollment encodings and attendance history
+    # (flask calibrate-thresholds, manual attendance corrections); FACE_RECOGNITION_TOLERANCE is the fallback
+    FACE_THRESHOLD_MIN = float(os.environ.get('FACE_THRESHOLD_MIN', 0.4))
+    FACE_THRESHOLD_MAX = float(os.environ.get('FACE_THRESHOLD_MAX', 0.65))
+    FACE_THRESHOLD_PERCENTILE = float(os.environ.get('FACE_THRESHOLD_PERCENTILE', 95))
+    FACE_THRESHOLD_MARGIN = float(os.environ.get('FACE_THRESHOLD_MARGIN', 0.05))
+    FACE_THRESHOLD_MIN_SAMPLES = int(os.environ.get('FACE_THRESHOLD_MIN_SAMPLES', 5)) # Confirmed matches needed to learn from history
+
+    # Adaptive templates updated from confirmed attendance matches (reservoir of FACE_TEMPLATE_MAX per student)
+    FACE_TEMPLATE_UPDATES = os.environ.get('FACE_TEMPLATE_UPDATES', 'True').lower() in ('true', '1', 't')
+    FACE_TEMPLATE_MAX = int(os.environ.get('FACE_TEMPLATE_MAX', 5))
+    # Matches below this confidence wait for a teacher confirmation (manual attendance update)
+    FACE_TEMPLATE_MIN_CONFIDENCE = float(os.environ.get('FACE_TEMPLATE_MIN_CONFIDENCE', 0.55))
+
+    # Liveness (photo-of-photo) heuristics on attendance photo faces, before matching
+    ATTENDANCE_LIVENESS_CHECK = os.environ.get('ATTENDANCE_LIVENESS_CHECK', 'False').lower() in ('true', '1', 't')
+    LIVENESS_MOIRE_PEAK_RATIO = float(os.environ.get('LIVENESS_MOIRE_PEAK_RATIO', 12.0)) # Spectral peak / mean above this flags moire
+    LIVENESS_MIN_SIZE_RATIO = float(os.environ.get('LIVENESS_MIN_SIZE_RATIO', 0.5)) # Face size relative to the photo's median
+    LIVENESS_MIN_FACES_FOR_SIZE = int(os.environ.get('LIVENESS_MIN_FACES_FOR_SIZE', 3))
+
+    # Unmatched attendance faces clustered per course across sessions (see unknown_face_service)
+    UNKNOWN_FACE_TRACKING = os.environ.get('UNKNOWN_FACE_TRACKING', 'True').lower() in ('true', '1', 't')
+    UNKNOWN_FACE_CLUSTER_DISTANCE = float(os.environ.get('UNKNOWN_FACE_CLUSTER_DISTANCE', 0.5)) # Max distance to a cluster centroid
+    UNKNOWN_FACE_CLUSTER_MAX_FACES = int(os.environ.get('UNKNOWN_FACE_CLUSTER_MAX_FACES', 10)) # Sample faces kept per cluster
+    UNKNOWN_FACE_THUMBNAIL_SIZE = int(os.environ.get('UNKNOWN_FACE_THUMBNAIL_SIZE', 112))
+
+    # Bulk face enrollment from a ZIP archive (POST /api/students/faces/bulk, flask enroll-faces)
+    BULK_ENROLLMENT_MAX_FILES = int(os.environ.get('BULK_ENROLLMENT_MAX_FILES', 5000))
+    BULK_ENROLLMENT_MAX_FILE_BYTES = int(os.environ.get('BULK_ENROLLMENT_MAX_FILE_BYTES', 20 * 1024 * 1024))
+    BULK_ENROLLMENT_WORKERS = int(os.environ.get('BULK_ENROLLMENT_WORKERS', 0)) # 0 uses the CPU count
+
+    # Attributes analyzed in EMOTION/FACE_EMOTION sessions when neither the request nor the course specifies them
+    ATTENDANCE_DEFAULT_ATTRIBUTES = [a.strip() for a in os.environ.get('ATTENDANCE_DEFAULT_ATTRIBUTES', 'emotion').split(',') if a.strip()]
+
+    # Face attribute (age/gender/emotion) analysis backend: 'deepface' (TensorFlow) or 'onnx' (ONNX Runtime, CPU)
+    ATTRIBUTE_BACKEND = os.environ.get('ATTRIBUTE_BACKEND', 'deepface')
+    # ONNX backend: one model file per attribute; attributes without a model are returned as None
+    ATTRIBUTE_MODEL_DIR = os.environ.get('ATTRIBUTE_MODEL_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'models'))
+    ATTRIBUTE_ONNX_EMOTION_MODEL = os.environ.get('ATTRIBUTE_ONNX_EMOTION_MODEL', os.path.join(ATTRIBUTE_MODEL_DIR, 'emotion.onnx'))
+    ATTRIBUTE_ONNX_AGE_MODEL = os.environ.get('ATTRIBUTE_ONNX_AGE_MODEL', os.path.join(ATTRIBUTE_MODEL_DIR, 'age.onnx'))
+    ATTRIBUTE_ONNX_GENDER_MODEL = os.environ.get('ATTRIBUTE_ONNX_GENDER_MODEL', os.path.join(ATTRIBUTE_MODEL_DIR, 'gender.onnx'))
+    # Comma separated class labels in model output order (defaults: FER+ emotion, Woman/Man gender)
+    ATTRIBUTE_ONNX_EMOTION_LABELS = os.environ.get('ATTRIBUTE_ONNX_EMOTION_LABELS', 'neutral,happy,surprise,sad,angry,disgust,fear,contempt')
+    ATTRIBUTE_ONNX_GENDER_LABELS = os.environ.get('ATTRIBUTE_ONNX_GENDER_LABELS', 'Woman,Man')
+    # Multiplier applied to 0-255 pixel values before inference (FER+ expects raw values, most others 1/255)
+    ATTRIBUTE_ONNX_EMOTION_SCALE = float(os.environ.get('ATTRIBUTE_ONNX_EMOTION_SCALE', 1.0))
+    ATTRIBUTE_ONNX_AGE_SCALE = float(os.environ.get('ATTRIBUTE_ONNX_AGE_SCALE', 1.0 / 255))
+    ATTRIBUTE_ONNX_GENDER_SCALE = float(os.environ.get('ATTRIBUTE_ONNX_GENDER_SCALE', 1.0 / 255))
+    ATTRIBUTE_ONNX_THREADS = int(os.environ.get('ATTRIBUTE_ONNX_THREADS', 1))